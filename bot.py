@@ -14,7 +14,10 @@ from config import config
 from handlers import commands_router, photo_router, calendar_router
 from services import token_manager
 from services.scheduler import scheduler
-from services.instagram_publisher_async import InstagramPublisher
+from services.database import get_db
+from services.instagram_publisher_async import InstagramPublisher, close_client
+from services.steem_uploader import shutdown_steem_pool
+from services.webhook_handler import InstagramWebhookHandler
 
 # Configurazione logging
 logging.basicConfig(
@@ -25,26 +28,31 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+def create_instagram_publisher() -> InstagramPublisher:
+    """Crea un publisher con il token corrente (può essere stato rinnovato)"""
+    return InstagramPublisher(
+        access_token=config.instagram.access_token,
+        account_id=config.instagram.account_id,
+        api_version=config.instagram.graph_api_version
+    )
+
+
 async def publish_scheduled_posts(bot: Bot):
     """
     Task in background per pubblicare i post programmati
     """
     logger.info("🚀 Avvio task pubblicazione post programmati")
     
+    # Worker che pubblicano i post messi in coda
+    scheduler.start_workers(create_instagram_publisher)
+    
     while True:
         try:
-            # Controlla ogni minuto se ci sono post da pubblicare
-            await asyncio.sleep(60)  # 60 secondi
+            # Dorme fino al prossimo post programmato (svegliato da nuovi post)
+            await scheduler.wait_for_next_due()
             
-            # Crea istanza Instagram publisher
-            instagram = InstagramPublisher(
-                access_token=config.instagram.access_token,
-                account_id=config.instagram.account_id,
-                api_version=config.instagram.graph_api_version
-            )
-            
-            # Pubblica post scaduti
-            await scheduler.publish_due_posts(instagram)
+            # Prende in carico i post scaduti e li passa ai worker
+            await scheduler.dispatch_due_posts()
             
         except Exception as e:
             logger.error(f"Errore nel task scheduler: {e}")
@@ -68,7 +76,8 @@ async def on_startup(bot: Bot) -> None:
         webhook_url = f"{config.bot.webhook_url}{config.bot.webhook_path}"
         await bot.set_webhook(
             url=webhook_url,
-            drop_pending_updates=True
+            drop_pending_updates=True,
+            max_connections=config.bot.webhook_max_connections
         )
         logger.info(f"🌐 Webhook impostato: {webhook_url}")
     else:
@@ -102,28 +111,40 @@ async def on_shutdown(bot: Bot) -> None:
     """Callback eseguito allo shutdown del bot"""
     logger.info("👋 Shutdown bot...")
     
-    if config.bot.use_webhook:
-        await bot.delete_webhook()
-        logger.info("Webhook rimosso")
-    # cancel token refresh task
     try:
+        if config.bot.use_webhook:
+            await bot.delete_webhook()
+            logger.info("Webhook rimosso")
+        
+        # cancel token refresh task (gather assorbe il CancelledError, che non è un Exception)
         task = getattr(bot, '_token_refresh_task', None)
         if task:
             task.cancel()
-            await task
+            await asyncio.gather(task, return_exceptions=True)
             logger.info("Token refresh background task stopped")
-    except Exception:
-        logger.debug("Error stopping token refresh task")
-    
-    # cancel scheduler task
-    try:
+        
+        # cancel scheduler task
         task = getattr(bot, '_scheduler_task', None)
         if task:
             task.cancel()
-            await task
+            await asyncio.gather(task, return_exceptions=True)
             logger.info("Scheduler background task stopped")
-    except Exception:
-        logger.debug("Error stopping scheduler task")
+    finally:
+        # svuota la coda di pubblicazione e ferma i worker
+        try:
+            await scheduler.stop_workers()
+        except Exception:
+            logger.debug("Error stopping publish workers")
+        
+        # chiudi client HTTP Instagram condiviso
+        await close_client()
+        
+        # chiudi thread pool delle operazioni Steem
+        shutdown_steem_pool()
+        
+        # chiudi connessione database (solo se è stata aperta)
+        if get_db.cache_info().currsize:
+            get_db().close()
 
 
 async def main_polling():
@@ -182,6 +203,14 @@ async def main_webhook():
     # Setup applicazione
     setup_application(app, dp, bot=bot)
     
+    # Webhook eventi Instagram (commenti, menzioni) invece del polling
+    if config.instagram.webhook_verify_token and config.instagram.app_secret:
+        InstagramWebhookHandler(
+            app_secret=config.instagram.app_secret,
+            verify_token=config.instagram.webhook_verify_token
+        ).register(app, config.instagram.webhook_path)
+        logger.info(f"✅ Webhook Instagram: {config.instagram.webhook_path}")
+    
     # Health check endpoint
     async def health(request):
         return web.json_response({'status': 'ok', 'bot': 'running'})
@@ -207,8 +236,20 @@ async def main_webhook():
     await asyncio.Event().wait()
 
 
+def install_event_loop_policy():
+    """Usa uvloop come event loop se disponibile (non supportato su Windows)"""
+    try:
+        import uvloop
+    except ImportError:
+        logger.debug("uvloop non disponibile, uso event loop standard asyncio")
+        return
+    uvloop.install()
+    logger.info("⚡ Event loop: uvloop")
+
+
 def main():
     """Entry point"""
+    install_event_loop_policy()
     try:
         if config.bot.use_webhook:
             logger.info("🌐 Modalità: WEBHOOK")
@@ -18,6 +18,7 @@ class BotConfig:
     webhook_path: str
     web_app_host: str
     web_app_port: int
+    webhook_max_connections: int = 100
     
     @classmethod
     def from_env(cls):
@@ -28,7 +29,8 @@ class BotConfig:
             webhook_url=os.getenv('WEBHOOK_URL'),
             webhook_path=os.getenv('WEBHOOK_PATH', '/webhook'),
             web_app_host=os.getenv('WEB_APP_HOST', '0.0.0.0'),
-            web_app_port=int(os.getenv('WEB_APP_PORT', '8080'))
+            web_app_port=int(os.getenv('WEB_APP_PORT', '8080')),
+            webhook_max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '100'))
         )
 
 
@@ -61,6 +63,8 @@ class InstagramConfig:
     app_id: str | None = None
     app_secret: str | None = None
     auto_refresh_token: bool = False  # Disabilitato per default a causa di problemi configurazione app
+    webhook_verify_token: str | None = None  # Abilita il webhook eventi Instagram (richiede app_secret)
+    webhook_path: str = '/webhooks/instagram'
     
     @classmethod
     def from_env(cls):
@@ -71,7 +75,9 @@ class InstagramConfig:
             graph_api_version=os.getenv('FACEBOOK_GRAPH_API_VERSION', 'v23.0'),
             app_id=os.getenv('FACEBOOK_APP_ID'),
             app_secret=os.getenv('FACEBOOK_APP_SECRET'),
-            auto_refresh_token=os.getenv('AUTO_REFRESH_TOKEN', 'false').lower() == 'true'
+            auto_refresh_token=os.getenv('AUTO_REFRESH_TOKEN', 'false').lower() == 'true',
+            webhook_verify_token=os.getenv('INSTAGRAM_WEBHOOK_VERIFY_TOKEN'),
+            webhook_path=os.getenv('INSTAGRAM_WEBHOOK_PATH', '/webhooks/instagram')
         )
 
 
@@ -9,7 +9,7 @@ from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardBut
 from aiogram.filters import Command
 from aiogram.types import Message
 from services.scheduler import scheduler
-from services.database import db
+from services.database import get_db
 
 logger = logging.getLogger(__name__)
 
@@ -218,7 +218,7 @@ async def handle_calendar_callback(callback: CallbackQuery):
         selected_date = datetime(int(year), int(month), int(day))
 
         # Salva la data selezionata nel database
-        db.save_user_session(
+        get_db().save_user_session(
             user_id=user_id,
             selected_date=selected_date
         )
@@ -240,7 +240,7 @@ async def handle_time_callback(callback: CallbackQuery):
     user_id = callback.from_user.id
 
     # Recupera la sessione utente dal database
-    session = db.get_user_session(user_id)
+    session = get_db().get_user_session(user_id)
     
     if not session or not session.get('selected_date'):
         await callback.message.edit_text("❌ Errore: sessione scaduta. Riprova con /schedule")
@@ -263,7 +263,7 @@ async def handle_time_callback(callback: CallbackQuery):
 
     if data == "time_cancel":
         # Cancella sessione
-        db.clear_user_session(user_id)
+        get_db().clear_user_session(user_id)
         await callback.message.edit_text("❌ Programmazione annullata")
         await callback.answer()
         return
@@ -281,7 +281,7 @@ async def handle_time_callback(callback: CallbackQuery):
         scheduled_datetime = selected_date.replace(hour=selected_hour, minute=selected_minute)
         
         # Salva nel database
-        db.save_user_session(user_id=user_id, scheduled_datetime=scheduled_datetime)
+        get_db().save_user_session(user_id=user_id, scheduled_datetime=scheduled_datetime)
         
         text = (
             f"🕐 <b>Orario programmato:</b> {scheduled_datetime.strftime('%d/%m/%Y %H:%M')}\n\n"
@@ -299,7 +299,7 @@ async def handle_time_callback(callback: CallbackQuery):
         hour = int(data.split("_")[2])
         
         # Salva ora nel database
-        db.save_user_session(user_id=user_id, selected_hour=hour)
+        get_db().save_user_session(user_id=user_id, selected_hour=hour)
         
         text = (
             f"📅 Data selezionata: <b>{selected_date.strftime('%d/%m/%Y')}</b>\n\n"
@@ -323,7 +323,7 @@ async def handle_time_callback(callback: CallbackQuery):
             return
         
         # Salva minuti nel database
-        db.save_user_session(user_id=user_id, selected_minute=minute)
+        get_db().save_user_session(user_id=user_id, selected_minute=minute)
         
         text = (
             f"� Data selezionata: <b>{selected_date.strftime('%d/%m/%Y')}</b>\n\n"
@@ -352,6 +352,7 @@ async def handle_scheduled_refresh(callback: CallbackQuery):
     for post in posts:
         status_emoji = {
             'scheduled': '⏰',
+            'publishing': '🔄',
             'published': '✅',
             'failed': '❌',
             'cancelled': '🚫'
@@ -360,7 +361,9 @@ async def handle_scheduled_refresh(callback: CallbackQuery):
         scheduled_str = post['scheduled_time'].strftime('%d/%m/%Y %H:%M')
         text += f"{status_emoji} {scheduled_str}\n"
 
-        if post.get('status') == 'published' and post.get('instagram_media_id'):
+        if post.get('status') == 'published' and post.get('instagram_shortcode'):
+            text += f"   📸 https://www.instagram.com/p/{post['instagram_shortcode']}\n"
+        elif post.get('status') == 'published' and post.get('instagram_media_id'):
             text += f"   📸 Media ID: {post['instagram_media_id']}\n"
         elif post.get('status') == 'failed' and post.get('error_message'):
             error_msg = post['error_message'][:50]
@@ -172,6 +172,7 @@ async def cmd_scheduled(message: Message):
     for post in posts:
         status_emoji = {
             'scheduled': '⏰',
+            'publishing': '🔄',
             'published': '✅',
             'failed': '❌',
             'cancelled': '🚫'
@@ -180,7 +181,9 @@ async def cmd_scheduled(message: Message):
         scheduled_str = post['scheduled_time'].strftime('%d/%m/%Y %H:%M')
         text += f"{status_emoji} {scheduled_str}\n"
 
-        if post.get('status') == 'published' and post.get('instagram_media_id'):
+        if post.get('status') == 'published' and post.get('instagram_shortcode'):
+            text += f"   📸 https://www.instagram.com/p/{post['instagram_shortcode']}\n"
+        elif post.get('status') == 'published' and post.get('instagram_media_id'):
             text += f"   📸 Media ID: {post['instagram_media_id']}\n"
         elif post.get('status') == 'failed' and post.get('error_message'):
             error_msg = post['error_message'][:50]
@@ -5,6 +5,7 @@ import os
 import asyncio
 import logging
 from datetime import datetime
+import aiohttp
 from aiogram import Router, F
 from aiogram.types import Message, PhotoSize, Document
 from aiogram.exceptions import TelegramAPIError
@@ -12,7 +13,7 @@ from config import config
 from services.steem_uploader import SteemUploader
 from services.instagram_publisher_async import InstagramPublisher
 from services.scheduler import scheduler
-from services.database import db
+from services.database import get_db
 
 logger = logging.getLogger(__name__)
 
@@ -34,7 +35,45 @@ instagram_publisher = InstagramPublisher(
 )
 
 
-async def process_photo(message: Message, file_id: str, caption: str = ""):
+# Firme (magic bytes) delle immagini accettate
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG\r\n\x1a\n',   # PNG
+)
+
+# Dimensione massima documenti (20 MB, limite Bot API)
+MAX_DOCUMENT_SIZE = 20 * 1024 * 1024
+
+# Timeout per il download dei primi byte del documento
+SNIFF_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+
+async def sniff_image_header(bot, file_path: str) -> bool | None:
+    """
+    Scarica solo i primi 16 byte del file e verifica la firma immagine
+    
+    Args:
+        bot: Istanza Bot aiogram
+        file_path: Percorso file restituito da getFile
+    
+    Returns:
+        True se immagine, False se non lo è, None se la verifica non è possibile
+    """
+    url = bot.session.api.file_url(bot.token, file_path)
+    try:
+        # Sessione aiohttp del bot: riusa le connessioni già aperte verso Telegram
+        session = await bot.session.create_session()
+        async with session.get(url, headers={'Range': 'bytes=0-15'}, timeout=SNIFF_TIMEOUT) as response:
+            if response.status not in (200, 206):
+                return None
+            head = await response.content.read(16)
+        return head.startswith(IMAGE_SIGNATURES)
+    except Exception as e:
+        logger.warning("Verifica firma immagine non riuscita: %s", e)
+        return None
+
+
+async def process_photo(message: Message, file_id: str, caption: str = "", file=None):
     """
     Processa foto: download -> Steem -> Instagram (o scheduling)
     
@@ -42,24 +81,36 @@ async def process_photo(message: Message, file_id: str, caption: str = ""):
         message: Messaggio Telegram originale
         file_id: ID file Telegram
         caption: Caption della foto
+        file: Metadati file già ottenuti con get_file (opzionale)
     """
     user_id = message.from_user.id
     
     # Controlla se l'utente ha una sessione di programmazione attiva
-    session = db.get_user_session(user_id)
+    session = get_db().get_user_session(user_id)
     scheduled_datetime = None
     
     if session and session.get('scheduled_datetime'):
         scheduled_datetime = session['scheduled_datetime']
-        logger.info(f"Trovato datetime programmato per utente {user_id}: {scheduled_datetime}")
+        logger.info("Trovato datetime programmato per utente %s: %s", user_id, scheduled_datetime)
     
-    status_msg = await message.answer("📥 Sto scaricando la foto...")
+    bot = message.bot
+    if file is None:
+        # Messaggio di stato e metadati file sono chiamate indipendenti: in parallelo
+        status_msg, file = await asyncio.gather(
+            message.answer("📥 Sto scaricando la foto..."),
+            bot.get_file(file_id),
+            return_exceptions=True
+        )
+        if isinstance(status_msg, BaseException):
+            raise status_msg
+    else:
+        status_msg = await message.answer("📥 Sto scaricando la foto...")
     
     try:
         # 1. Download da Telegram
-        logger.info(f"Download file {file_id}")
-        bot = message.bot
-        file = await bot.get_file(file_id)
+        logger.info("Download file %s", file_id)
+        if isinstance(file, BaseException):
+            raise file
         
         # Crea directory temp se non esiste
         os.makedirs(config.temp_dir, exist_ok=True)
@@ -70,7 +121,7 @@ async def process_photo(message: Message, file_id: str, caption: str = ""):
         
         # Download file
         await bot.download_file(file.file_path, temp_path)
-        logger.info(f"File scaricato: {temp_path}")
+        logger.info("File scaricato: %s", temp_path)
         
         await status_msg.edit_text("⬆️ Sto caricando su blockchain...")
         
@@ -82,12 +133,12 @@ async def process_photo(message: Message, file_id: str, caption: str = ""):
             await status_msg.edit_text("❌ Errore durante l'upload su blockchain")
             return
         
-        logger.info(f"Immagine caricata: {image_url}")
+        logger.info("Immagine caricata: %s", image_url)
         
         # 3. Programma o pubblica il post
         if scheduled_datetime and scheduled_datetime > datetime.now():
             # Programma il post
-            logger.info(f"Programmazione post per {scheduled_datetime}")
+            logger.info("Programmazione post per %s", scheduled_datetime)
             await status_msg.edit_text(f"✅ Caricata su blockchain!\n\n⏰ Programmando post per {scheduled_datetime.strftime('%d/%m/%Y %H:%M')}...")
             
             post_id = scheduler.schedule_post(
@@ -134,15 +185,15 @@ async def process_photo(message: Message, file_id: str, caption: str = ""):
         # 4. Cleanup file temporaneo
         try:
             os.remove(temp_path)
-            logger.info(f"File temporaneo rimosso: {temp_path}")
+            logger.info("File temporaneo rimosso: %s", temp_path)
         except:
             pass
             
     except TelegramAPIError as e:
-        logger.error(f"Errore Telegram API: {e}")
+        logger.error("Errore Telegram API: %s", e)
         await status_msg.edit_text(f"❌ Errore Telegram: {str(e)}")
     except Exception as e:
-        logger.error(f"Errore processing foto: {e}", exc_info=True)
+        logger.error("Errore processing foto: %s", e, exc_info=True)
         await status_msg.edit_text(f"❌ Errore imprevisto: {str(e)}")
 
 
@@ -155,7 +206,7 @@ async def handle_photo(message: Message):
     # Estrai caption
     caption = message.caption or ""
     
-    logger.info(f"Ricevuta foto da {message.from_user.username}: {photo.file_id}")
+    logger.info("Ricevuta foto da %s: %s", message.from_user.username, photo.file_id)
     
     # Processa foto
     await process_photo(message, photo.file_id, caption)
@@ -173,18 +224,32 @@ async def handle_document(message: Message):
         return
     
     # Verifica dimensione (max 20 MB)
-    max_size = 20 * 1024 * 1024  # 20 MB
-    if document.file_size > max_size:
-        await message.answer(f"⚠️ File troppo grande (max 20 MB)")
+    if document.file_size and document.file_size > MAX_DOCUMENT_SIZE:
+        await message.answer("⚠️ File troppo grande (max 20 MB)")
+        return
+    
+    # Verifica firma reale del file (il MIME type può essere falsificato)
+    try:
+        file = await message.bot.get_file(document.file_id)
+    except TelegramAPIError as e:
+        logger.error("Errore Telegram API: %s", e)
+        await message.answer(f"❌ Errore Telegram: {str(e)}")
+        return
+    except Exception as e:
+        logger.error("Errore recupero documento: %s", e, exc_info=True)
+        await message.answer(f"❌ Errore imprevisto: {str(e)}")
+        return
+    if await sniff_image_header(message.bot, file.file_path) is False:
+        await message.answer("⚠️ Per favore invia un'immagine (JPG, PNG)")
         return
     
     # Estrai caption
     caption = message.caption or ""
     
-    logger.info(f"Ricevuto documento da {message.from_user.username}: {document.file_id}")
+    logger.info("Ricevuto documento da %s: %s", message.from_user.username, document.file_id)
     
     # Processa foto
-    await process_photo(message, document.file_id, caption)
+    await process_photo(message, document.file_id, caption, file=file)
 
 
 @photo_router.message()
@@ -12,26 +12,43 @@ Per configurare:
 2. pip install -r requirements.txt
 3. python main.py
 
+In produzione usa un server WSGI multi-thread invece del server di sviluppo:
+    gunicorn -k gthread -w 4 --threads 16 --timeout 120 main:app
+    waitress-serve --threads=32 main:app   (Windows)
+Con DEBUG=false, `python main.py` usa waitress automaticamente se installato.
+
 Endpoints:
 - GET / - Informazioni API
-- POST /upload - Upload file diretto
+- POST /upload - Upload file diretto (multipart, oppure application/octet-stream + X-Filename)
 - POST /upload-telegram - Upload da Telegram file_id
 - POST /upload-multiple - Upload multipli
+- POST /workflow/telegram-to-instagram - Workflow completo (asincrono, 202 + job_id)
+- GET /progress/<job_id> - Progresso workflow (Server-Sent Events)
 - GET /health - Stato servizio
 """
 
 import os
+import atexit
+import queue
+import time
+import uuid
+import hashlib
 import tempfile
+import threading
+import multiprocessing
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
-from PIL import Image
 import logging
 
 # Setup logging
@@ -44,9 +61,16 @@ logger = logging.getLogger(__name__)
 # Carica variabili d'ambiente
 load_dotenv()
 
+# orjson (opzionale) serializza le risposte JSON molto più velocemente dell'encoder standard
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Importa blockchain (assumendo struttura esistente)
 try:
-    from utils.steem_request import Blockchain
+    from utils.steem_request import Blockchain, init_upload_worker, upload_in_worker
+    from utils.image_verify import verify_image
 except ImportError:
     logger.error("❌ Impossibile importare Blockchain. Assicurati che il modulo utils.steem_request esista")
     exit(1)
@@ -71,47 +95,249 @@ INSTAGRAM_ACCOUNT_ID = os.getenv("INSTAGRAM_ACCOUNT_ID")
 API_HOST = os.getenv("API_HOST", "127.0.0.1")
 API_PORT = int(os.getenv("API_PORT", 5000))
 DEBUG_MODE = os.getenv("DEBUG", "True").lower() == "true"
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "32"))
+HEALTH_NODE_TTL = int(os.getenv("HEALTH_NODE_TTL", "15"))  # Secondi di validità del controllo nodo in /health
 
 # Configurazione file
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'})
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 TEMP_DIR = os.path.join(tempfile.gettempdir(), 'steem_uploads')
+UPLOAD_TIMEOUT = 120  # Secondi massimi di attesa per un singolo upload
+SPOOL_MAX_SIZE = 2 * 1024 * 1024  # Oltre questa soglia i download in memoria passano su disco
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB per blocco di download
+
+# Firme (magic bytes) dei formati accettati
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+)
+
+# Se true, verifica l'intero file immagine con Pillow (più lento); altrimenti solo i magic bytes
+STRICT_IMAGE_VALIDATION = os.getenv("STRICT_IMAGE_VALIDATION", "false").lower() == "true"
+# Processi per la verifica completa (solo con STRICT_IMAGE_VALIDATION; 0 = nel thread della richiesta)
+VALIDATE_PROCS = int(os.getenv('VALIDATE_PROCS', str(os.cpu_count() or 1)))
+
+# Configurazione concorrenza upload
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', '8'))
+# Upload blockchain in volo a livello di processo, da qualunque endpoint provengano
+MAX_INFLIGHT_UPLOADS = int(os.getenv('MAX_INFLIGHT_UPLOADS', os.getenv('MAX_CONCURRENT_UPLOADS', '16')))
+INFLIGHT_ACQUIRE_TIMEOUT = float(os.getenv('INFLIGHT_ACQUIRE_TIMEOUT', '5'))  # Oltre si risponde 429
+MAX_FILES_PER_REQUEST = int(os.getenv('MAX_FILES_PER_REQUEST', '10'))
+# Processi dedicati alla firma/upload blockchain (0 = esegui nel thread della richiesta)
+UPLOAD_PROCS = int(os.getenv('UPLOAD_PROCS', '0'))
+
+# Cache hash contenuto -> URL per non ricaricare immagini già inviate (es. retry di n8n)
+URL_CACHE_SIZE = int(os.getenv('URL_CACHE_SIZE', '10000'))
+URL_CACHE_TTL = int(os.getenv('URL_CACHE_TTL', str(24 * 3600)))
+
+# File temporanei riusati per gli upload diretti (0 = sempre file nuovi)
+TEMP_RING_SIZE = int(os.getenv('TEMP_RING_SIZE', str(2 * UPLOAD_WORKERS)))
 
 # Crea directory temporanea se non esiste
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider di Flask basato su orjson, usato da jsonify quando orjson è installato"""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 # Inizializza Flask
 app = Flask(__name__)
+if orjson:
+    app.json = OrjsonProvider(app)
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 CORS(app, origins="*")  # Abilita CORS per tutte le origini
 
+# Pool di thread condiviso per gli upload (riusato tra le richieste)
+UPLOAD_POOL = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='steem-upload')
+
+# Limita gli upload blockchain simultanei per non sovraccaricare il nodo
+UPLOAD_INFLIGHT = threading.BoundedSemaphore(MAX_INFLIGHT_UPLOADS)
+
+
+class UploadBusyError(Exception):
+    """Troppi upload blockchain in corso: il client deve riprovare più tardi (HTTP 429)"""
+
+# I pool di processi usano "spawn": nascono anche dai thread delle richieste e il fork di un
+# processo multithread può copiare nei figli lock già acquisiti (deadlock)
+MP_CONTEXT = multiprocessing.get_context('spawn')
+# Con spawn ogni worker riesegue questo modulo come __mp_main__: lì servono solo le funzioni
+# dei worker (utils.*), quindi Blockchain e file temporanei non vengono creati
+IS_POOL_WORKER = __name__ == '__mp_main__'
+
+# Pool di processi per gli upload, creato al primo utilizzo (vedi get_upload_proc_pool)
+_upload_proc_pool = None
+_upload_proc_pool_lock = threading.Lock()
+
+
+def get_upload_proc_pool():
+    """Restituisce il pool di processi per gli upload, o None se UPLOAD_PROCS=0"""
+    global _upload_proc_pool
+    if UPLOAD_PROCS <= 0:
+        return None
+    with _upload_proc_pool_lock:
+        if _upload_proc_pool is None:
+            _upload_proc_pool = MP_CONTEXT.Pool(
+                processes=UPLOAD_PROCS,
+                initializer=init_upload_worker,
+                initargs=('irreversible', STEEM_USERNAME, STEEM_WIF)
+            )
+            atexit.register(close_upload_proc_pool)
+            logger.info(f"✅ Pool processi upload avviato ({UPLOAD_PROCS} processi)")
+    return _upload_proc_pool
+
+
+def close_upload_proc_pool():
+    """Chiude il pool upload attendendo i worker (uscita regolare invece di terminate)"""
+    if _upload_proc_pool is not None:
+        _upload_proc_pool.close()
+        _upload_proc_pool.join()
+
+
+# Pool di processi per la verifica Pillow, creato al primo utilizzo (vedi get_validate_pool)
+_validate_pool = None
+
+
+def get_validate_pool() -> Optional[ProcessPoolExecutor]:
+    """Restituisce il pool di processi per la verifica immagini, o None se non usato"""
+    global _validate_pool
+    if not STRICT_IMAGE_VALIDATION or VALIDATE_PROCS <= 0:
+        return None
+    with _upload_proc_pool_lock:
+        if _validate_pool is None:
+            _validate_pool = ProcessPoolExecutor(max_workers=VALIDATE_PROCS, mp_context=MP_CONTEXT)
+            logger.info(f"✅ Pool processi validazione avviato ({VALIDATE_PROCS} processi)")
+    return _validate_pool
+
+
 # Inizializza blockchain
 try:
-    blockchain = Blockchain()
-    logger.info("✅ Blockchain inizializzata correttamente")
+    blockchain = None if IS_POOL_WORKER else Blockchain()
+    if blockchain:
+        atexit.register(blockchain.close)
+        logger.info("✅ Blockchain inizializzata correttamente")
 except Exception as e:
     logger.error(f"❌ Errore inizializzazione blockchain: {e}")
     blockchain = None
 
 
+def create_http_session() -> requests.Session:
+    """Crea una sessione HTTP con connection pooling e retry, condivisa tra i thread Flask"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=128,
+        max_retries=Retry(total=3, backoff_factor=0.2)
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Sessione HTTP condivisa (riusa connessioni TCP/TLS tra le richieste)
+http_session = create_http_session()
+
+
 class TelegramFileDownloader:
     """Gestisce il download di file da Telegram"""
     
-    def __init__(self, bot_token: str):
+    def __init__(self, bot_token: str, session: requests.Session = None):
         self.bot_token = bot_token
+        self.session = session or http_session
         self.base_url = f"https://api.telegram.org/bot{bot_token}"
         self.file_url = f"https://api.telegram.org/file/bot{bot_token}"
     
     def get_file_info(self, file_id: str) -> Dict[str, Any]:
         """Ottiene informazioni sul file da Telegram"""
         try:
-            response = requests.get(f"{self.base_url}/getFile", params={"file_id": file_id})
+            response = self.session.get(f"{self.base_url}/getFile", params={"file_id": file_id}, timeout=(5, 30))
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Errore ottenendo info file {file_id}: {e}")
             raise Exception(f"Impossibile ottenere informazioni file: {e}")
     
+    def check_file(self, file_id: str) -> Dict[str, Any]:
+        """
+        Ottiene le info del file da Telegram e lo rifiuta subito (dimensione o
+        estensione non ammesse) prima di aprire connessioni di download o buffer
+        
+        Returns:
+            dict: Campo "result" di getFile (file_path, file_size, ...)
+        """
+        file_info = self.get_file_info(file_id)
+        
+        if not file_info.get("ok"):
+            raise Exception(f"Errore API Telegram: {file_info.get('description', 'Unknown error')}")
+        
+        file_data = file_info["result"]
+        file_size = file_data.get("file_size") or 0
+        
+        # Controlla dimensione
+        if file_size > MAX_FILE_SIZE:
+            raise Exception(f"File troppo grande: {file_size} bytes (max: {MAX_FILE_SIZE})")
+        
+        # Controlla estensione prima di scaricare
+        file_extension = Path(file_data["file_path"]).suffix.lower().lstrip('.')
+        if file_extension and file_extension not in ALLOWED_EXTENSIONS:
+            raise Exception(f"Formato non supportato: {file_extension}")
+        
+        return file_data
+    
+    def _open_download(self, file_id: str, file_data: Dict[str, Any] = None) -> tuple[requests.Response, str]:
+        """
+        Apre lo stream di download (ottiene e controlla le info file se non già fornite)
+        
+        Returns:
+            tuple: (risposta_http_in_streaming, file_path_telegram)
+        """
+        file_path = (file_data or self.check_file(file_id))["file_path"]
+        
+        # Scarica il file
+        download_url = f"{self.file_url}/{file_path}"
+        response = self.session.get(download_url, stream=True, timeout=(5, 30))
+        response.raise_for_status()
+        
+        # Rifiuta subito se il server dichiara un contenuto troppo grande
+        content_length = response.headers.get('Content-Length')
+        if content_length and int(content_length) > MAX_FILE_SIZE:
+            response.close()
+            raise Exception(f"File troppo grande: {content_length} bytes (max: {MAX_FILE_SIZE})")
+        
+        return response, file_path
+    
+    @staticmethod
+    def _copy_stream(response: requests.Response, out) -> int:
+        """
+        Copia il corpo della risposta in out a blocchi da DOWNLOAD_CHUNK_SIZE,
+        interrompendo il download appena viene superato MAX_FILE_SIZE
+        
+        Returns:
+            int: Byte scritti
+        """
+        if response.headers.get('Content-Encoding', 'identity') == 'identity':
+            # Nessuna decodifica necessaria: legge direttamente dallo stream grezzo
+            chunks = iter(lambda: response.raw.read(DOWNLOAD_CHUNK_SIZE), b'')
+        else:
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        
+        written = 0
+        for chunk in chunks:
+            written += len(chunk)
+            if written > MAX_FILE_SIZE:
+                response.close()
+                raise Exception(f"File troppo grande: oltre {MAX_FILE_SIZE} bytes")
+            out.write(chunk)
+        return written
+    
     def download_file(self, file_id: str) -> tuple[str, str]:
         """
         Scarica un file da Telegram
@@ -120,24 +346,7 @@ class TelegramFileDownloader:
             tuple: (percorso_file_locale, nome_file_originale)
         """
         try:
-            # Ottiene informazioni sul file
-            file_info = self.get_file_info(file_id)
-            
-            if not file_info.get("ok"):
-                raise Exception(f"Errore API Telegram: {file_info.get('description', 'Unknown error')}")
-            
-            file_data = file_info["result"]
-            file_path = file_data["file_path"]
-            file_size = file_data.get("file_size", 0)
-            
-            # Controlla dimensione
-            if file_size > MAX_FILE_SIZE:
-                raise Exception(f"File troppo grande: {file_size} bytes (max: {MAX_FILE_SIZE})")
-            
-            # Scarica il file
-            download_url = f"{self.file_url}/{file_path}"
-            response = requests.get(download_url, stream=True)
-            response.raise_for_status()
+            response, file_path = self._open_download(file_id)
             
             # Genera nome file temporaneo
             file_extension = Path(file_path).suffix or '.jpg'
@@ -145,9 +354,13 @@ class TelegramFileDownloader:
             temp_path = os.path.join(TEMP_DIR, temp_filename)
             
             # Salva il file
-            with open(temp_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+            try:
+                with open(temp_path, 'wb') as f:
+                    self._copy_stream(response, f)
+            except Exception:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+                raise
             
             original_filename = Path(file_path).name
             logger.info(f"✅ File scaricato: {original_filename} -> {temp_path}")
@@ -157,6 +370,177 @@ class TelegramFileDownloader:
         except Exception as e:
             logger.error(f"Errore download file {file_id}: {e}")
             raise
+    
+    def download_to_buffer(self, file_id: str, file_data: Dict[str, Any] = None) -> tuple[tempfile.SpooledTemporaryFile, str, int]:
+        """
+        Scarica un file da Telegram in memoria (su disco solo oltre SPOOL_MAX_SIZE)
+        
+        Args:
+            file_id: File ID Telegram
+            file_data: Info già ottenute con check_file (evita una seconda chiamata getFile)
+        
+        Returns:
+            tuple: (buffer_posizionato_all_inizio, nome_file_originale, dimensione_bytes)
+        """
+        try:
+            file_data = file_data or self.check_file(file_id)
+            response, file_path = self._open_download(file_id, file_data)
+            
+            # Se Telegram dichiara già un file grande si scrive subito su disco,
+            # senza riempire un buffer in memoria da riversare poi al superamento della soglia
+            if (file_data.get("file_size") or 0) > SPOOL_MAX_SIZE:
+                buffer = tempfile.TemporaryFile(dir=TEMP_DIR)
+            else:
+                buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=TEMP_DIR)
+            try:
+                size = self._copy_stream(response, buffer)
+                buffer.seek(0)
+            except Exception:
+                buffer.close()
+                raise
+            
+            original_filename = Path(file_path).name
+            logger.info(f"✅ File scaricato in memoria: {original_filename} ({size} bytes)")
+            
+            return buffer, original_filename, size
+            
+        except Exception as e:
+            logger.error(f"Errore download file {file_id}: {e}")
+            raise
+
+
+def sniff_image_format(head: bytes) -> Optional[str]:
+    """
+    Riconosce il formato immagine dai magic bytes iniziali
+    
+    Returns:
+        str: Formato (JPEG, PNG, GIF, WEBP, BMP) o None se non riconosciuto
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+class TempFileRing:
+    """
+    Insieme fisso di file temporanei in TEMP_DIR riusati tra le richieste.
+    Evita creazione/cancellazione di un inode per ogni upload: al rilascio il file
+    viene solo troncato e rimesso in coda. Se sono tutti occupati si usa un file nuovo.
+    """
+    
+    def __init__(self, directory: str, size: int):
+        self.directory = directory
+        self._free: queue.Queue = queue.Queue()
+        self._members = set()
+        for index in range(size):
+            path = os.path.join(directory, f'ring-{os.getpid()}-{index}.tmp')
+            open(path, 'wb').close()
+            self._members.add(path)
+            self._free.put(path)
+    
+    def acquire(self) -> str:
+        """Restituisce un percorso libero (dal ring o, se esaurito, un file univoco)"""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return self.unique_path()
+    
+    def unique_path(self) -> str:
+        """Percorso di un file univoco, fuori dal ring"""
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}.tmp")
+    
+    def detach(self, path: str) -> str:
+        """
+        Sposta il contenuto di path in un file univoco, di proprietà del chiamante.
+        Un membro del ring viene ricreato vuoto, quindi release(path) resta valido.
+        """
+        detached = self.unique_path()
+        os.replace(path, detached)
+        if path in self._members:
+            open(path, 'wb').close()
+        return detached
+    
+    @staticmethod
+    def remove(path: str):
+        """Elimina un file univoco ignorando gli errori"""
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    
+    def release(self, path: str):
+        """Restituisce il file al ring troncandolo, oppure lo elimina se non ne fa parte"""
+        try:
+            if path in self._members:
+                os.truncate(path, 0)
+                self._free.put(path)
+            elif os.path.exists(path):
+                os.unlink(path)
+            logger.debug(f"🧹 File temporaneo rilasciato: {path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Impossibile rilasciare file temporaneo {path}: {e}")
+    
+    def close(self):
+        """Elimina i file del ring (chiamato all'uscita del processo)"""
+        for path in self._members:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+# Nei worker dei pool (terminati senza atexit) il ring resta vuoto: nessun file da perdere
+temp_files = TempFileRing(TEMP_DIR, 0 if IS_POOL_WORKER else TEMP_RING_SIZE)
+atexit.register(temp_files.close)
+
+
+class UploadUrlCache:
+    """
+    Cache LRU con scadenza: SHA-256 del contenuto -> URL dell'immagine su Steem.
+    Un'immagine già caricata restituisce subito l'URL esistente senza nuovo broadcast.
+    """
+    
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def digest_file(file_path: str) -> str:
+        """Calcola lo SHA-256 di un file leggendolo a blocchi da 1MB"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """Restituisce l'URL in cache o None se assente/scaduto"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            url, expires = item
+            if time.monotonic() > expires:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return url
+    
+    def put(self, key: str, url: str):
+        """Salva l'URL, scartando la voce meno recente oltre maxsize"""
+        with self._lock:
+            self._items[key] = (url, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+url_cache = UploadUrlCache(URL_CACHE_SIZE, URL_CACHE_TTL)
 
 
 class ImageUploadService:
@@ -168,6 +552,18 @@ class ImageUploadService:
         self.wif = STEEM_WIF
         self.telegram_downloader = TelegramFileDownloader(TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
     
+    def prefetch_node(self):
+        """
+        Avvia in background la scelta del nodo Steem se non ancora fatta,
+        così la RPC di test dei nodi si sovrappone al download da Telegram.
+        
+        Returns:
+            Future del warm-up, o None se non necessario
+        """
+        if not self.blockchain or self.blockchain.steem_node or get_upload_proc_pool():
+            return None
+        return UPLOAD_POOL.submit(self.blockchain.update_node)
+    
     def validate_config(self) -> bool:
         """Verifica configurazione"""
         if not self.username or self.username == "your_username_here":
@@ -178,90 +574,340 @@ class ImageUploadService:
             return False
         return True
     
-    def validate_image_file(self, file_path: str) -> bool:
-        """Valida se il file è un'immagine valida"""
+    def _check_image(self, source, filename: str, file_size: int) -> Dict[str, Any]:
+        """
+        Controlla estensione, dimensione e header di un'immagine (path o file-like)
+        
+        Returns:
+            dict: Metadati immagine (format, size_bytes)
+        """
+        # Controlla estensione (prima di aprire il file)
+        file_extension = Path(filename).suffix.lower().lstrip('.')
+        if file_extension not in ALLOWED_EXTENSIONS:
+            raise Exception(f"Formato non supportato: {file_extension}")
+        
+        # Controlla dimensioni
+        if file_size > MAX_FILE_SIZE:
+            raise Exception(f"File troppo grande: {file_size} bytes")
+        
+        # Legge solo i primi byte; la verifica completa con Pillow è opzionale
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                head = f.read(32)
+        else:
+            head = source.read(32)
+            source.seek(0)
+        
+        image_format = sniff_image_format(head)
+        if not image_format:
+            raise Exception("Il contenuto non è un'immagine supportata")
+        
+        if STRICT_IMAGE_VALIDATION:
+            # I file su disco si verificano in un processo separato (si passa solo il percorso),
+            # così upload multipli sfruttano tutti i core; i buffer in memoria restano nel thread
+            pool = get_validate_pool()
+            if pool is not None and isinstance(source, str):
+                pool.submit(verify_image, source).result(timeout=UPLOAD_TIMEOUT)
+            else:
+                verify_image(source)
+        
+        return {
+            "format": image_format,
+            "size_bytes": file_size
+        }
+    
+    def validate_image_file(self, file_path: str, filename: str = None) -> Dict[str, Any]:
+        """Valida se il file è un'immagine valida e ne restituisce i metadati"""
         try:
-            # Controlla estensione
-            file_extension = Path(file_path).suffix.lower().lstrip('.')
-            if file_extension not in ALLOWED_EXTENSIONS:
-                raise Exception(f"Formato non supportato: {file_extension}")
-            
-            # Verifica che sia un'immagine leggibile
-            with Image.open(file_path) as img:
-                img.verify()
-            
-            # Controlla dimensioni
-            file_size = os.path.getsize(file_path)
-            if file_size > MAX_FILE_SIZE:
-                raise Exception(f"File troppo grande: {file_size} bytes")
-            
-            return True
-            
+            return self._check_image(file_path, filename or file_path, os.path.getsize(file_path))
         except Exception as e:
             logger.error(f"Validazione fallita per {file_path}: {e}")
             raise Exception(f"File non valido: {e}")
     
-    def upload_to_steem(self, file_path: str, cleanup: bool = True) -> Dict[str, Any]:
-        """Carica immagine su Steem/Hive"""
+    def validate_image_buffer(self, buffer, filename: str, file_size: int) -> Dict[str, Any]:
+        """Valida un'immagine già in memoria, lasciando il buffer posizionato all'inizio"""
+        try:
+            buffer.seek(0)
+            info = self._check_image(buffer, filename, file_size)
+            buffer.seek(0)
+            return info
+        except Exception as e:
+            logger.error(f"Validazione fallita per {filename}: {e}")
+            raise Exception(f"File non valido: {e}")
+    
+    def _blockchain_upload(self, source, image_name: str = None) -> Any:
+        """Esegue l'upload blockchain nel pool di processi se configurato, altrimenti nel thread corrente"""
+        pool = get_upload_proc_pool()
+        if not UPLOAD_INFLIGHT.acquire(timeout=INFLIGHT_ACQUIRE_TIMEOUT):
+            raise UploadBusyError("Troppi upload in corso, riprova tra poco")
+        try:
+            if pool is not None:
+                # Il worker riceve un percorso (niente pickle dell'immagine) di un file tutto suo,
+                # eliminato solo a task concluso: dopo un timeout il task può essere ancora in coda,
+                # mentre il file di ring del chiamante torna libero per altre richieste
+                if isinstance(source, bytes):
+                    worker_path = temp_files.unique_path()
+                    with open(worker_path, 'wb') as f:
+                        f.write(source)
+                else:
+                    worker_path = temp_files.detach(source)
+                cleanup = lambda _: temp_files.remove(worker_path)
+                try:
+                    # Credenziali già impostate nei worker dall'initializer
+                    async_result = pool.apply_async(
+                        upload_in_worker, (worker_path,), {'image_name': image_name},
+                        callback=cleanup, error_callback=cleanup
+                    )
+                except Exception:
+                    temp_files.remove(worker_path)
+                    raise
+                return async_result.get(timeout=UPLOAD_TIMEOUT)
+            return self.blockchain.steem_upload_image(source, self.username, self.wif, image_name=image_name)
+        finally:
+            UPLOAD_INFLIGHT.release()
+    
+    @staticmethod
+    def _extract_url(result: Any) -> str:
+        """Estrae URL dal risultato dell'upload blockchain"""
+        if isinstance(result, dict) and 'url' in result:
+            return result['url']
+        if isinstance(result, str):
+            return result
+        return str(result)
+    
+    def upload_to_steem(self, file_path: str, cleanup: bool = True, image_name: str = None,
+                        content_hash: str = None) -> Dict[str, Any]:
+        """
+        Carica immagine su Steem/Hive
+        
+        Args:
+            file_path: Percorso del file da caricare
+            cleanup: Se True rilascia/elimina il file al termine
+            image_name: Nome con cui caricare l'immagine (default: nome del file)
+            content_hash: SHA-256 già calcolato durante il salvataggio (evita di rileggere il file)
+        """
+        filename = image_name or Path(file_path).name
         try:
             if not self.validate_config():
                 raise Exception("Configurazione non valida - controlla STEEM_USERNAME e STEEM_WIF")
             
             # Valida immagine
-            self.validate_image_file(file_path)
+            image_info = self.validate_image_file(file_path, filename)
             
-            # Upload su blockchain
-            logger.info(f"📤 Upload {Path(file_path).name} su blockchain...")
-            result = self.blockchain.steem_upload_image(file_path, self.username, self.wif)
+            # Immagine già caricata di recente?
+            content_hash = content_hash or url_cache.digest_file(file_path)
+            image_url = url_cache.get(content_hash)
             
-            # Estrae URL dal risultato
-            if isinstance(result, dict) and 'url' in result:
-                image_url = result['url']
-            elif isinstance(result, str):
-                image_url = result
+            if image_url:
+                logger.info(f"♻️ Immagine già caricata, riuso URL: {image_url}")
             else:
-                image_url = str(result)
-            
-            logger.info(f"✅ Upload completato: {image_url}")
+                # Upload su blockchain
+                logger.info(f"📤 Upload {filename} su blockchain...")
+                result = self._blockchain_upload(file_path, image_name=filename)
+                
+                # Estrae URL dal risultato
+                image_url = self._extract_url(result)
+                url_cache.put(content_hash, image_url)
+                
+                logger.info(f"✅ Upload completato: {image_url}")
             
             return {
                 "success": True,
                 "url": image_url,
-                "filename": Path(file_path).name,
-                "size_bytes": os.path.getsize(file_path),
+                "filename": filename,
+                "size_bytes": image_info["size_bytes"],
                 "uploaded_by": self.username,
                 "timestamp": datetime.now().isoformat()
             }
             
+        except UploadBusyError:
+            raise
         except Exception as e:
             logger.error(f"❌ Errore upload {file_path}: {e}")
             raise Exception(f"Upload fallito: {e}")
         
         finally:
             # Pulizia file temporaneo
-            if cleanup and os.path.exists(file_path):
-                try:
-                    os.unlink(file_path)
-                    logger.debug(f"🧹 File temporaneo eliminato: {file_path}")
-                except Exception as e:
-                    logger.warning(f"⚠️ Impossibile eliminare file temporaneo {file_path}: {e}")
+            if cleanup:
+                temp_files.release(file_path)
+    
+    def upload_to_steem_buffer(self, buffer, filename: str, file_size: int) -> Dict[str, Any]:
+        """Carica su Steem/Hive un'immagine già in memoria, senza passare dal disco"""
+        try:
+            if not self.validate_config():
+                raise Exception("Configurazione non valida - controlla STEEM_USERNAME e STEEM_WIF")
+            
+            # Valida immagine
+            self.validate_image_buffer(buffer, filename, file_size)
+            
+            image_data = buffer.read()
+            content_hash = hashlib.sha256(image_data).hexdigest()
+            image_url = url_cache.get(content_hash)
+            
+            if image_url:
+                logger.info(f"♻️ Immagine già caricata, riuso URL: {image_url}")
+            else:
+                # Upload su blockchain
+                logger.info(f"📤 Upload {filename} su blockchain...")
+                result = self._blockchain_upload(image_data, image_name=filename)
+                
+                image_url = self._extract_url(result)
+                url_cache.put(content_hash, image_url)
+                logger.info(f"✅ Upload completato: {image_url}")
+            
+            return {
+                "success": True,
+                "url": image_url,
+                "filename": filename,
+                "size_bytes": file_size,
+                "uploaded_by": self.username,
+                "timestamp": datetime.now().isoformat()
+            }
+            
+        except UploadBusyError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Errore upload {filename}: {e}")
+            raise Exception(f"Upload fallito: {e}")
+        
+        finally:
+            buffer.close()
+
+
+class NodeHealthCache:
+    """
+    Cache del controllo nodo blockchain usato da /health.
+    Il controllo (ping RPC del nodo) gira in un thread daemon: /health non attende mai la RPC.
+    """
+    
+    def __init__(self, blockchain_instance, ttl: int):
+        self.blockchain = blockchain_instance
+        self.ttl = ttl
+        self.last_ok_ts = 0.0
+        self.last_error: Optional[str] = None
+        # False finché il primo controllo non è concluso (stato "pending", non un errore)
+        self.checked = False
+        self._refreshing = False
+        self._lock = threading.Lock()
+    
+    def _refresh(self):
+        """Interroga il nodo corrente con una RPC leggera e salva l'esito"""
+        try:
+            if not self.blockchain.ping_node():
+                raise Exception(f"Il nodo {self.blockchain.steem_node} non risponde alle RPC")
+            self.last_ok_ts = time.monotonic()
+            self.last_error = None
+        except Exception as e:
+            logger.warning(f"⚠️ Controllo nodo blockchain fallito: {e}")
+            self.last_error = str(e)
+        finally:
+            self.checked = True
+            with self._lock:
+                self._refreshing = False
+    
+    def refresh_async(self):
+        """Avvia un aggiornamento in background se non già in corso"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='health-node-refresh', daemon=True).start()
+    
+    def check(self) -> Optional[str]:
+        """
+        Restituisce l'ultimo esito noto senza bloccare
+        
+        Returns:
+            None se il nodo è raggiungibile, altrimenti il messaggio di errore
+        """
+        if time.monotonic() - self.last_ok_ts > self.ttl:
+            self.refresh_async()
+        return self.last_error
+
+
+def copy_hashed(src, temp_path: str) -> str:
+    """
+    Copia uno stream in temp_path a blocchi da 1MB calcolando intanto lo SHA-256,
+    così salvataggio e hash del contenuto avvengono in un solo passaggio.
+    
+    Returns:
+        str: SHA-256 esadecimale del contenuto
+    
+    Raises:
+        Exception: Se il contenuto supera MAX_FILE_SIZE
+    """
+    digest = hashlib.sha256()
+    size = 0
+    out_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0), 0o600)
+    with os.fdopen(out_fd, 'wb') as out:
+        for block in iter(lambda: src.read(DOWNLOAD_CHUNK_SIZE), b''):
+            size += len(block)
+            if size > MAX_FILE_SIZE:
+                raise Exception(f"File troppo grande: oltre {MAX_FILE_SIZE} bytes")
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest()
+
+
+def save_upload(file, temp_path: str) -> str:
+    """
+    Salva un file caricato (FileStorage) in temp_path
+    
+    Returns:
+        str: SHA-256 esadecimale del contenuto
+    """
+    file.stream.seek(0)
+    return copy_hashed(file.stream, temp_path)
 
 
 # Inizializza servizio
 upload_service = ImageUploadService()
+node_health = NodeHealthCache(blockchain, HEALTH_NODE_TTL) if blockchain else None
+if node_health:
+    # Primo controllo subito: il primo /health dopo l'avvio non deve attenderlo né fallire
+    node_health.refresh_async()
+
+# Client Instagram/Telegram condivisi tra le richieste (nessuno stato mutabile: thread-safe)
+INSTA_PUB = InstagramPublisher(
+    access_token=INSTAGRAM_ACCESS_TOKEN,
+    instagram_account_id=INSTAGRAM_ACCOUNT_ID
+) if (INSTAGRAM_AVAILABLE and INSTAGRAM_ACCESS_TOKEN and INSTAGRAM_ACCOUNT_ID) else None
+TELEGRAM_REPLY = TelegramHandler(TELEGRAM_BOT_TOKEN, session=http_session) if (INSTAGRAM_AVAILABLE and TELEGRAM_BOT_TOKEN) else None
+
+
+def busy_response(error: UploadBusyError):
+    """Risposta 429 quando il limite di upload in volo è raggiunto"""
+    return jsonify({
+        'success': False,
+        'error': str(error)
+    }), 429, {'Retry-After': str(int(INFLIGHT_ACQUIRE_TIMEOUT))}
 
 
 def allowed_file(filename: str) -> bool:
     """Verifica se il file ha estensione supportata"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    i = filename.rfind('.')
+    return i >= 0 and filename[i + 1:].lower() in ALLOWED_EXTENSIONS
 
 
-@app.route('/')
-def home():
-    """Endpoint informazioni API"""
+def make_image_name(filename: str) -> str:
+    """
+    Genera un nome immagine univoco con l'estensione del file caricato.
+    Il nome originale non viene usato, quindi non serve secure_filename
+    (l'estensione è già stata validata da allowed_file).
+    """
+    extension = filename[filename.rfind('.'):].lower()
+    return f"{uuid.uuid4().hex}{extension}"
+
+
+# Corpo della risposta di / serializzato una sola volta (la configurazione non cambia a runtime)
+_home_body: Optional[str] = None
+
+
+def build_home_info() -> Dict[str, Any]:
+    """Informazioni statiche dell'API mostrate da /"""
     config_valid = upload_service.validate_config()
     
-    return jsonify({
+    return {
         'service': 'Steem/Hive Image Upload API',
         'version': '2.0.0',
         'status': 'running',
@@ -275,7 +921,7 @@ def home():
         'limits': {
             'max_file_size_mb': MAX_FILE_SIZE // (1024 * 1024),
             'supported_formats': list(ALLOWED_EXTENSIONS),
-            'max_multiple_files': 10
+            'max_multiple_files': MAX_FILES_PER_REQUEST
         },
         'endpoints': {
             'upload_file': 'POST /upload',
@@ -291,7 +937,16 @@ def home():
             'enabled': bool(TELEGRAM_BOT_TOKEN),
             'bot_configured': bool(TELEGRAM_BOT_TOKEN)
         }
-    })
+    }
+
+
+@app.route('/')
+def home():
+    """Endpoint informazioni API"""
+    global _home_body
+    if _home_body is None:
+        _home_body = app.json.dumps(build_home_info())
+    return Response(_home_body, mimetype='application/json')
 
 
 @app.route('/upload', methods=['POST'])
@@ -304,30 +959,42 @@ def upload_file():
                 'error': 'Servizio non configurato - controlla STEEM_USERNAME e STEEM_WIF'
             }), 500
         
-        # Controllo file
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'error': 'Nessun file fornito'}), 400
+        # Corpo binario (Content-Type: application/octet-stream): lo stream della richiesta
+        # va direttamente nel file temporaneo, senza il buffer multipart di Werkzeug
+        raw_body = request.mimetype == 'application/octet-stream'
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'success': False, 'error': 'Nessun file selezionato'}), 400
+        if raw_body:
+            filename = request.headers.get('X-Filename') or request.args.get('filename', '')
+            if not filename:
+                return jsonify({'success': False, 'error': 'Nome file richiesto (header X-Filename o parametro filename)'}), 400
+        else:
+            # Controllo file
+            if 'file' not in request.files:
+                return jsonify({'success': False, 'error': 'Nessun file fornito'}), 400
+            
+            file = request.files['file']
+            filename = file.filename
+            if filename == '':
+                return jsonify({'success': False, 'error': 'Nessun file selezionato'}), 400
         
-        if not allowed_file(file.filename):
+        if not allowed_file(filename):
             return jsonify({
                 'success': False, 
                 'error': f'Formato non supportato. Supportati: {", ".join(ALLOWED_EXTENSIONS)}'
             }), 400
         
-        # Salva temporaneamente
-        filename = secure_filename(file.filename)
-        file_extension = Path(filename).suffix
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension, dir=TEMP_DIR)
-        temp_path = temp_file.name
-        
-        file.save(temp_path)
+        # Salva temporaneamente calcolando l'hash del contenuto
+        temp_path = temp_files.acquire()
+        try:
+            content_hash = copy_hashed(request.stream, temp_path) if raw_body else save_upload(file, temp_path)
+        except Exception:
+            temp_files.release(temp_path)
+            raise
         
         # Upload
-        result = upload_service.upload_to_steem(temp_path)
+        result = upload_service.upload_to_steem(
+            temp_path, image_name=make_image_name(filename), content_hash=content_hash
+        )
         
         return jsonify({
             'success': True,
@@ -335,6 +1002,8 @@ def upload_file():
             'data': result
         })
         
+    except UploadBusyError as e:
+        return busy_response(e)
     except Exception as e:
         return jsonify({
             'success': False,
@@ -370,10 +1039,10 @@ def upload_telegram():
         
         # Scarica da Telegram
         logger.info(f"📥 Download file da Telegram: {file_id}")
-        temp_path, original_filename = upload_service.telegram_downloader.download_file(file_id)
+        buffer, original_filename, file_size = upload_service.telegram_downloader.download_to_buffer(file_id)
         
         # Upload su blockchain
-        result = upload_service.upload_to_steem(temp_path)
+        result = upload_service.upload_to_steem_buffer(buffer, original_filename, file_size)
         result['original_filename'] = original_filename
         result['telegram_file_id'] = file_id
         
@@ -383,6 +1052,8 @@ def upload_telegram():
             'data': result
         })
         
+    except UploadBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Errore upload Telegram: {e}")
         return jsonify({
@@ -405,12 +1076,15 @@ def upload_multiple():
         if not files or len(files) == 0:
             return jsonify({'success': False, 'error': 'Nessun file fornito'}), 400
         
-        if len(files) > 10:
-            return jsonify({'success': False, 'error': 'Massimo 10 file per volta'}), 400
+        if len(files) > MAX_FILES_PER_REQUEST:
+            return jsonify({'success': False, 'error': f'Massimo {MAX_FILES_PER_REQUEST} file per volta'}), 400
         
         results = []
         errors = []
+        pending = []
+        busy_error = None
         
+        # Salva i file e invia gli upload al pool condiviso
         for file in files:
             try:
                 if file.filename == '' or not allowed_file(file.filename):
@@ -421,16 +1095,18 @@ def upload_multiple():
                     continue
                 
                 # Salva temporaneamente
-                filename = secure_filename(file.filename)
-                file_extension = Path(filename).suffix
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_extension, dir=TEMP_DIR)
-                temp_path = temp_file.name
-                
-                file.save(temp_path)
+                temp_path = temp_files.acquire()
+                try:
+                    content_hash = save_upload(file, temp_path)
+                except Exception:
+                    temp_files.release(temp_path)
+                    raise
                 
-                # Upload
-                result = upload_service.upload_to_steem(temp_path)
-                results.append(result)
+                # Upload (in parallelo)
+                pending.append((file.filename, UPLOAD_POOL.submit(
+                    upload_service.upload_to_steem, temp_path,
+                    image_name=make_image_name(file.filename), content_hash=content_hash
+                )))
                 
             except Exception as e:
                 errors.append({
@@ -438,6 +1114,26 @@ def upload_multiple():
                     'error': str(e)
                 })
         
+        # Raccogli i risultati nell'ordine di invio
+        for filename, future in pending:
+            try:
+                results.append(future.result(timeout=UPLOAD_TIMEOUT))
+            except UploadBusyError as e:
+                busy_error = e
+                errors.append({
+                    'filename': filename or 'unknown',
+                    'error': str(e)
+                })
+            except Exception as e:
+                errors.append({
+                    'filename': filename or 'unknown',
+                    'error': str(e)
+                })
+        
+        # Nessun upload accettato per saturazione: il client deve riprovare
+        if busy_error and not results:
+            return busy_response(busy_error)
+        
         return jsonify({
             'success': len(errors) == 0,
             'message': f'Processati {len(files)} file. {len(results)} successi, {len(errors)} errori',
@@ -475,20 +1171,24 @@ def health_check():
                 }
             }), 500
         
-        # Test connessione blockchain
-        blockchain.update_node()
+        # Test connessione blockchain (esito in cache, aggiornato in background)
+        node_error = node_health.check()
+        if node_error:
+            raise Exception(node_error)
         
         return jsonify({
-            'status': 'healthy',
+            # "pending" finché il primo controllo del nodo avviato all'avvio non è concluso
+            'status': 'healthy' if node_health.checked else 'pending',
             'timestamp': datetime.now().isoformat(),
             'checks': {
                 'config': True,
-                'blockchain': True,
+                'blockchain': True if node_health.checked else None,
                 'telegram': bool(TELEGRAM_BOT_TOKEN),
                 'instagram': bool(INSTAGRAM_ACCESS_TOKEN and INSTAGRAM_ACCOUNT_ID)
             },
             'info': {
                 'username': upload_service.username,
+                'steem_node': blockchain.steem_node,
                 'temp_dir': TEMP_DIR,
                 'max_file_size_mb': MAX_FILE_SIZE // (1024 * 1024)
             }
@@ -534,15 +1234,9 @@ def publish_instagram():
                 'error': 'image_url richiesto nel body JSON, form data o query params'
             }), 400
         
-        # Inizializza publisher
-        publisher = InstagramPublisher(
-            access_token=INSTAGRAM_ACCESS_TOKEN,
-            instagram_account_id=INSTAGRAM_ACCOUNT_ID
-        )
-        
         # Pubblica su Instagram
         logger.info(f"📸 Pubblicazione Instagram: {image_url}")
-        result = publisher.publish_photo(image_url, caption)
+        result = INSTA_PUB.publish_photo(image_url, caption)
         
         if result.get('success'):
             return jsonify({
@@ -564,11 +1258,188 @@ def publish_instagram():
         }), 500
 
 
+def run_workflow(file_id: str, caption: str = '', chat_id: Optional[str] = None,
+                 on_step: Optional[Callable[[Dict[str, Any]], None]] = None) -> tuple[Dict[str, Any], int]:
+    """
+    Esegue il workflow Telegram → Steem → Instagram → Reply
+    
+    Args:
+        file_id: File ID Telegram
+        caption: Didascalia del post Instagram
+        chat_id: Chat a cui inviare la conferma (opzionale)
+        on_step: Callback invocata con ogni step completato (per il progresso SSE)
+    
+    Returns:
+        tuple: (risultato_workflow, status_code_http)
+    """
+    workflow_result = {
+        'success': False,
+        'steps': []
+    }
+    
+    def add_step(step: Dict[str, Any]):
+        workflow_result['steps'].append(step)
+        if on_step:
+            on_step(step)
+    
+    # STEP 1: Download da Telegram
+    logger.info(f"🔄 STEP 1: Download file_id {file_id}")
+    try:
+        # File non ammessi vengono scartati prima di qualunque altro lavoro
+        file_data = upload_service.telegram_downloader.check_file(file_id)
+        
+        # Scelta del nodo Steem in parallelo al download
+        node_warmup = upload_service.prefetch_node()
+        
+        buffer, original_filename, file_size = upload_service.telegram_downloader.download_to_buffer(file_id, file_data)
+        add_step({
+            'step': 1,
+            'name': 'telegram_download',
+            'success': True,
+            'file': original_filename
+        })
+    except Exception as e:
+        add_step({
+            'step': 1,
+            'name': 'telegram_download',
+            'success': False,
+            'error': str(e)
+        })
+        return workflow_result, 500
+    
+    # STEP 2: Upload su Steem
+    logger.info(f"🔄 STEP 2: Upload su Steem")
+    try:
+        if node_warmup:
+            node_warmup.result(timeout=UPLOAD_TIMEOUT)
+        steem_result = upload_service.upload_to_steem_buffer(buffer, original_filename, file_size)
+        image_url = steem_result['url']
+        add_step({
+            'step': 2,
+            'name': 'steem_upload',
+            'success': True,
+            'url': image_url
+        })
+    except Exception as e:
+        add_step({
+            'step': 2,
+            'name': 'steem_upload',
+            'success': False,
+            'error': str(e)
+        })
+        return workflow_result, 429 if isinstance(e, UploadBusyError) else 500
+    
+    # STEP 3: Pubblica su Instagram
+    logger.info(f"🔄 STEP 3: Pubblicazione Instagram")
+    try:
+        instagram_result = INSTA_PUB.publish_photo(image_url, caption)
+        
+        if instagram_result.get('success'):
+            add_step({
+                'step': 3,
+                'name': 'instagram_publish',
+                'success': True,
+                'media_id': instagram_result.get('media_id')
+            })
+        else:
+            raise Exception(instagram_result.get('error', 'Errore Instagram'))
+            
+    except Exception as e:
+        add_step({
+            'step': 3,
+            'name': 'instagram_publish',
+            'success': False,
+            'error': str(e)
+        })
+        return workflow_result, 500
+    
+    # STEP 4: Rispondi su Telegram (opzionale)
+    if chat_id and TELEGRAM_REPLY:
+        logger.info(f"🔄 STEP 4: Risposta Telegram")
+        try:
+            TELEGRAM_REPLY.send_message(
+                chat_id=int(chat_id),
+                text="✅ Content Posted!\n\n"
+                     f"📸 Instagram: Pubblicato\n"
+                     f"🔗 Steem: {image_url}"
+            )
+            add_step({
+                'step': 4,
+                'name': 'telegram_reply',
+                'success': True
+            })
+        except Exception as e:
+            add_step({
+                'step': 4,
+                'name': 'telegram_reply',
+                'success': False,
+                'error': str(e)
+            })
+    
+    # Risultato finale
+    workflow_result['success'] = True
+    workflow_result['image_url'] = image_url
+    workflow_result['instagram_media_id'] = instagram_result.get('media_id')
+    
+    return workflow_result, 200
+
+
+# ==================== JOB ASINCRONI + PROGRESSO SSE ====================
+
+JOB_TTL = 600  # Secondi dopo i quali un job non letto viene rimosso
+SSE_TIMEOUT = 120  # Durata massima di uno stream /progress
+SSE_HEARTBEAT = 15  # Intervallo commenti keep-alive SSE
+
+# job_id -> {'queue': coda eventi, 'created': timestamp monotonic}
+JOBS: Dict[str, Dict[str, Any]] = {}
+JOBS_LOCK = threading.Lock()
+
+
+def create_job() -> str:
+    """Registra un nuovo job e rimuove quelli scaduti"""
+    job_id = uuid.uuid4().hex
+    now = time.monotonic()
+    with JOBS_LOCK:
+        for expired in [jid for jid, job in JOBS.items() if now - job['created'] > JOB_TTL]:
+            del JOBS[expired]
+        JOBS[job_id] = {'queue': queue.Queue(), 'created': now}
+    return job_id
+
+
+def emit_job_event(job_id: str, event: Dict[str, Any]):
+    """Accoda un evento di progresso per il job"""
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if job:
+        job['queue'].put(event)
+
+
+def run_workflow_job(job_id: str, file_id: str, caption: str, chat_id: Optional[str]):
+    """Esegue il workflow in background pubblicando il progresso sulla coda del job"""
+    try:
+        emit_job_event(job_id, {'status': 'running'})
+        result, status_code = run_workflow(
+            file_id, caption, chat_id,
+            on_step=lambda step: emit_job_event(job_id, {'status': 'step', **step})
+        )
+        emit_job_event(job_id, {
+            'status': 'completed' if status_code == 200 else 'failed',
+            'result': result
+        })
+    except Exception as e:
+        logger.error(f"Errore workflow job {job_id}: {e}")
+        emit_job_event(job_id, {'status': 'failed', 'result': {'success': False, 'error': str(e)}})
+
+
 @app.route('/workflow/telegram-to-instagram', methods=['POST'])
 def workflow_telegram_to_instagram():
     """
     Workflow completo: Telegram → Steem Upload → Instagram Publish
-    Replica il workflow n8n internamente
+    Replica il workflow n8n internamente.
+    
+    Di default è asincrono: risponde 202 con job_id e il progresso si segue su
+    GET /progress/<job_id> (Server-Sent Events). Con "wait": true risponde
+    al termine del workflow come in passato.
     """
     try:
         # Validazione configurazione
@@ -578,7 +1449,7 @@ def workflow_telegram_to_instagram():
                 'error': 'Servizio Steem non configurato'
             }), 500
         
-        if not INSTAGRAM_AVAILABLE or not INSTAGRAM_ACCESS_TOKEN or not INSTAGRAM_ACCOUNT_ID:
+        if not INSTA_PUB:
             return jsonify({
                 'success': False,
                 'error': 'Servizio Instagram non configurato'
@@ -589,6 +1460,7 @@ def workflow_telegram_to_instagram():
         file_id = data.get('file_id') or request.form.get('file_id')
         caption = data.get('caption', '') or request.form.get('caption', '')
         chat_id = data.get('chat_id') or request.form.get('chat_id')  # Per rispondere su Telegram
+        wait = str(data.get('wait') or request.form.get('wait') or request.args.get('wait') or '').lower() in ('1', 'true', 'yes')
         
         if not file_id:
             return jsonify({
@@ -596,108 +1468,23 @@ def workflow_telegram_to_instagram():
                 'error': 'file_id richiesto'
             }), 400
         
-        workflow_result = {
-            'success': False,
-            'steps': []
-        }
-        
-        # STEP 1: Download da Telegram
-        logger.info(f"🔄 STEP 1: Download file_id {file_id}")
-        try:
-            temp_path, original_filename = upload_service.telegram_downloader.download_file(file_id)
-            workflow_result['steps'].append({
-                'step': 1,
-                'name': 'telegram_download',
-                'success': True,
-                'file': original_filename
-            })
-        except Exception as e:
-            workflow_result['steps'].append({
-                'step': 1,
-                'name': 'telegram_download',
-                'success': False,
-                'error': str(e)
-            })
-            return jsonify(workflow_result), 500
-        
-        # STEP 2: Upload su Steem
-        logger.info(f"🔄 STEP 2: Upload su Steem")
-        try:
-            steem_result = upload_service.upload_to_steem(temp_path)
-            image_url = steem_result['url']
-            workflow_result['steps'].append({
-                'step': 2,
-                'name': 'steem_upload',
-                'success': True,
-                'url': image_url
-            })
-        except Exception as e:
-            workflow_result['steps'].append({
-                'step': 2,
-                'name': 'steem_upload',
-                'success': False,
-                'error': str(e)
-            })
-            return jsonify(workflow_result), 500
+        if wait:
+            workflow_result, status_code = run_workflow(file_id, caption, chat_id)
+            return jsonify(workflow_result), status_code
         
-        # STEP 3: Pubblica su Instagram
-        logger.info(f"🔄 STEP 3: Pubblicazione Instagram")
-        try:
-            publisher = InstagramPublisher(
-                access_token=INSTAGRAM_ACCESS_TOKEN,
-                instagram_account_id=INSTAGRAM_ACCOUNT_ID
-            )
-            instagram_result = publisher.publish_photo(image_url, caption)
-            
-            if instagram_result.get('success'):
-                workflow_result['steps'].append({
-                    'step': 3,
-                    'name': 'instagram_publish',
-                    'success': True,
-                    'media_id': instagram_result.get('media_id')
-                })
-            else:
-                raise Exception(instagram_result.get('error', 'Errore Instagram'))
-                
-        except Exception as e:
-            workflow_result['steps'].append({
-                'step': 3,
-                'name': 'instagram_publish',
-                'success': False,
-                'error': str(e)
-            })
-            return jsonify(workflow_result), 500
+        job_id = create_job()
+        threading.Thread(
+            target=run_workflow_job,
+            args=(job_id, file_id, caption, chat_id),
+            name=f'workflow-{job_id[:8]}',
+            daemon=True
+        ).start()
         
-        # STEP 4: Rispondi su Telegram (opzionale)
-        if chat_id and TELEGRAM_BOT_TOKEN:
-            logger.info(f"🔄 STEP 4: Risposta Telegram")
-            try:
-                telegram_handler = TelegramHandler(TELEGRAM_BOT_TOKEN)
-                telegram_handler.send_message(
-                    chat_id=int(chat_id),
-                    text="✅ Content Posted!\n\n"
-                         f"📸 Instagram: Pubblicato\n"
-                         f"🔗 Steem: {image_url}"
-                )
-                workflow_result['steps'].append({
-                    'step': 4,
-                    'name': 'telegram_reply',
-                    'success': True
-                })
-            except Exception as e:
-                workflow_result['steps'].append({
-                    'step': 4,
-                    'name': 'telegram_reply',
-                    'success': False,
-                    'error': str(e)
-                })
-        
-        # Risultato finale
-        workflow_result['success'] = True
-        workflow_result['image_url'] = image_url
-        workflow_result['instagram_media_id'] = instagram_result.get('media_id')
-        
-        return jsonify(workflow_result)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'progress_url': f'/progress/{job_id}'
+        }), 202
         
     except Exception as e:
         logger.error(f"Errore workflow completo: {e}")
@@ -707,6 +1494,36 @@ def workflow_telegram_to_instagram():
         }), 500
 
 
+@app.route('/progress/<job_id>')
+def workflow_progress(job_id: str):
+    """Stream SSE con il progresso di un job del workflow"""
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job non trovato'}), 404
+    
+    def generate():
+        deadline = time.monotonic() + SSE_TIMEOUT
+        while time.monotonic() < deadline:
+            try:
+                event = job['queue'].get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            yield f"data: {app.json.dumps(event)}\n\n"
+            if event.get('status') in ('completed', 'failed'):
+                with JOBS_LOCK:
+                    JOBS.pop(job_id, None)
+                return
+        yield "event: timeout\ndata: {}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @app.errorhandler(413)
 def file_too_large(e):
     """Gestisce file troppo grandi"""
@@ -725,6 +1542,24 @@ def internal_error(e):
     }), 500
 
 
+def run_server():
+    """Avvia l'API: waitress in produzione, server Werkzeug solo in debug o come fallback"""
+    if DEBUG_MODE:
+        logger.warning("⚠️ DEBUG attivo: server di sviluppo Werkzeug, non usare in produzione")
+        app.run(host=API_HOST, port=API_PORT, debug=True, threaded=True)
+        return
+    
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.warning("⚠️ waitress non installato: uso server Werkzeug multi-thread (pip install waitress o usa gunicorn)")
+        app.run(host=API_HOST, port=API_PORT, debug=False, threaded=True)
+        return
+    
+    logger.info(f"🚀 Server WSGI waitress con {WSGI_THREADS} thread")
+    serve(app, host=API_HOST, port=API_PORT, threads=WSGI_THREADS)
+
+
 if __name__ == '__main__':
     print("🚀 Steem/Hive Image Upload API v2.0")
     print("=" * 60)
@@ -739,6 +1574,8 @@ if __name__ == '__main__':
     print("   POST /upload   - Upload diretto file")
     print("   POST /upload-telegram - Upload da Telegram file_id")
     print("   POST /upload-multiple - Upload multipli")
+    print("   POST /workflow/telegram-to-instagram - Workflow completo")
+    print("   GET  /progress/<job_id> - Progresso workflow (SSE)")
     print("   GET  /health   - Stato servizio")
     print("=" * 60)
     
@@ -751,11 +1588,7 @@ if __name__ == '__main__':
         print()
     
     try:
-        app.run(
-            host=API_HOST,
-            port=API_PORT,
-            debug=DEBUG_MODE
-        )
+        run_server()
     except KeyboardInterrupt:
         print("\n👋 Server fermato dall'utente")
     except Exception as e:
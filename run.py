@@ -1,11 +1,20 @@
 """
 Script di avvio semplificato per il bot Instagram Publisher
 Verifica configurazione e avvia il bot in modalità appropriata
+
+I controlli di avvio (.env, dipendenze, configurazione) sono idempotenti ma costosi:
+con riavvii frequenti (systemd, docker restart) impostare SKIP_STARTUP_CHECKS=1
+dopo il primo avvio riuscito per avviare direttamente il bot.
 """
 import sys
 import os
+import hashlib
+from importlib import metadata
 from pathlib import Path
 
+# File che registra l'ultimo requirements.txt verificato con successo
+DEPS_STAMP = Path(".deps_ok")
+
 # Banner
 BANNER = """
 ╔══════════════════════════════════════════════════════════════╗
@@ -49,6 +58,11 @@ def check_env_file():
             print()
             print(f"   Apri .env con: notepad {env_file}")
             
+            # Senza terminale (systemd, docker) input() resterebbe bloccato: esci subito
+            if not sys.stdin.isatty():
+                print("   Ambiente non interattivo: configura .env e riavvia")
+                sys.exit(1)
+            
             # Chiedi se vuole aprire subito
             try:
                 response = input("\n   Vuoi aprire .env ora? (s/n): ")
@@ -66,8 +80,22 @@ def check_env_file():
         print("✅ File .env trovato")
 
 
+def requirements_hash() -> str:
+    """Hash di requirements.txt (stringa vuota se il file non esiste)"""
+    requirements = Path("requirements.txt")
+    if not requirements.exists():
+        return ""
+    return hashlib.sha1(requirements.read_bytes()).hexdigest()
+
+
 def check_dependencies():
     """Verifica dipendenze installate"""
+    # Avvio a caldo: requirements.txt invariato dall'ultima verifica riuscita
+    req_hash = requirements_hash()
+    if req_hash and DEPS_STAMP.exists() and DEPS_STAMP.read_text().strip() == req_hash:
+        print("✅ Dipendenze OK (verificate in precedenza)")
+        return
+    
     required = [
         ('aiogram', 'aiogram'),
         ('aiohttp', 'aiohttp'),
@@ -77,33 +105,23 @@ def check_dependencies():
         ('dotenv', 'python-dotenv')
     ]
     
+    # Legge solo i metadati del pacchetto installato, senza importarlo (beem, aiogram...)
     missing = []
-    for module, package in required:
+    for _, package in required:
         try:
-            __import__(module)
-        except ImportError:
+            metadata.version(package)
+        except metadata.PackageNotFoundError:
             missing.append(package)
     
     if missing:
-        print(f"⚠️  Dipendenze mancanti: {', '.join(missing)}")
-        print("   Installo dipendenze...")
-        print()
-        
-        import subprocess
-        result = subprocess.run(
-            [sys.executable, "-m", "pip", "install", "-r", "requirements.txt"],
-            capture_output=True,
-            text=True
-        )
-        
-        if result.returncode != 0:
-            print("❌ Errore installazione dipendenze:")
-            print(result.stderr)
-            sys.exit(1)
-        
-        print("✅ Dipendenze installate")
-    else:
-        print("✅ Dipendenze OK")
+        print(f"❌ Dipendenze mancanti: {', '.join(missing)}")
+        print("   Installa con: pip install -r requirements.txt")
+        sys.exit(1)
+    
+    print("✅ Dipendenze OK")
+    
+    if req_hash:
+        DEPS_STAMP.write_text(req_hash)
 
 
 def validate_config():
@@ -159,6 +177,10 @@ def run_bot():
 
 def main():
     """Entry point principale"""
+    # Riavvio gestito da un supervisore: controlli già superati in precedenza
+    if os.environ.get("SKIP_STARTUP_CHECKS") == "1":
+        return run_bot()
+    
     print(BANNER)
     print("🔍 Verifico ambiente di esecuzione...\n")
     
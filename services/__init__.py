@@ -4,5 +4,6 @@ Servizi modulari per l'applicazione Image Upload
 
 from .instagram_publisher import InstagramPublisher
 from .telegram_handler import TelegramHandler
+from .database import get_db
 
-__all__ = ['InstagramPublisher', 'TelegramHandler']
+__all__ = ['InstagramPublisher', 'TelegramHandler', 'get_db']
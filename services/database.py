@@ -3,13 +3,155 @@ Servizio database SQLite per gestione sessioni utente e post programmati
 """
 import sqlite3
 import logging
+import threading
+import time
+import functools
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from pathlib import Path
 import json
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Versione dello schema salvata in PRAGMA user_version: incrementarla a ogni modifica del DDL
+SCHEMA_VERSION = 3
+
+# Un post resta 'publishing' per la durata di upload + attesa container + publish:
+# oltre questa soglia (secondi dalla presa in carico) è considerato interrotto
+STALE_PUBLISHING_AFTER = 15 * 60
+INTERRUPTED_ERROR = "Pubblicazione interrotta: verificare su Instagram prima di riprogrammare"
+
+
+def _json_dumps(value: Any) -> str:
+    """Serializza extra_data (orjson se disponibile, altrimenti json)"""
+    if orjson:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
+
+
+def _json_loads(value: str) -> Any:
+    """Deserializza extra_data (orjson se disponibile, altrimenti json)"""
+    if orjson:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def _now() -> int:
+    """Istante attuale in secondi unix (time.time è molto più economico di datetime.now)"""
+    return int(time.time())
+
+
+def _convert_epoch(value: bytes) -> datetime:
+    """Converte una colonna EPOCH (secondi unix) in datetime locale"""
+    return datetime.fromtimestamp(int(value))
+
+
+# Le colonne dichiarate EPOCH contengono secondi unix (INTEGER) e tornano come datetime.
+# Nome di tipo dedicato per non sostituire il convertitore "timestamp" di sqlite3.
+sqlite3.register_converter("EPOCH", _convert_epoch)
+
+_SQL_CREATE_POSTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS scheduled_posts (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        image_url TEXT NOT NULL,
+        caption TEXT,
+        scheduled_time EPOCH NOT NULL,
+        created_at EPOCH NOT NULL,
+        status TEXT DEFAULT 'scheduled',
+        telegram_message_id INTEGER,
+        instagram_media_id TEXT,
+        error_message TEXT,
+        instagram_shortcode TEXT,
+        claimed_at EPOCH,
+        FOREIGN KEY (user_id) REFERENCES user_sessions(user_id)
+    )
+"""
+
+# Query usate a ogni chiamata: testo costante così la statement cache di sqlite3 le riusa già compilate
+_SESSION_COLUMNS = ('scheduled_datetime', 'selected_date', 'selected_hour',
+                    'selected_minute', 'last_updated', 'extra_data')
+
+# Upsert a colonne fisse: le colonne non passate (NULL) mantengono il valore esistente
+_SQL_SAVE_SESSION = f"""
+    INSERT INTO user_sessions (user_id, {', '.join(_SESSION_COLUMNS)})
+    VALUES (?, {', '.join('?' for _ in _SESSION_COLUMNS)})
+    ON CONFLICT(user_id) DO UPDATE SET
+    {', '.join(f"{c}=COALESCE(excluded.{c}, {c})" for c in _SESSION_COLUMNS)}
+"""
+_SQL_GET_SESSION = "SELECT * FROM user_sessions WHERE user_id = ?"
+_SQL_CREATE_POST = """
+    INSERT INTO scheduled_posts
+    (id, user_id, image_url, caption, scheduled_time, created_at, telegram_message_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO NOTHING
+"""
+_SQL_USER_POSTS = """
+    SELECT * FROM scheduled_posts
+    WHERE user_id = ?
+    ORDER BY scheduled_time ASC
+"""
+_SQL_USER_POSTS_BY_STATUS = """
+    SELECT * FROM scheduled_posts
+    WHERE user_id = ? AND status = ?
+    ORDER BY scheduled_time ASC
+"""
+_SQL_DUE_POSTS = """
+    SELECT * FROM scheduled_posts
+    WHERE status = 'scheduled' AND scheduled_time <= ?
+    ORDER BY scheduled_time ASC
+"""
+# Servita dall'indice parziale idx_due
+_SQL_NEXT_DUE_TIME = """
+    SELECT MIN(scheduled_time) FROM scheduled_posts
+    WHERE status = 'scheduled'
+"""
+# Prende in carico i post scaduti in un solo statement (status -> 'publishing'),
+# così lo stesso post non può essere pubblicato due volte
+_SQL_CLAIM_DUE_POSTS = """
+    UPDATE scheduled_posts
+    SET status = 'publishing', claimed_at = ?
+    WHERE id IN (
+        SELECT id FROM scheduled_posts
+        WHERE status = 'scheduled' AND scheduled_time <= ?
+        ORDER BY scheduled_time ASC
+        LIMIT ?
+    )
+    RETURNING *
+"""
+# Post presi in carico da troppo tempo (processo terminato durante la pubblicazione).
+# Non tornano in coda: il media potrebbe essere già stato pubblicato prima dell'arresto
+_SQL_FAIL_STALE_PUBLISHING = """
+    UPDATE scheduled_posts
+    SET status = 'failed', error_message = ?
+    WHERE status = 'publishing' AND (claimed_at IS NULL OR claimed_at < ?)
+"""
+_SQL_UPDATE_POST_STATUS = """
+    UPDATE scheduled_posts
+    SET status = ?,
+        instagram_media_id = COALESCE(?, instagram_media_id),
+        instagram_shortcode = COALESCE(?, instagram_shortcode),
+        error_message = COALESCE(?, error_message)
+    WHERE id = ?
+"""
+_SQL_CANCEL_POST = """
+    UPDATE scheduled_posts
+    SET status = 'cancelled'
+    WHERE id = ? AND user_id = ? AND status = 'scheduled'
+"""
+_SQL_GET_POST = "SELECT * FROM scheduled_posts WHERE id = ?"
+_SQL_STATS = """
+    SELECT 'active_sessions', COUNT(*) FROM user_sessions
+    UNION ALL
+    SELECT 'posts_' || status, COUNT(*) FROM scheduled_posts GROUP BY status
+"""
+
 
 class Database:
     """Gestore database SQLite"""
@@ -22,67 +164,190 @@ class Database:
             db_path: Percorso file database
         """
         self.db_path = db_path
+        # Rientrante: letture e scritture possono essere chiamate dentro batch()
+        self._lock = threading.RLock()
+        self._conn = self._connect()
         self._init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Apre l'unica connessione usata per tutta la vita del processo.
+        Autocommit (isolation_level=None) e WAL: le letture non bloccano le scritture.
+        """
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        conn.row_factory = sqlite3.Row
+        journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        if journal_mode.lower() != 'wal':
+            # Es. filesystem di rete: SQLite resta sul journal di rollback
+            logger.warning(f"WAL non disponibile per {self.db_path}, journal_mode={journal_mode}")
+        # Con una connessione sempre aperta il file -wal non si riduce da solo
+        conn.execute("PRAGMA journal_size_limit=67108864")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-20000")
+        return conn
+
+    @contextmanager
+    def _read(self):
+        """
+        Connessione per letture, serializzate con le scritture.
+
+        WAL isola solo connessioni diverse: qui la connessione è unica e condivisa tra i thread,
+        quindi senza lock una lettura potrebbe finire dentro (e vedere) un batch() aperto altrove.
+        """
+        with self._lock:
+            yield self._conn
+
+    @contextmanager
+    def _write(self):
+        """Connessione per scritture, serializzate tra i thread"""
+        with self._lock:
+            yield self._conn
+
+    @contextmanager
+    def batch(self):
+        """
+        Raggruppa più scritture in un'unica transazione (un solo commit)
+
+        Valido per i metodi a singola istruzione (save_user_session, create_scheduled_post, ...);
+        non annidare metodi che aprono una propria transazione (create_scheduled_posts, claim_due_posts).
+
+        Yields:
+            La connessione, con la transazione aperta
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        """Chiude la connessione al database (aggiornando prima le statistiche del planner)"""
+        with self._lock:
+            try:
+                self._conn.execute("PRAGMA optimize")
+            except sqlite3.Error as e:
+                logger.debug(f"PRAGMA optimize fallito: {e}")
+            self._conn.close()
+
     def _init_db(self):
-        """Inizializza schema database"""
+        """Inizializza schema database (DDL eseguito solo se user_version è obsoleto)"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                # Tabella sessioni utente (per programmazione post)
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS user_sessions (
-                        user_id INTEGER PRIMARY KEY,
-                        scheduled_datetime TEXT,
-                        selected_date TEXT,
-                        selected_hour INTEGER,
-                        selected_minute INTEGER,
-                        last_updated TEXT,
-                        extra_data TEXT
-                    )
-                """)
-
-                # Tabella post programmati
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS scheduled_posts (
-                        id TEXT PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        image_url TEXT NOT NULL,
-                        caption TEXT,
-                        scheduled_time TEXT NOT NULL,
-                        created_at TEXT NOT NULL,
-                        status TEXT DEFAULT 'scheduled',
-                        telegram_message_id INTEGER,
-                        instagram_media_id TEXT,
-                        error_message TEXT,
-                        FOREIGN KEY (user_id) REFERENCES user_sessions(user_id)
-                    )
-                """)
-
-                # Indici per performance
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_scheduled_posts_user_id 
-                    ON scheduled_posts(user_id)
-                """)
-
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_scheduled_posts_status 
-                    ON scheduled_posts(status)
-                """)
-
-                cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS idx_scheduled_posts_time 
-                    ON scheduled_posts(scheduled_time)
-                """)
-
-                conn.commit()
+            with self._write() as conn:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    migrated = self._create_schema(conn)
+                    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+                    # Database esistente aggiornato: ricostruisce indici e compatta il file
+                    if version > 0 or migrated:
+                        conn.execute("REINDEX")
+                        conn.execute("VACUUM")
+                    logger.info(f"Schema database aggiornato alla versione {SCHEMA_VERSION}")
+
+                # Post rimasti in pubblicazione per un arresto improvviso: solo quelli vecchi, così un
+                # secondo processo che apre il database non tocca le pubblicazioni in corso del bot
+                interrupted = conn.execute(
+                    _SQL_FAIL_STALE_PUBLISHING, (INTERRUPTED_ERROR, _now() - STALE_PUBLISHING_AFTER)
+                ).rowcount
+                if interrupted:
+                    logger.warning(f"{interrupted} post in pubblicazione interrotta marcati come 'failed'")
+
                 logger.info(f"Database inizializzato: {self.db_path}")
 
         except Exception as e:
             logger.error(f"Errore inizializzazione database: {e}")
             raise
 
+    def _create_schema(self, conn: sqlite3.Connection) -> bool:
+        """
+        Crea tabelle e indici, migrando i database creati prima di user_version
+
+        Returns:
+            True se è stata eseguita la migrazione delle date a EPOCH
+        """
+        # Tabella sessioni utente (per programmazione post)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_sessions (
+                user_id INTEGER PRIMARY KEY,
+                scheduled_datetime TEXT,
+                selected_date TEXT,
+                selected_hour INTEGER,
+                selected_minute INTEGER,
+                last_updated TEXT,
+                extra_data TEXT
+            )
+        """)
+
+        # Tabella post programmati
+        conn.execute(_SQL_CREATE_POSTS_TABLE)
+
+        # Database creati prima delle colonne EPOCH: converte le date ISO in secondi unix
+        column_types = {row['name']: row['type'] for row in conn.execute("PRAGMA table_info(scheduled_posts)")}
+        migrated = column_types.get('scheduled_time', '').upper() == 'TEXT'
+        if migrated:
+            self._migrate_post_times(conn)
+        else:
+            if 'instagram_shortcode' not in column_types:
+                # Versione 2: shortcode salvato alla pubblicazione per costruire l'URL del post
+                conn.execute("ALTER TABLE scheduled_posts ADD COLUMN instagram_shortcode TEXT")
+            if 'claimed_at' not in column_types:
+                # Versione 3: momento della presa in carico, per riconoscere le pubblicazioni interrotte
+                conn.execute("ALTER TABLE scheduled_posts ADD COLUMN claimed_at EPOCH")
+
+        # Indici per performance
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_scheduled_posts_user_id 
+            ON scheduled_posts(user_id)
+        """)
+
+        # Indice parziale per i post in attesa (get_due_posts/claim_due_posts):
+        # contiene solo i 'scheduled', ordinati per scheduled_time
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_due
+            ON scheduled_posts(scheduled_time) WHERE status = 'scheduled'
+        """)
+
+        # Sostituiti da idx_due: il planner altrimenti preferisce l'indice su status
+        conn.execute("DROP INDEX IF EXISTS idx_scheduled_posts_status")
+        conn.execute("DROP INDEX IF EXISTS idx_scheduled_posts_time")
+
+        return migrated
+
+    @staticmethod
+    def _migrate_post_times(conn: sqlite3.Connection):
+        """
+        Ricrea scheduled_posts con scheduled_time/created_at EPOCH.
+        La conversione avviene in SQLite: le date ISO salvate sono ora locale,
+        il modificatore 'utc' le porta in UTC prima di calcolare i secondi unix.
+        """
+        to_epoch = "CAST(strftime('%s', {0}, 'utc') AS INTEGER)"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Il DROP finale rimuove anche i vecchi indici, ricreati subito dopo da _init_db
+            conn.execute("ALTER TABLE scheduled_posts RENAME TO scheduled_posts_old")
+            conn.execute(_SQL_CREATE_POSTS_TABLE)
+            migrated = conn.execute(f"""
+                INSERT INTO scheduled_posts
+                (id, user_id, image_url, caption, scheduled_time, created_at,
+                 status, telegram_message_id, instagram_media_id, error_message)
+                SELECT id, user_id, image_url, caption,
+                       {to_epoch.format('scheduled_time')}, {to_epoch.format('created_at')},
+                       status, telegram_message_id, instagram_media_id, error_message
+                FROM scheduled_posts_old
+            """).rowcount
+            conn.execute("DROP TABLE scheduled_posts_old")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        logger.info(f"Migrate {migrated} date dei post programmati a EPOCH")
+
     # ==================== USER SESSIONS ====================
 
     def save_user_session(self, user_id: int, **kwargs):
@@ -94,9 +359,7 @@ class Database:
             **kwargs: Dati da salvare (scheduled_datetime, selected_date, etc.)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
+            with self._write() as conn:
                 # Converti datetime in ISO string se presente
                 data = kwargs.copy()
                 for key in ['scheduled_datetime', 'selected_date']:
@@ -104,24 +367,18 @@ class Database:
                         data[key] = data[key].isoformat()
 
                 # Converti extra_data in JSON se presente
-                if 'extra_data' in data and isinstance(data[key], dict):
-                    data['extra_data'] = json.dumps(data['extra_data'])
+                if 'extra_data' in data and isinstance(data['extra_data'], dict):
+                    data['extra_data'] = _json_dumps(data['extra_data'])
 
                 data['last_updated'] = datetime.now().isoformat()
 
+                unknown = set(data) - set(_SESSION_COLUMNS)
+                if unknown:
+                    raise ValueError(f"Campi sessione sconosciuti: {', '.join(sorted(unknown))}")
+
                 # Inserisci o aggiorna
-                columns = ', '.join(data.keys())
-                placeholders = ', '.join(['?' for _ in data])
-                values = list(data.values())
-
-                cursor.execute(f"""
-                    INSERT INTO user_sessions (user_id, {columns})
-                    VALUES (?, {placeholders})
-                    ON CONFLICT(user_id) DO UPDATE SET
-                    {', '.join([f"{k}=excluded.{k}" for k in data.keys()])}
-                """, [user_id] + values)
-
-                conn.commit()
+                conn.execute(_SQL_SAVE_SESSION, [user_id] + [data.get(c) for c in _SESSION_COLUMNS])
+
                 logger.debug(f"Sessione utente {user_id} salvata")
 
         except Exception as e:
@@ -139,15 +396,8 @@ class Database:
             Dizionario con dati sessione o None
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                cursor.execute("""
-                    SELECT * FROM user_sessions WHERE user_id = ?
-                """, (user_id,))
-
-                row = cursor.fetchone()
+            with self._read() as conn:
+                row = conn.execute(_SQL_GET_SESSION, (user_id,)).fetchone()
                 if row:
                     data = dict(row)
 
@@ -162,7 +412,7 @@ class Database:
                     # Converti extra_data da JSON
                     if data.get('extra_data'):
                         try:
-                            data['extra_data'] = json.loads(data['extra_data'])
+                            data['extra_data'] = _json_loads(data['extra_data'])
                         except:
                             pass
 
@@ -182,10 +432,8 @@ class Database:
             user_id: ID utente Telegram
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute("DELETE FROM user_sessions WHERE user_id = ?", (user_id,))
-                conn.commit()
+            with self._write() as conn:
+                conn.execute("DELETE FROM user_sessions WHERE user_id = ?", (user_id,))
                 logger.debug(f"Sessione utente {user_id} cancellata")
 
         except Exception as e:
@@ -208,123 +456,164 @@ class Database:
             telegram_message_id: ID messaggio Telegram
 
         Returns:
-            True se creato con successo
+            True se creato con successo (o già presente con lo stesso ID)
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                cursor.execute("""
-                    INSERT INTO scheduled_posts 
-                    (id, user_id, image_url, caption, scheduled_time, created_at, 
-                     telegram_message_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
+            with self._write() as conn:
+                inserted = conn.execute(_SQL_CREATE_POST, (
                     post_id,
                     user_id,
                     image_url,
                     caption,
-                    scheduled_time.isoformat(),
-                    datetime.now().isoformat(),
+                    int(scheduled_time.timestamp()),
+                    _now(),
                     telegram_message_id
-                ))
+                )).rowcount
 
-                conn.commit()
-                logger.info(f"Post programmato creato: {post_id}")
+                if inserted:
+                    logger.info(f"Post programmato creato: {post_id}")
+                else:
+                    # Retry con lo stesso ID: nessuna modifica
+                    logger.debug(f"Post programmato già presente: {post_id}")
                 return True
 
         except Exception as e:
             logger.error(f"Errore creazione post programmato {post_id}: {e}")
             return False
 
-    def get_user_posts(self, user_id: int, status: str = None) -> list:
+    def create_scheduled_posts(self, posts: list) -> int:
+        """
+        Crea più post programmati in un'unica transazione
+
+        Args:
+            posts: Tuple (post_id, user_id, image_url, caption, scheduled_time, telegram_message_id)
+
+        Returns:
+            Numero di post creati, esclusi gli ID già presenti (0 in caso di errore: nessun post viene salvato)
+        """
+        created_at = _now()
+        rows = [
+            (post_id, user_id, image_url, caption, int(scheduled_time.timestamp()), created_at, telegram_message_id)
+            for post_id, user_id, image_url, caption, scheduled_time, telegram_message_id in posts
+        ]
+        if not rows:
+            return 0
+
+        try:
+            with self._write() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    inserted = conn.executemany(_SQL_CREATE_POST, rows).rowcount
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+
+                if inserted < len(rows):
+                    logger.debug(f"Saltati {len(rows) - inserted} post programmati già presenti")
+                logger.info(f"Creati {inserted} post programmati")
+                return inserted
+
+        except Exception as e:
+            logger.error(f"Errore creazione post programmati in blocco: {e}")
+            return 0
+
+    def get_user_posts(self, user_id: int, status: str = None, raw: bool = False) -> list:
         """
         Recupera post programmati di un utente
 
         Args:
             user_id: ID utente Telegram
             status: Filtra per status (optional)
+            raw: Se True restituisce le sqlite3.Row senza convertirle in dict
 
         Returns:
             Lista di post
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
+            with self._read() as conn:
                 if status:
-                    cursor.execute("""
-                        SELECT * FROM scheduled_posts 
-                        WHERE user_id = ? AND status = ?
-                        ORDER BY scheduled_time ASC
-                    """, (user_id, status))
+                    rows = conn.execute(_SQL_USER_POSTS_BY_STATUS, (user_id, status))
                 else:
-                    cursor.execute("""
-                        SELECT * FROM scheduled_posts 
-                        WHERE user_id = ?
-                        ORDER BY scheduled_time ASC
-                    """, (user_id,))
-
-                rows = cursor.fetchall()
-                posts = []
-
-                for row in rows:
-                    post = dict(row)
-                    # Converti date
-                    if post.get('scheduled_time'):
-                        post['scheduled_time'] = datetime.fromisoformat(post['scheduled_time'])
-                    if post.get('created_at'):
-                        post['created_at'] = datetime.fromisoformat(post['created_at'])
-                    posts.append(post)
-
-                return posts
+                    rows = conn.execute(_SQL_USER_POSTS, (user_id,))
+
+                if raw:
+                    return rows.fetchall()
+                return [dict(row) for row in rows]
 
         except Exception as e:
             logger.error(f"Errore recupero post utente {user_id}: {e}")
             return []
 
-    def get_due_posts(self) -> list:
+    def get_due_posts(self, raw: bool = False) -> list:
         """
         Recupera post da pubblicare ora
 
+        Args:
+            raw: Se True restituisce le sqlite3.Row senza convertirle in dict
+
         Returns:
             Lista di post scaduti non ancora pubblicati
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
+            with self._read() as conn:
+                rows = conn.execute(_SQL_DUE_POSTS, (_now(),))
+                if raw:
+                    return rows.fetchall()
+                return [dict(row) for row in rows]
 
-                now = datetime.now().isoformat()
+        except Exception as e:
+            logger.error(f"Errore recupero post scaduti: {e}")
+            return []
 
-                cursor.execute("""
-                    SELECT * FROM scheduled_posts 
-                    WHERE status = 'scheduled' AND scheduled_time <= ?
-                    ORDER BY scheduled_time ASC
-                """, (now,))
+    def get_next_due_time(self) -> Optional[datetime]:
+        """
+        Recupera l'orario del prossimo post da pubblicare
 
-                rows = cursor.fetchall()
-                posts = []
+        Returns:
+            Datetime del primo post in stato 'scheduled' o None se non ce ne sono
+        """
+        try:
+            with self._read() as conn:
+                next_time = conn.execute(_SQL_NEXT_DUE_TIME).fetchone()[0]
+                return _convert_epoch(next_time) if next_time is not None else None
 
-                for row in rows:
-                    post = dict(row)
-                    # Converti date
-                    if post.get('scheduled_time'):
-                        post['scheduled_time'] = datetime.fromisoformat(post['scheduled_time'])
-                    if post.get('created_at'):
-                        post['created_at'] = datetime.fromisoformat(post['created_at'])
-                    posts.append(post)
+        except Exception as e:
+            logger.error(f"Errore recupero prossimo post programmato: {e}")
+            return None
 
-                return posts
+    def claim_due_posts(self, limit: int = 50) -> list:
+        """
+        Recupera i post da pubblicare ora e li marca come 'publishing' in un'unica operazione
+
+        Args:
+            limit: Numero massimo di post presi in carico
+
+        Returns:
+            Lista di post presi in carico, in ordine di scheduled_time
+        """
+        try:
+            with self._write() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    now = _now()
+                    rows = conn.execute(_SQL_CLAIM_DUE_POSTS, (now, now, limit)).fetchall()
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+
+                # RETURNING non garantisce l'ordine delle righe
+                return sorted((dict(row) for row in rows), key=lambda post: post['scheduled_time'])
 
         except Exception as e:
-            logger.error(f"Errore recupero post scaduti: {e}")
+            logger.error(f"Errore presa in carico post scaduti: {e}")
             return []
 
     def update_post_status(self, post_id: str, status: str,
                           instagram_media_id: str = None,
-                          error_message: str = None) -> bool:
+                          error_message: str = None,
+                          instagram_shortcode: str = None) -> bool:
         """
         Aggiorna stato di un post
 
@@ -333,40 +622,61 @@ class Database:
             status: Nuovo status
             instagram_media_id: ID media Instagram (optional)
             error_message: Messaggio errore (optional)
+            instagram_shortcode: Shortcode del post pubblicato (optional)
 
         Returns:
             True se aggiornato con successo
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
+            with self._write() as conn:
+                conn.execute(_SQL_UPDATE_POST_STATUS, (
+                    status,
+                    instagram_media_id or None,
+                    instagram_shortcode or None,
+                    error_message or None,
+                    post_id
+                ))
 
-                updates = ["status = ?"]
-                values = [status]
+                logger.info(f"Post {post_id} aggiornato: {status}")
+                return True
 
-                if instagram_media_id:
-                    updates.append("instagram_media_id = ?")
-                    values.append(instagram_media_id)
+        except Exception as e:
+            logger.error(f"Errore aggiornamento post {post_id}: {e}")
+            return False
 
-                if error_message:
-                    updates.append("error_message = ?")
-                    values.append(error_message)
+    def update_post_statuses(self, updates: list) -> int:
+        """
+        Aggiorna lo stato di più post in un'unica transazione
 
-                values.append(post_id)
+        Args:
+            updates: Tuple (post_id, status, instagram_media_id, error_message, instagram_shortcode)
 
-                cursor.execute(f"""
-                    UPDATE scheduled_posts 
-                    SET {', '.join(updates)}
-                    WHERE id = ?
-                """, values)
+        Returns:
+            Numero di post aggiornati (0 in caso di errore)
+        """
+        rows = [
+            (status, instagram_media_id or None, instagram_shortcode or None, error_message or None, post_id)
+            for post_id, status, instagram_media_id, error_message, instagram_shortcode in updates
+        ]
+        if not rows:
+            return 0
 
-                conn.commit()
-                logger.info(f"Post {post_id} aggiornato: {status}")
-                return True
+        try:
+            with self._write() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    updated = conn.executemany(_SQL_UPDATE_POST_STATUS, rows).rowcount
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+
+                logger.info(f"Aggiornati {updated} post")
+                return updated
 
         except Exception as e:
-            logger.error(f"Errore aggiornamento post {post_id}: {e}")
-            return False
+            logger.error(f"Errore aggiornamento post in blocco: {e}")
+            return 0
 
     def cancel_post(self, post_id: str, user_id: int) -> bool:
         """
@@ -380,17 +690,8 @@ class Database:
             True se cancellato con successo
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                cursor.execute("""
-                    UPDATE scheduled_posts 
-                    SET status = 'cancelled'
-                    WHERE id = ? AND user_id = ? AND status = 'scheduled'
-                """, (post_id, user_id))
-
-                rows_affected = cursor.rowcount
-                conn.commit()
+            with self._write() as conn:
+                rows_affected = conn.execute(_SQL_CANCEL_POST, (post_id, user_id)).rowcount
 
                 if rows_affected > 0:
                     logger.info(f"Post {post_id} cancellato")
@@ -403,34 +704,22 @@ class Database:
             logger.error(f"Errore cancellazione post {post_id}: {e}")
             return False
 
-    def get_post_by_id(self, post_id: str) -> Optional[Dict[str, Any]]:
+    def get_post_by_id(self, post_id: str, raw: bool = False) -> Optional[Dict[str, Any]]:
         """
         Recupera un post per ID
 
         Args:
             post_id: ID post
+            raw: Se True restituisce la sqlite3.Row senza convertirla in dict
 
         Returns:
-            Dizionario con dati post o None
+            Dizionario (o sqlite3.Row) con dati post o None
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-
-                cursor.execute("""
-                    SELECT * FROM scheduled_posts WHERE id = ?
-                """, (post_id,))
-
-                row = cursor.fetchone()
+            with self._read() as conn:
+                row = conn.execute(_SQL_GET_POST, (post_id,)).fetchone()
                 if row:
-                    post = dict(row)
-                    # Converti date
-                    if post.get('scheduled_time'):
-                        post['scheduled_time'] = datetime.fromisoformat(post['scheduled_time'])
-                    if post.get('created_at'):
-                        post['created_at'] = datetime.fromisoformat(post['created_at'])
-                    return post
+                    return row if raw else dict(row)
 
                 return None
 
@@ -448,18 +737,13 @@ class Database:
             days: Numero di giorni
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
+            with self._write() as conn:
                 cutoff = datetime.now() - timedelta(days=days)
 
-                cursor.execute("""
+                deleted = conn.execute("""
                     DELETE FROM user_sessions 
                     WHERE last_updated < ?
-                """, (cutoff.isoformat(),))
-
-                deleted = cursor.rowcount
-                conn.commit()
+                """, (cutoff.isoformat(),)).rowcount
 
                 if deleted > 0:
                     logger.info(f"Cancellate {deleted} sessioni vecchie")
@@ -475,23 +759,22 @@ class Database:
             days: Numero di giorni
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                cutoff = datetime.now() - timedelta(days=days)
+            with self._write() as conn:
+                cutoff = _now() - days * 86400
 
-                cursor.execute("""
+                deleted = conn.execute("""
                     DELETE FROM scheduled_posts 
                     WHERE created_at < ? 
                     AND status IN ('published', 'failed', 'cancelled')
-                """, (cutoff.isoformat(),))
-
-                deleted = cursor.rowcount
-                conn.commit()
+                """, (cutoff,)).rowcount
 
                 if deleted > 0:
                     logger.info(f"Cancellati {deleted} post vecchi")
 
+                # Manutenzione periodica: svuota il WAL e aggiorna le statistiche del planner
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                conn.execute("PRAGMA optimize")
+
         except Exception as e:
             logger.error(f"Errore pulizia post: {e}")
 
@@ -503,38 +786,33 @@ class Database:
             Dizionario con statistiche
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                stats = {}
-
-                # Conta sessioni attive
-                cursor.execute("SELECT COUNT(*) FROM user_sessions")
-                stats['active_sessions'] = cursor.fetchone()[0]
-
-                # Conta post per status
-                cursor.execute("""
-                    SELECT status, COUNT(*) 
-                    FROM scheduled_posts 
-                    GROUP BY status
-                """)
-                for status, count in cursor.fetchall():
-                    stats[f'posts_{status}'] = count
-
-                return stats
+            with self._read() as conn:
+                # Sessioni attive e post per status in un'unica query
+                return dict(conn.execute(_SQL_STATS).fetchall())
 
         except Exception as e:
             logger.error(f"Errore recupero statistiche: {e}")
             return {}
 
 
-# Istanza globale database
-db = Database()
+@functools.lru_cache(maxsize=1)
+def get_db() -> Database:
+    """
+    Restituisce l'istanza globale del database, creandola al primo utilizzo
+
+    Evita di aprire il file SQLite (e di eseguire lo schema) al semplice import
+    del modulo, ad esempio nei comandi di setup di run.py.
+
+    Returns:
+        Database: Istanza condivisa
+    """
+    return Database()
 
 
 if __name__ == "__main__":
     # Test database
     print("🧪 Test Database SQLite\n")
+    db = get_db()
 
     # Test user session
     print("1️⃣ Test User Session...")
@@ -12,36 +12,73 @@ Workflow Instagram:
 2. Pubblica container con POST /{ig-user-id}/media_publish
 """
 
+import asyncio
 import os
 import time
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Dict, Any, Optional
 from datetime import datetime
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Info account (cambiano raramente) e shortcode (permanenti) condivisi tra le istanze
+account_info_cache = TTLCache(maxsize=256, ttl=300)
+shortcode_cache = TTLCache(maxsize=4096, ttl=86400)
+
+# Polling stato container: backoff esponenziale 0.5s -> 8s, attesa massima 30s
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 8.0
+POLL_MAX_WAIT = 30.0
+
 
 class InstagramPublisher:
     """Gestisce la pubblicazione su Instagram tramite Facebook Graph API"""
     
-    def __init__(self, access_token: str = None, instagram_account_id: str = None):
+    def __init__(self, access_token: str = None, instagram_account_id: str = None,
+                 session: requests.Session = None):
         """
         Inizializza Instagram Publisher
         
         Args:
             access_token: Facebook/Instagram access token
             instagram_account_id: Instagram Business Account ID (formato: 17841465903297752)
+            session: Sessione HTTP da riusare (default: nuova sessione con pooling e retry)
         """
         self.access_token = access_token or os.getenv("INSTAGRAM_ACCESS_TOKEN")
         self.instagram_account_id = instagram_account_id or os.getenv("INSTAGRAM_ACCOUNT_ID")
         self.graph_api_version = os.getenv("FACEBOOK_GRAPH_API_VERSION", "v23.0")
         self.base_url = f"https://graph.facebook.com/{self.graph_api_version}"
+        # Endpoint fissi calcolati una volta sola
+        self._ep_account = f"{self.base_url}/{self.instagram_account_id}"
+        self._ep_media = f"{self._ep_account}/media"
+        self._ep_publish = f"{self._ep_account}/media_publish"
         
         if not self.access_token:
             raise ValueError("Instagram access_token non configurato")
         if not self.instagram_account_id:
             raise ValueError("Instagram account_id non configurato")
+        
+        self.session = session or self._create_session()
+    
+    @staticmethod
+    def _create_session() -> requests.Session:
+        """
+        Crea una sessione HTTP con connection pooling verso graph.facebook.com.
+        I retry (502/503/504) valgono solo per le GET: urllib3 non ripete le POST,
+        così un container non viene mai creato due volte.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=5,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        )
+        session.mount('https://', adapter)
+        return session
     
     def create_media_container(self, image_url: str, caption: str = "") -> Dict[str, Any]:
         """
@@ -55,7 +92,7 @@ class InstagramPublisher:
             dict: {'id': 'container_id', 'status_code': 'IN_PROGRESS'}
         """
         try:
-            endpoint = f"{self.base_url}/{self.instagram_account_id}/media"
+            endpoint = self._ep_media
             
             params = {
                 "image_url": image_url,
@@ -67,7 +104,7 @@ class InstagramPublisher:
             
             logger.info(f"📸 Creazione container Instagram per: {image_url}")
             
-            response = requests.post(endpoint, params=params, timeout=30)
+            response = self.session.post(endpoint, params=params, timeout=30)
             response.raise_for_status()
             
             result = response.json()
@@ -81,6 +118,48 @@ class InstagramPublisher:
                 logger.error(f"Risposta API: {e.response.text}")
             raise Exception(f"Impossibile creare container Instagram: {e}")
     
+    def _poll_container_ready(self, creation_id: str, max_wait: float = POLL_MAX_WAIT) -> None:
+        """
+        Attende che il container sia elaborato interrogando status_code con backoff esponenziale
+
+        Args:
+            creation_id: ID del container creato in step 1
+            max_wait: Attesa massima in secondi
+
+        Raises:
+            Exception: Se il container va in ERROR/EXPIRED o non è pronto entro max_wait
+        """
+        endpoint = f"{self.base_url}/{creation_id}"
+        params = {
+            "fields": "status_code,status",
+            "access_token": self.access_token
+        }
+        deadline = time.monotonic() + max_wait
+        delay = POLL_INITIAL_DELAY
+
+        while True:
+            try:
+                response = self.session.get(endpoint, params=params, timeout=10)
+                response.raise_for_status()
+                data = response.json()
+                status_code = data.get('status_code')
+
+                if status_code == 'FINISHED':
+                    return
+                if status_code in ('ERROR', 'EXPIRED'):
+                    raise Exception(f"Container {creation_id} non pubblicabile: {status_code} ({data.get('status')})")
+
+            except requests.exceptions.RequestException as e:
+                # Errore transitorio: riprova fino alla scadenza
+                logger.warning(f"Errore controllo stato container {creation_id}: {e}")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception(f"Container {creation_id} non pronto dopo {max_wait:.0f}s")
+
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, POLL_MAX_DELAY)
+
     def publish_media(self, creation_id: str) -> Dict[str, Any]:
         """
         Pubblica il container media su Instagram (step 2)
@@ -92,16 +171,18 @@ class InstagramPublisher:
             dict: {'id': 'media_id'}
         """
         try:
-            endpoint = f"{self.base_url}/{self.instagram_account_id}/media_publish"
+            endpoint = self._ep_publish
             
             params = {
                 "creation_id": creation_id,
+                # Read-after-write: lo shortcode arriva nella stessa risposta
+                "fields": "id,shortcode",
                 "access_token": self.access_token
             }
             
             logger.info(f"📤 Pubblicazione container: {creation_id}")
             
-            response = requests.post(endpoint, params=params, timeout=30)
+            response = self.session.post(endpoint, params=params, timeout=30)
             response.raise_for_status()
             
             result = response.json()
@@ -140,19 +221,28 @@ class InstagramPublisher:
             # Step 2: Attendi che il container sia pronto (opzionale)
             if wait_for_ready:
                 logger.info("⏳ Attesa elaborazione container...")
-                time.sleep(5)  # Instagram necessita qualche secondo per processare
+                self._poll_container_ready(creation_id)
             
             # Step 3: Pubblica
             media = self.publish_media(creation_id)
+            media_id = media.get('id')
+            
+            # Shortcode dalla risposta di publish; chiamata aggiuntiva solo se assente
+            shortcode = media.get('shortcode')
+            if media_id and shortcode:
+                shortcode_cache.put(media_id, shortcode)
+            elif media_id:
+                shortcode = self._get_media_code(media_id)
             
             return {
                 "success": True,
                 "container_id": creation_id,
-                "media_id": media.get('id'),
+                "media_id": media_id,
+                "shortcode": shortcode,
                 "image_url": image_url,
                 "caption": caption,
                 "published_at": datetime.now().isoformat(),
-                "instagram_url": f"https://www.instagram.com/p/{self._get_media_code(media.get('id'))}" if media.get('id') else None
+                "instagram_url": f"https://www.instagram.com/p/{shortcode}" if shortcode else None
             }
             
         except Exception as e:
@@ -163,11 +253,22 @@ class InstagramPublisher:
                 "image_url": image_url
             }
     
+    async def publish_photo_async(self, image_url: str, caption: str = "", wait_for_ready: bool = True) -> Dict[str, Any]:
+        """
+        Versione per codice async di publish_photo: le chiamate bloccanti girano
+        in un thread, senza fermare l'event loop
+        """
+        return await asyncio.to_thread(self.publish_photo, image_url, caption, wait_for_ready)
+    
     def _get_media_code(self, media_id: str) -> Optional[str]:
         """
         Ottiene il codice media per costruire URL Instagram
         (opzionale - richiede chiamata API aggiuntiva)
         """
+        shortcode = shortcode_cache.get(media_id)
+        if shortcode:
+            return shortcode
+
         try:
             endpoint = f"{self.base_url}/{media_id}"
             params = {
@@ -175,10 +276,13 @@ class InstagramPublisher:
                 "access_token": self.access_token
             }
             
-            response = requests.get(endpoint, params=params, timeout=10)
+            response = self.session.get(endpoint, params=params, timeout=10)
             response.raise_for_status()
             
-            return response.json().get('shortcode')
+            shortcode = response.json().get('shortcode')
+            if shortcode:
+                shortcode_cache.put(media_id, shortcode)
+            return shortcode
             
         except Exception as e:
             logger.warning(f"Impossibile ottenere shortcode: {e}")
@@ -191,17 +295,24 @@ class InstagramPublisher:
         Returns:
             dict: Info account (username, profile_picture_url, followers_count, etc.)
         """
+        cache_key = self._ep_account
+        info = account_info_cache.get(cache_key)
+        if info is not None:
+            return info
+
         try:
-            endpoint = f"{self.base_url}/{self.instagram_account_id}"
+            endpoint = self._ep_account
             params = {
                 "fields": "username,name,profile_picture_url,followers_count,follows_count,media_count",
                 "access_token": self.access_token
             }
             
-            response = requests.get(endpoint, params=params, timeout=10)
+            response = self.session.get(endpoint, params=params, timeout=10)
             response.raise_for_status()
             
-            return response.json()
+            info = response.json()
+            account_info_cache.put(cache_key, info)
+            return info
             
         except Exception as e:
             logger.error(f"Errore recupero info account: {e}")
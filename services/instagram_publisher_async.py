@@ -2,12 +2,60 @@
 Servizio asincrono per pubblicazione su Instagram
 """
 import asyncio
+import importlib.util
+import time
 import httpx
 import logging
-from typing import Optional
+from typing import List, Optional
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Polling stato container: backoff esponenziale 0.5s -> 8s, attesa massima 30s
+POLL_INITIAL_DELAY = 0.5
+POLL_MAX_DELAY = 8.0
+POLL_MAX_WAIT = 30.0
+
+# Limiti Instagram per i caroselli
+CAROUSEL_MIN_ITEMS = 2
+CAROUSEL_MAX_ITEMS = 10
+
+# Info account condivise tra le istanze (cambiano raramente)
+account_info_cache = TTLCache(maxsize=256, ttl=300)
+# Shortcode dei media pubblicati (permanenti)
+shortcode_cache = TTLCache(maxsize=4096, ttl=86400)
+
+# HTTP/2 richiede il pacchetto h2 (httpx[http2]): se manca si ripiega su HTTP/1.1
+# invece di sollevare ImportError alla creazione del client
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Client HTTP/2 condiviso da tutte le istanze (multiplexing su una sola connessione TLS)
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Restituisce il client httpx condiviso, creandolo al primo utilizzo"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=20,
+                max_keepalive_connections=10,
+                keepalive_expiry=60.0
+            )
+        )
+    return _client
+
+
+async def close_client():
+    """Chiude il client httpx condiviso (da chiamare allo shutdown)"""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
 
 class InstagramPublisher:
     """Pubblicazione foto su Instagram (async)"""
@@ -24,6 +72,10 @@ class InstagramPublisher:
         self.access_token = access_token
         self.account_id = account_id
         self.base_url = f"https://graph.facebook.com/{api_version}"
+        # Endpoint fissi calcolati una volta sola
+        self._ep_account = f"{self.base_url}/{account_id}"
+        self._ep_media = f"{self._ep_account}/media"
+        self._ep_publish = f"{self._ep_account}/media_publish"
     
     async def create_container(self, image_url: str, caption: str = "") -> Optional[str]:
         """
@@ -37,26 +89,127 @@ class InstagramPublisher:
             Container ID o None se errore
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/{self.account_id}/media",
-                    data={
-                        "image_url": image_url,
-                        "caption": caption,
+            response = await get_client().post(
+                self._ep_media,
+                data={
+                    "image_url": image_url,
+                    "caption": caption,
+                    "access_token": self.access_token
+                }
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            container_id = data.get('id')
+            logger.info(f"Container creato: {container_id}")
+            return container_id
+            
+        except Exception as e:
+            logger.error(f"Errore creazione container: {e}")
+            return None
+    
+    async def _create_item_container(self, image_url: str) -> Optional[str]:
+        """
+        Crea container di un elemento del carosello
+
+        Args:
+            image_url: URL pubblico immagine
+
+        Returns:
+            Container ID o None se errore
+        """
+        try:
+            response = await get_client().post(
+                self._ep_media,
+                data={
+                    "image_url": image_url,
+                    "is_carousel_item": "true",
+                    "access_token": self.access_token
+                }
+            )
+            response.raise_for_status()
+            return response.json().get('id')
+
+        except Exception as e:
+            logger.error(f"Errore creazione elemento carosello: {e}")
+            return None
+
+    async def create_carousel_container(self, children: List[str], caption: str = "") -> Optional[str]:
+        """
+        Crea container padre di tipo CAROUSEL
+
+        Args:
+            children: ID dei container elemento
+            caption: Didascalia post
+
+        Returns:
+            Container ID o None se errore
+        """
+        try:
+            response = await get_client().post(
+                self._ep_media,
+                data={
+                    "media_type": "CAROUSEL",
+                    "children": ",".join(children),
+                    "caption": caption,
+                    "access_token": self.access_token
+                }
+            )
+            response.raise_for_status()
+
+            container_id = response.json().get('id')
+            logger.info(f"Container carosello creato: {container_id}")
+            return container_id
+
+        except Exception as e:
+            logger.error(f"Errore creazione container carosello: {e}")
+            return None
+
+    async def _poll_container_ready(self, container_id: str, max_wait: float = POLL_MAX_WAIT) -> bool:
+        """
+        Attende che il container sia elaborato interrogando status_code con backoff esponenziale
+
+        Args:
+            container_id: ID container da controllare
+            max_wait: Attesa massima in secondi
+
+        Returns:
+            True se il container è FINISHED, False se in errore, scaduto o non pronto entro max_wait
+        """
+        deadline = time.monotonic() + max_wait
+        delay = POLL_INITIAL_DELAY
+
+        while True:
+            try:
+                response = await get_client().get(
+                    f"{self.base_url}/{container_id}",
+                    params={
+                        "fields": "status_code,status",
                         "access_token": self.access_token
                     }
                 )
                 response.raise_for_status()
                 data = response.json()
-                
-                container_id = data.get('id')
-                logger.info(f"Container creato: {container_id}")
-                return container_id
-                
-        except Exception as e:
-            logger.error(f"Errore creazione container: {e}")
-            return None
-    
+                status_code = data.get('status_code')
+
+                if status_code == 'FINISHED':
+                    return True
+                if status_code in ('ERROR', 'EXPIRED'):
+                    logger.error(f"Container {container_id} non pubblicabile: {status_code} ({data.get('status')})")
+                    return False
+
+            except Exception as e:
+                # Errore transitorio: riprova fino alla scadenza
+                logger.warning(f"Errore controllo stato container {container_id}: {e}")
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.error(f"Container {container_id} non pronto dopo {max_wait:.0f}s")
+                return False
+
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, POLL_MAX_DELAY)
+
     async def publish_container(self, container_id: str) -> Optional[str]:
         """
         Pubblica container su Instagram (Step 2)
@@ -68,21 +221,24 @@ class InstagramPublisher:
             Media ID pubblicato o None se errore
         """
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/{self.account_id}/media_publish",
-                    data={
-                        "creation_id": container_id,
-                        "access_token": self.access_token
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                media_id = data.get('id')
-                logger.info(f"Media pubblicato: {media_id}")
-                return media_id
-                
+            response = await get_client().post(
+                self._ep_publish,
+                data={
+                    "creation_id": container_id,
+                    # Read-after-write: lo shortcode arriva nella stessa risposta
+                    "fields": "id,shortcode",
+                    "access_token": self.access_token
+                }
+            )
+            response.raise_for_status()
+            data = response.json()
+            
+            media_id = data.get('id')
+            if media_id and data.get('shortcode'):
+                shortcode_cache.put(media_id, data['shortcode'])
+            logger.info(f"Media pubblicato: {media_id}")
+            return media_id
+            
         except Exception as e:
             logger.error(f"Errore pubblicazione: {e}")
             return None
@@ -96,12 +252,13 @@ class InstagramPublisher:
             caption: Didascalia post
         
         Returns:
-            Dict con risultato: {success, container_id, media_id, error}
+            Dict con risultato: {success, container_id, media_id, shortcode, error}
         """
         result = {
             'success': False,
             'container_id': None,
             'media_id': None,
+            'shortcode': None,
             'error': None
         }
         
@@ -115,7 +272,9 @@ class InstagramPublisher:
         
         # Attendi processing (Instagram richiede 5-30 secondi)
         logger.info("Attendo processing container...")
-        await asyncio.sleep(10)
+        if not await self._poll_container_ready(container_id):
+            result['error'] = "Container non pronto per la pubblicazione"
+            return result
         
         # Step 2: Pubblica
         media_id = await self.publish_container(container_id)
@@ -124,34 +283,95 @@ class InstagramPublisher:
             return result
         
         result['media_id'] = media_id
+        result['shortcode'] = shortcode_cache.get(media_id)
         result['success'] = True
         
         return result
     
+    async def publish_carousel(self, image_urls: List[str], caption: str = "") -> dict:
+        """
+        Workflow carosello: elementi in parallelo + container padre + una sola pubblicazione
+
+        Args:
+            image_urls: URL pubblici delle immagini (da 2 a 10)
+            caption: Didascalia post
+
+        Returns:
+            Dict con risultato: {success, container_id, media_id, shortcode, error}
+        """
+        result = {
+            'success': False,
+            'container_id': None,
+            'media_id': None,
+            'shortcode': None,
+            'error': None
+        }
+
+        if not CAROUSEL_MIN_ITEMS <= len(image_urls) <= CAROUSEL_MAX_ITEMS:
+            result['error'] = f"Il carosello richiede da {CAROUSEL_MIN_ITEMS} a {CAROUSEL_MAX_ITEMS} immagini"
+            return result
+
+        # Step 1: Crea gli elementi in parallelo (Instagram li elabora contemporaneamente)
+        children = await asyncio.gather(*(self._create_item_container(url) for url in image_urls))
+        if not all(children):
+            result['error'] = "Errore creazione elementi carosello"
+            return result
+
+        # Step 2: Crea container padre
+        container_id = await self.create_carousel_container(children, caption)
+        if not container_id:
+            result['error'] = "Errore creazione container carosello"
+            return result
+
+        result['container_id'] = container_id
+
+        logger.info("Attendo processing carosello...")
+        if not await self._poll_container_ready(container_id):
+            result['error'] = "Container non pronto per la pubblicazione"
+            return result
+
+        # Step 3: Pubblica una sola volta
+        media_id = await self.publish_container(container_id)
+        if not media_id:
+            result['error'] = "Errore pubblicazione container"
+            return result
+
+        result['media_id'] = media_id
+        result['shortcode'] = shortcode_cache.get(media_id)
+        result['success'] = True
+
+        return result
+
     async def get_account_info(self) -> Optional[dict]:
         """Ottieni info account Instagram"""
+        cache_key = self._ep_account
+        info = account_info_cache.get(cache_key)
+        if info is not None:
+            return info
+
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{self.base_url}/{self.account_id}",
-                    params={
-                        "fields": "username,name,profile_picture_url,followers_count,follows_count,media_count",
-                        "access_token": self.access_token
-                    }
-                )
+            response = await get_client().get(
+                self._ep_account,
+                params={
+                    "fields": "username,name,profile_picture_url,followers_count,follows_count,media_count",
+                    "access_token": self.access_token
+                }
+            )
+            try:
+                response.raise_for_status()
+            except httpx.HTTPStatusError as he:
+                # Log full response body for easier debugging (Graph API returns JSON with message)
+                text = None
                 try:
-                    response.raise_for_status()
-                except httpx.HTTPStatusError as he:
-                    # Log full response body for easier debugging (Graph API returns JSON with message)
-                    text = None
-                    try:
-                        text = response.text
-                    except Exception:
-                        text = '<no response body available>'
-                    logger.error(f"Errore info account: HTTP {response.status_code} - {text}")
-                    return None
-
-                return response.json()
+                    text = response.text
+                except Exception:
+                    text = '<no response body available>'
+                logger.error(f"Errore info account: HTTP {response.status_code} - {text}")
+                return None
+
+            info = response.json()
+            account_info_cache.put(cache_key, info)
+            return info
         except httpx.RequestError as e:
             logger.error(f"Errore info account (request): {e}")
             return None
@@ -2,30 +2,51 @@
 Servizio per la gestione della programmazione dei post
 Usa database SQLite tramite services.database
 """
+import asyncio
+import json
 import logging
 from datetime import datetime
-from typing import List, Dict, Optional, Any
-from services.database import db
+from typing import Callable, List, Dict, Optional, Any, Union
+from services.database import Database, get_db
 
 logger = logging.getLogger(__name__)
 
+# Worker di pubblicazione in parallelo (limite per non saturare la Graph API)
+PUBLISH_CONCURRENCY = 5
+
+# Coda in memoria tra presa in carico (SQL) e worker di pubblicazione
+PUBLISH_QUEUE_SIZE = 100
+WORKERS_DRAIN_TIMEOUT = 30
+
+# Attesa massima tra due controlli anche senza post in coda (rete di sicurezza)
+MAX_IDLE_WAIT = 300
+
 
 class PostScheduler:
     """Gestore della programmazione dei post usando database SQLite"""
 
     def __init__(self):
         """Inizializza scheduler con database"""
-        self.db = db
+        # Creato dentro il loop asyncio al primo wait_for_next_due
+        self._wakeup: Optional[asyncio.Event] = None
+        # Coda e worker creati da start_workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
         logger.info("Scheduler inizializzato con database SQLite")
 
-    def schedule_post(self, user_id: int, image_url: str, caption: str,
+    @property
+    def db(self) -> Database:
+        """Database condiviso, aperto al primo accesso"""
+        return get_db()
+
+    def schedule_post(self, user_id: int, image_url: Union[str, List[str]], caption: str,
                      scheduled_time: datetime, telegram_message_id: int = None) -> str:
         """
         Programma un nuovo post
 
         Args:
             user_id: ID utente Telegram
-            image_url: URL dell'immagine
+            image_url: URL dell'immagine (lista di URL per un carosello)
             caption: Caption del post
             scheduled_time: Quando pubblicare
             telegram_message_id: ID messaggio Telegram originale
@@ -35,6 +56,10 @@ class PostScheduler:
         """
         post_id = f"{user_id}_{int(scheduled_time.timestamp())}_{telegram_message_id or 0}"
 
+        # I caroselli sono salvati come lista JSON nella stessa colonna
+        if not isinstance(image_url, str):
+            image_url = json.dumps(list(image_url))
+
         success = self.db.create_scheduled_post(
             post_id=post_id,
             user_id=user_id,
@@ -48,6 +73,8 @@ class PostScheduler:
             logger.info(f"Post programmato: {post_id} per {scheduled_time}")
             # Pulisci sessione utente dopo aver programmato il post
             self.db.clear_user_session(user_id)
+            # Il nuovo post potrebbe scadere prima di quello atteso
+            self.wake_up()
         else:
             logger.error(f"Errore programmazione post per utente {user_id}")
 
@@ -75,8 +102,21 @@ class PostScheduler:
         """
         return self.db.get_due_posts()
 
+    def claim_due_posts(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Prende in carico i post da pubblicare ora (status 'publishing')
+
+        Args:
+            limit: Numero massimo di post
+
+        Returns:
+            Lista di post presi in carico
+        """
+        return self.db.claim_due_posts(limit)
+
     def update_post_status(self, post_id: str, status: str,
-                          instagram_media_id: str = None, error_message: str = None):
+                          instagram_media_id: str = None, error_message: str = None,
+                          instagram_shortcode: str = None):
         """
         Aggiorna lo stato di un post
 
@@ -85,8 +125,21 @@ class PostScheduler:
             status: Nuovo status
             instagram_media_id: ID media Instagram (optional)
             error_message: Messaggio errore (optional)
+            instagram_shortcode: Shortcode del post pubblicato (optional)
         """
-        self.db.update_post_status(post_id, status, instagram_media_id, error_message)
+        self.db.update_post_status(post_id, status, instagram_media_id, error_message, instagram_shortcode)
+
+    def update_post_statuses(self, updates: List[tuple]) -> int:
+        """
+        Aggiorna lo stato di più post con un solo commit
+
+        Args:
+            updates: Tuple (post_id, status, instagram_media_id, error_message, instagram_shortcode)
+
+        Returns:
+            Numero di post aggiornati
+        """
+        return self.db.update_post_statuses(updates)
 
     def cancel_post(self, post_id: str, user_id: int) -> bool:
         """
@@ -113,53 +166,155 @@ class PostScheduler:
         """
         return self.db.get_post_by_id(post_id)
 
-    async def publish_due_posts(self, instagram_publisher):
+    def get_next_due_time(self) -> Optional[datetime]:
+        """
+        Ottieni l'orario del prossimo post da pubblicare
+
+        Returns:
+            Datetime del prossimo post o None se la coda è vuota
+        """
+        return self.db.get_next_due_time()
+
+    def wake_up(self):
+        """Interrompe l'attesa corrente per ricalcolare la prossima scadenza"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def wait_for_next_due(self, max_wait: float = MAX_IDLE_WAIT):
         """
-        Pubblica i post scaduti
+        Dorme fino alla scadenza del prossimo post (o fino a wake_up)
 
         Args:
-            instagram_publisher: Istanza di InstagramPublisher
+            max_wait: Attesa massima in secondi
         """
-        due_posts = self.get_due_posts()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.clear()
 
-        if not due_posts:
+        next_time = self.get_next_due_time()
+        if next_time is None:
+            delay = max_wait
+        else:
+            delay = min(max(0.0, (next_time - datetime.now()).total_seconds()), max_wait)
+
+        if delay <= 0:
             return
 
-        logger.info(f"Trovati {len(due_posts)} post da pubblicare")
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
 
-        for post in due_posts:
+    def start_workers(self, publisher_factory: Callable[[], Any], workers: int = PUBLISH_CONCURRENCY):
+        """
+        Avvia i worker che pubblicano i post messi in coda da dispatch_due_posts
+
+        Args:
+            publisher_factory: Restituisce l'InstagramPublisher da usare (chiamata per ogni post)
+            workers: Numero di worker, cioè di pubblicazioni contemporanee
+        """
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+        self._workers = [
+            asyncio.create_task(self._worker(publisher_factory), name=f"publish-worker-{i}")
+            for i in range(workers)
+        ]
+        logger.info(f"Avviati {workers} worker di pubblicazione")
+
+    async def stop_workers(self, timeout: float = WORKERS_DRAIN_TIMEOUT):
+        """
+        Attende lo svuotamento della coda (fino a timeout) e ferma i worker.
+        I post ancora in coda (mai inviati a Instagram) tornano 'scheduled'; quelli interrotti
+        a metà pubblicazione restano 'publishing' e diventano 'failed' al riavvio.
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Coda di pubblicazione non svuotata entro {timeout}s")
+
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+        requeued = []
+        while not self._queue.empty():
+            post = self._queue.get_nowait()
+            requeued.append((post['id'], 'scheduled', None, None, None))
+        if requeued:
+            self.update_post_statuses(requeued)
+            logger.info(f"{len(requeued)} post in coda riportati a 'scheduled'")
+        self._queue = None
+
+    async def _worker(self, publisher_factory: Callable[[], Any]):
+        """Consuma la coda: pubblica un post alla volta e ne salva lo stato"""
+        while True:
+            post = await self._queue.get()
             try:
-                logger.info(f"Pubblicazione post programmato: {post['id']}")
+                result = await self._publish_one(post, publisher_factory())
+                self.update_post_statuses([result])
+            except Exception as e:
+                logger.error(f"Errore worker pubblicazione post {post['id']}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def dispatch_due_posts(self) -> int:
+        """
+        Prende in carico i post scaduti e li mette in coda per i worker
+
+        Returns:
+            Numero di post messi in coda
+        """
+        due_posts = self.claim_due_posts()
+        for post in due_posts:
+            # Con la coda piena attende: i worker smaltiscono al ritmo consentito dall'API
+            await self._queue.put(post)
+
+        if due_posts:
+            logger.info(f"Messi in coda {len(due_posts)} post da pubblicare")
+        return len(due_posts)
+
+    async def _publish_one(self, post: Dict[str, Any], instagram_publisher) -> tuple:
+        """
+        Pubblica un singolo post programmato
+
+        Args:
+            post: Post preso in carico
+            instagram_publisher: Istanza di InstagramPublisher
 
-                # Pubblica su Instagram
+        Returns:
+            Tupla (post_id, status, instagram_media_id, error_message, instagram_shortcode) per update_post_statuses
+        """
+        try:
+            logger.info(f"Pubblicazione post programmato: {post['id']}")
+
+            # Pubblica su Instagram (lista JSON di URL = carosello)
+            image_url = post['image_url']
+            if image_url.startswith('['):
+                result = await instagram_publisher.publish_carousel(
+                    json.loads(image_url),
+                    post['caption'] or ""
+                )
+            else:
                 result = await instagram_publisher.publish_photo(
-                    post['image_url'],
+                    image_url,
                     post['caption'] or ""
                 )
 
-                if result['success']:
-                    self.update_post_status(
-                        post['id'],
-                        'published',
-                        result.get('media_id')
-                    )
-                    logger.info(f"Post {post['id']} pubblicato con successo")
-                else:
-                    error_msg = result.get('error', 'Errore sconosciuto')
-                    self.update_post_status(
-                        post['id'],
-                        'failed',
-                        error_message=error_msg
-                    )
-                    logger.error(f"Errore pubblicazione post {post['id']}: {error_msg}")
+            if result['success']:
+                logger.info(f"Post {post['id']} pubblicato con successo")
+                return (post['id'], 'published', result.get('media_id'), None, result.get('shortcode'))
 
-            except Exception as e:
-                logger.error(f"Errore pubblicazione post {post['id']}: {e}")
-                self.update_post_status(
-                    post['id'],
-                    'failed',
-                    error_message=str(e)
-                )
+            error_msg = result.get('error', 'Errore sconosciuto')
+            logger.error(f"Errore pubblicazione post {post['id']}: {error_msg}")
+            return (post['id'], 'failed', None, error_msg, None)
+
+        except Exception as e:
+            logger.error(f"Errore pubblicazione post {post['id']}: {e}")
+            return (post['id'], 'failed', None, str(e), None)
 
 
 # Istanza globale del scheduler
@@ -2,32 +2,75 @@
 Servizio asincrono per upload immagini su Steem blockchain
 """
 import asyncio
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from typing import Optional
 from beem import Steem
 from beem.imageuploader import ImageUploader
 import logging
-import requests
 import time
 
+from utils.steem_nodes import (
+    DEEP_CHECK_NODES, GOOD_ENOUGH_LATENCY, MAX_PROBED_NODES, PROBE_TIMEOUT, RPC_PROBE_PAYLOAD,
+    SERVER_LIST_TTL, http_session, invalidate_cached_node, load_cached_node, save_cached_node,
+)
+
 logger = logging.getLogger(__name__)
 
+# Thread pool dedicato a beem (upload e test nodi), separato dall'executor di default
+STEEM_IO_WORKERS = 4
+_steem_pool: Optional[ThreadPoolExecutor] = None
+
+
+def get_steem_pool() -> ThreadPoolExecutor:
+    """Restituisce il thread pool condiviso per le operazioni beem, creandolo al primo utilizzo"""
+    global _steem_pool
+    if _steem_pool is None:
+        _steem_pool = ThreadPoolExecutor(max_workers=STEEM_IO_WORKERS, thread_name_prefix="steem-io")
+    return _steem_pool
+
+
+def shutdown_steem_pool():
+    """Chiude il thread pool beem (da chiamare allo shutdown)"""
+    global _steem_pool
+    if _steem_pool is not None:
+        _steem_pool.shutdown(wait=False, cancel_futures=True)
+    _steem_pool = None
+
 
 class SteemNodeTester:
     """Classe per testare e trovare il nodo Steem più veloce"""
 
+    # Lista nodi condivisa tra le istanze (il lock evita download multipli all'avvio)
+    _server_list_cache = {'data': None, 'fetched_at': 0.0}
+    _server_list_lock = threading.Lock()
+
     def __init__(self):
         self.fastest_node = None
+        self.fastest_time = float('inf')
         self.blacklist = set()
+        # test_node/check_rpc girano su più thread durante find_fastest_node
+        self._blacklist_lock = threading.Lock()
 
     def get_steem_servers(self) -> Optional[list[str]]:
-        """Ottiene lista nodi Steem disponibili"""
+        """Ottiene lista nodi Steem disponibili (in cache per SERVER_LIST_TTL secondi)"""
+        cache = self._server_list_cache
+        with self._server_list_lock:
+            if cache['data'] and time.monotonic() - cache['fetched_at'] < SERVER_LIST_TTL:
+                return cache['data']
+            return self._fetch_steem_servers()
+
+    def _fetch_steem_servers(self) -> Optional[list[str]]:
+        """Scarica la lista nodi e aggiorna la cache"""
         url = "https://steem.senior.workers.dev/"
         try:
-            response = requests.get(url, timeout=10)
+            response = http_session.get(url, timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 steem_servers = data.get('__steem_servers__', [])
                 logger.info(f"Trovati {len(steem_servers)} nodi Steem disponibili")
+                self._server_list_cache.update(data=steem_servers, fetched_at=time.monotonic())
                 return steem_servers
             else:
                 logger.warning(f"Errore richiesta server: {response.status_code}")
@@ -37,33 +80,50 @@ class SteemNodeTester:
             return None
 
     def test_node(self, node: str) -> float:
-        """Testa velocità di un singolo nodo"""
-        if node in self.blacklist:
-            return float('inf')
+        """Misura la latenza di un singolo nodo con una richiesta HEAD"""
+        with self._blacklist_lock:
+            if node in self.blacklist:
+                return float('inf')
 
         try:
-            # Test connessione HTTP
-            response = requests.get(node, timeout=5)
-            if response.status_code != 200:
+            start_time = time.monotonic()
+            response = http_session.head(node, timeout=PROBE_TIMEOUT)
+            response_time = time.monotonic() - start_time
+            if response.status_code >= 500:
                 raise Exception(f"Nodo {node} status {response.status_code}")
 
-            # Test connessione blockchain
-            steem = Steem(node=node)
-            start_time = time.time()
-            steem.get_config()
-            end_time = time.time()
-
-            response_time = end_time - start_time
             logger.debug(f"Nodo {node}: {response_time:.3f}s")
             return response_time
 
         except Exception as e:
             logger.debug(f"Errore test nodo {node}: {e}")
-            self.blacklist.add(node)
+            with self._blacklist_lock:
+                self.blacklist.add(node)
             return float('inf')
 
-    def find_fastest_node(self, fallback_nodes: list[str] = None) -> Optional[str]:
-        """Trova il nodo più veloce disponibile"""
+    def check_rpc(self, node: str) -> bool:
+        """Verifica che il nodo risponda alle RPC (get_dynamic_global_properties, risposta di ~1 KB)"""
+        try:
+            # JSON-RPC diretta: niente costruzione di un client beem per ogni nodo
+            response = http_session.post(node, json=RPC_PROBE_PAYLOAD, timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            if 'head_block_number' not in (response.json().get('result') or {}):
+                raise Exception(f"risposta RPC non valida: {response.text[:100]}")
+            return True
+        except Exception as e:
+            logger.debug(f"Errore RPC nodo {node}: {e}")
+            with self._blacklist_lock:
+                self.blacklist.add(node)
+            return False
+
+    def find_fastest_node(self, fallback_nodes: list[str] = None, deep_check: bool = False) -> Optional[str]:
+        """
+        Trova il nodo più veloce disponibile
+
+        Args:
+            fallback_nodes: Nodi da usare se la lista dinamica non è disponibile
+            deep_check: Se True verifica con get_dynamic_global_properties i primi nodi che rispondono
+        """
         nodes = self.get_steem_servers()
         
         # Se non riusciamo a ottenere la lista dinamica, usa i nodi di fallback
@@ -71,19 +131,46 @@ class SteemNodeTester:
             logger.info("Uso nodi di fallback")
             nodes = fallback_nodes or ['https://api.steemit.com', 'https://api.steemdb.com']
 
-        fastest_time = float('inf')
-        fastest_node = None
-
         logger.info("Ricerca del nodo più veloce...")
-        for node in nodes[:10]:  # Testa solo i primi 10 per velocità
-            response_time = self.test_node(node)
-            if response_time < fastest_time:
-                fastest_time = response_time
-                fastest_node = node
+        # Test in parallelo (solo I/O): i primi nodi a rispondere sono i più veloci
+        candidates = nodes[:MAX_PROBED_NODES]
+        wanted = DEEP_CHECK_NODES if deep_check else 1
+        responders = []
+        pool = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="steem-probe")
+        try:
+            futures = {pool.submit(self.test_node, node): node for node in candidates}
+            pending = set(futures)
+            start = time.monotonic()
+            while pending and len(responders) < wanted:
+                # Con almeno un nodo valido si attendono altri candidati solo entro GOOD_ENOUGH_LATENCY
+                timeout = None
+                if responders:
+                    timeout = max(0.0, GOOD_ENOUGH_LATENCY - (time.monotonic() - start))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    response_time = future.result()
+                    if response_time < float('inf'):
+                        responders.append((response_time, futures[future]))
+        finally:
+            # I test ancora in corso terminano da soli entro il loro timeout
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        if deep_check and responders:
+            # Verifiche RPC in parallelo: il costo è quello del nodo più lento, non la somma
+            with ThreadPoolExecutor(max_workers=len(responders), thread_name_prefix="steem-rpc") as rpc_pool:
+                rpc_ok = list(rpc_pool.map(self.check_rpc, [node for _, node in responders]))
+            responders = [r for r, ok in zip(responders, rpc_ok) if ok]
+
+        # Distribuzione delle latenze misurate (utile per tarare GOOD_ENOUGH_LATENCY)
+        logger.debug(f"Latenze nodi Steem: {sorted(round(t, 3) for t, _ in responders)}")
+        fastest_time, fastest_node = min(responders, default=(float('inf'), None))
 
         if fastest_node:
             logger.info(f"✅ Nodo più veloce: {fastest_node} ({fastest_time:.3f}s)")
             self.fastest_node = fastest_node
+            self.fastest_time = fastest_time
         else:
             logger.warning("⚠️ Nessun nodo disponibile trovato")
 
@@ -109,15 +196,37 @@ class SteemUploader:
         self.auto_find_fastest = auto_find_fastest
         self.active_nodes = nodes.copy()
         self.node_tester = SteemNodeTester()
+        self._nodes_stale = False
+        # Connessione Steem e uploader per thread del pool steem-io (beem non è thread-safe):
+        # ogni thread li crea al primo upload e li riusa finché la generazione non cambia
+        self._local = threading.local()
+        self._client_generation = 0
+        self._client_lock = threading.Lock()
         
         # Se abilitato, trova il nodo più veloce all'inizializzazione
         if auto_find_fastest:
             self._update_fastest_node()
 
-    def _update_fastest_node(self):
-        """Aggiorna al nodo più veloce disponibile"""
+    def _update_fastest_node(self, force: bool = False):
+        """
+        Aggiorna al nodo più veloce disponibile
+
+        Args:
+            force: Se True ignora la cache su disco e ripete i test sui nodi
+        """
+        self._nodes_stale = False
         try:
-            fastest = self.node_tester.find_fastest_node(self.fallback_nodes)
+            fastest = None if force else load_cached_node()
+            if fastest:
+                logger.info(f"Nodo più veloce da cache: {fastest}")
+            else:
+                fastest = self.node_tester.find_fastest_node(self.fallback_nodes)
+                if fastest:
+                    save_cached_node(fastest, self.node_tester.fastest_time)
+
+            # I nodi cambiano: la connessione verrà ricreata al prossimo upload
+            self._reset_client()
+
             if fastest:
                 # Metti il nodo più veloce in testa alla lista
                 self.active_nodes = [fastest] + [n for n in self.fallback_nodes if n != fastest]
@@ -129,10 +238,10 @@ class SteemUploader:
             logger.warning(f"Errore ricerca nodo veloce: {e}, uso fallback")
             self.active_nodes = self.fallback_nodes
 
-    async def update_fastest_node_async(self):
+    async def update_fastest_node_async(self, force: bool = False):
         """Versione asincrona di update_fastest_node"""
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, self._update_fastest_node)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(get_steem_pool(), self._update_fastest_node, force)
 
     async def upload_image(self, file_path: str) -> Optional[str]:
         """
@@ -144,37 +253,60 @@ class SteemUploader:
         Returns:
             URL immagine su images.steem.blog o None se errore
         """
+        # Dopo un upload fallito il nodo in cache non è più affidabile: nuovo test
+        if self._nodes_stale and self.auto_find_fastest:
+            await self.update_fastest_node_async(force=True)
+
         try:
             # beem è sincrono, quindi eseguiamo in thread pool
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             url = await loop.run_in_executor(
-                None,
+                get_steem_pool(),
                 self._upload_sync,
                 file_path
             )
             return url
         except Exception as e:
             logger.error(f"Errore upload Steem: {e}")
+            invalidate_cached_node()
+            self._nodes_stale = True
             return None
 
+    def _ensure_client(self) -> ImageUploader:
+        """Restituisce l'ImageUploader del thread corrente, creandolo se manca o è stato scartato"""
+        local = self._local
+        generation = self._client_generation
+        if getattr(local, 'generation', None) != generation:
+            steem = Steem(
+                node=self.active_nodes,
+                keys=[self.wif]
+            )
+            local.uploader = ImageUploader(blockchain_instance=steem)
+            local.generation = generation
+        return local.uploader
+
+    def _reset_client(self):
+        """Scarta le connessioni di tutti i thread (ricreate al prossimo upload)"""
+        with self._client_lock:
+            self._client_generation += 1
+
     def _upload_sync(self, file_path: str) -> str:
         """Upload sincrono (eseguito in thread pool)"""
         logger.info(f"📤 Upload immagine: {file_path}")
         logger.info(f"👤 Username: {self.username}")
         logger.info(f"🌐 Nodi: {self.active_nodes[:2]}")
         
-        # Inizializza connessione Steem
-        steem = Steem(
-            node=self.active_nodes,
-            keys=[self.wif]
-        )
-
-        # Upload immagine
-        uploader = ImageUploader(blockchain_instance=steem)
-        result = uploader.upload(
-            file_path,
-            self.username
-        )
+        # Upload immagine con la connessione Steem del thread
+        uploader = self._ensure_client()
+        try:
+            result = uploader.upload(
+                file_path,
+                self.username
+            )
+        except Exception:
+            # Il nodo potrebbe non rispondere più: nuova connessione al prossimo upload
+            self._reset_client()
+            raise
 
         logger.info("✅ Immagine caricata con successo!")
         logger.info(f"🔗 URL: {result['url']}")
@@ -185,9 +317,9 @@ class SteemUploader:
     async def test_connection(self) -> bool:
         """Test connessione ai nodi"""
         try:
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             await loop.run_in_executor(
-                None,
+                get_steem_pool(),
                 self._test_connection_sync
             )
             return True
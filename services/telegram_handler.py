@@ -11,22 +11,32 @@ Funzionalità:
 
 import os
 import logging
+import tempfile
 from typing import Dict, Any, Optional, Callable, List
 from datetime import datetime
 import requests
+from requests.adapters import HTTPAdapter
+
+from utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Cartella per i download senza save_path
+TEMP_DIR = tempfile.gettempdir()
+# Il file_path restituito da getFile vale circa un'ora: la cache resta sotto quel limite
+FILE_INFO_TTL = 3000
+
 
 class TelegramHandler:
     """Gestisce interazioni con Telegram Bot API"""
     
-    def __init__(self, bot_token: str = None):
+    def __init__(self, bot_token: str = None, session: requests.Session = None):
         """
         Inizializza Telegram Handler
         
         Args:
             bot_token: Token del bot Telegram (da @BotFather)
+            session: Sessione HTTP per le chiamate Bot API (default: nuova sessione con pooling)
         """
         self.bot_token = bot_token or os.getenv("TELEGRAM_BOT_TOKEN")
         if not self.bot_token:
@@ -34,6 +44,25 @@ class TelegramHandler:
         
         self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
         self.file_url = f"https://api.telegram.org/file/bot{self.bot_token}"
+        # Endpoint precalcolati (niente formattazione a ogni chiamata)
+        self._ep_get_me = f"{self.base_url}/getMe"
+        self._ep_send_message = f"{self.base_url}/sendMessage"
+        self._ep_get_file = f"{self.base_url}/getFile"
+        self._ep_set_webhook = f"{self.base_url}/setWebhook"
+        self._ep_delete_webhook = f"{self.base_url}/deleteWebhook"
+        
+        # Connessioni keep-alive verso api.telegram.org: chiamate brevi e download
+        # usano pool separati, così un download lungo non blocca sendMessage
+        self.session = session or self._create_session(pool_maxsize=16)
+        self.download_session = self._create_session(pool_maxsize=4)
+        self._file_info_cache = TTLCache(maxsize=1024, ttl=FILE_INFO_TTL)
+    
+    @staticmethod
+    def _create_session(pool_maxsize: int) -> requests.Session:
+        """Crea una sessione HTTP con connection pooling"""
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize))
+        return session
     
     def get_me(self) -> Dict[str, Any]:
         """
@@ -43,7 +72,7 @@ class TelegramHandler:
             dict: Info bot (id, username, first_name, etc.)
         """
         try:
-            response = requests.get(f"{self.base_url}/getMe", timeout=10)
+            response = self.session.get(self._ep_get_me, timeout=10)
             response.raise_for_status()
             
             result = response.json()
@@ -77,7 +106,7 @@ class TelegramHandler:
             if parse_mode:
                 params["parse_mode"] = parse_mode
             
-            response = requests.post(f"{self.base_url}/sendMessage", json=params, timeout=10)
+            response = self.session.post(self._ep_send_message, json=params, timeout=10)
             response.raise_for_status()
             
             result = response.json()
@@ -93,7 +122,7 @@ class TelegramHandler:
     
     def get_file_info(self, file_id: str) -> Dict[str, Any]:
         """
-        Ottiene informazioni su un file
+        Ottiene informazioni su un file (in cache per FILE_INFO_TTL secondi)
         
         Args:
             file_id: ID del file
@@ -101,13 +130,18 @@ class TelegramHandler:
         Returns:
             dict: Info file (file_path, file_size, etc.)
         """
+        info = self._file_info_cache.get(file_id)
+        if info is not None:
+            return info
+        
         try:
             params = {"file_id": file_id}
-            response = requests.get(f"{self.base_url}/getFile", params=params, timeout=10)
+            response = self.session.get(self._ep_get_file, params=params, timeout=10)
             response.raise_for_status()
             
             result = response.json()
             if result.get("ok"):
+                self._file_info_cache.put(file_id, result["result"])
                 return result["result"]
             else:
                 raise Exception(f"API error: {result.get('description')}")
@@ -137,19 +171,17 @@ class TelegramHandler:
             
             # Download
             download_url = f"{self.file_url}/{file_path}"
-            response = requests.get(download_url, stream=True, timeout=30)
+            response = self.download_session.get(download_url, stream=True, timeout=30)
             response.raise_for_status()
             
             # Determina percorso salvataggio
             if not save_path:
-                import tempfile
-                from pathlib import Path
-                file_ext = Path(file_path).suffix or '.jpg'
-                save_path = os.path.join(tempfile.gettempdir(), f"telegram_{file_id[:10]}{file_ext}")
+                file_ext = os.path.splitext(file_path)[1] or '.jpg'
+                save_path = os.path.join(TEMP_DIR, f"telegram_{file_id[:10]}{file_ext}")
             
             # Salva file
             with open(save_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
+                for chunk in response.iter_content(chunk_size=64 * 1024):
                     f.write(chunk)
             
             logger.info(f"✅ File salvato: {save_path}")
@@ -222,25 +254,29 @@ class TelegramHandler:
             dict: Dati estratti (file_id, caption, chat_id, etc.)
         """
         try:
-            message = update.get("message", {})
+            # Sotto-oggetti letti una sola volta
+            message = update.get("message") or {}
+            sender = message.get("from") or {}
+            chat = message.get("chat") or {}
+            photos = message.get("photo")
             
             result = {
                 "update_id": update.get("update_id"),
                 "message_id": message.get("message_id"),
-                "chat_id": self.extract_chat_id(message),
-                "user_id": message.get("from", {}).get("id"),
-                "username": message.get("from", {}).get("username"),
+                "chat_id": chat.get("id") or sender.get("id"),
+                "user_id": sender.get("id"),
+                "username": sender.get("username"),
                 "text": message.get("text"),
-                "caption": self.extract_caption(message),
+                "caption": message.get("caption"),
                 "date": message.get("date"),
-                "has_photo": "photo" in message,
+                "has_photo": photos is not None,
                 "file_id": None
             }
             
             # Estrai file_id se presente foto
-            if result["has_photo"]:
-                result["file_id"] = self.extract_photo_file_id(message, quality="high")
-                result["photo_sizes"] = len(message.get("photo", []))
+            if photos is not None:
+                result["file_id"] = photos[-1]["file_id"] if photos else None
+                result["photo_sizes"] = len(photos)
             
             return result
             
@@ -248,13 +284,19 @@ class TelegramHandler:
             logger.error(f"Errore processing update: {e}")
             raise
     
-    def set_webhook(self, webhook_url: str, allowed_updates: List[str] = None) -> bool:
+    def set_webhook(self, webhook_url: str, allowed_updates: List[str] = None,
+                    max_connections: int = 100, drop_pending_updates: bool = False,
+                    secret_token: Optional[str] = None) -> bool:
         """
         Configura webhook per ricevere update
         
         Args:
             webhook_url: URL pubblico dove ricevere webhook
             allowed_updates: Lista tipi update da ricevere (es. ['message', 'edited_message'])
+            max_connections: Connessioni HTTPS simultanee di Telegram verso il webhook (1-100,
+                default Telegram 40). Tenerlo allineato ai worker del server che riceve gli update
+            drop_pending_updates: Scarta gli update in coda
+            secret_token: Token inviato da Telegram nell'header X-Telegram-Bot-Api-Secret-Token
             
         Returns:
             bool: True se configurato con successo
@@ -264,8 +306,14 @@ class TelegramHandler:
             
             if allowed_updates:
                 params["allowed_updates"] = allowed_updates
+            if max_connections != 40:
+                params["max_connections"] = max_connections
+            if drop_pending_updates:
+                params["drop_pending_updates"] = True
+            if secret_token:
+                params["secret_token"] = secret_token
             
-            response = requests.post(f"{self.base_url}/setWebhook", json=params, timeout=10)
+            response = self.session.post(self._ep_set_webhook, json=params, timeout=10)
             response.raise_for_status()
             
             result = response.json()
@@ -287,7 +335,7 @@ class TelegramHandler:
             bool: True se rimosso con successo
         """
         try:
-            response = requests.post(f"{self.base_url}/deleteWebhook", timeout=10)
+            response = self.session.post(self._ep_delete_webhook, timeout=10)
             response.raise_for_status()
             
             result = response.json()
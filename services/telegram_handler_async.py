@@ -0,0 +1,411 @@
+"""
+Telegram Handler asincrono - chiamate Bot API con httpx.AsyncClient
+
+Stesse operazioni di services.telegram_handler, ma senza bloccare l'event loop:
+più invii e download possono procedere in parallelo sulla stessa connessione pool.
+"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import logging
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiofiles
+import httpx
+
+from utils.ttl_cache import TTLCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 (pacchetto h2, incluso in httpx[http2]): le chiamate Bot API condividono una connessione multiplexata
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Chiamate contemporanee in send_many/download_many (sotto i limiti per bot di Telegram)
+BULK_CONCURRENCY = 8
+# Richieste contemporanee verso api.telegram.org per istanza, da qualunque metodo provengano
+HOST_CONCURRENCY = 8
+# Tentativi aggiuntivi dopo una risposta 429 (Too Many Requests)
+MAX_RETRIES = 3
+# Long polling: Telegram tiene aperta getUpdates fino a LONG_POLL_TIMEOUT secondi
+LONG_POLL_TIMEOUT = 30
+DEFAULT_ALLOWED_UPDATES = ("message", "callback_query")
+# Download: blocchi da 64 KiB; sopra RANGED_MIN_SIZE il file è scaricato in RANGED_PARTS richieste Range parallele
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+RANGED_MIN_SIZE = 4 * 1024 * 1024
+RANGED_PARTS = 4
+# Cartella per i download senza save_path
+TEMP_DIR = tempfile.gettempdir()
+# Il file_path restituito da getFile vale circa un'ora: la cache resta sotto quel limite
+FILE_INFO_TTL = 3000
+
+
+def _json_loads(data: bytes) -> Any:
+    """Deserializza una risposta Bot API (orjson se disponibile, altrimenti json)"""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_body(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Argomenti httpx per un corpo JSON serializzato con orjson se disponibile"""
+    if orjson:
+        return {"content": orjson.dumps(payload), "headers": {"Content-Type": "application/json"}}
+    return {"json": payload}
+
+
+class _RangeNotSupported(Exception):
+    """Il server ha risposto 200 invece di 206 a una richiesta Range"""
+
+
+class TelegramHandler:
+    """Gestisce interazioni con Telegram Bot API (async)"""
+
+    def __init__(self, bot_token: str = None):
+        """
+        Inizializza Telegram Handler
+
+        Args:
+            bot_token: Token del bot Telegram (da @BotFather)
+        """
+        self.bot_token = bot_token or os.getenv("TELEGRAM_BOT_TOKEN")
+        if not self.bot_token:
+            raise ValueError("TELEGRAM_BOT_TOKEN non configurato")
+
+        self.base_url = f"https://api.telegram.org/bot{self.bot_token}"
+        self.file_url = f"https://api.telegram.org/file/bot{self.bot_token}"
+        self._client: Optional[httpx.AsyncClient] = None
+        # Pool separato per getUpdates: la richiesta resta appesa e non deve occupare il pool degli invii
+        self._poll_client: Optional[httpx.AsyncClient] = None
+        # Creato al primo utilizzo, dentro l'event loop
+        self._host_limit: Optional[asyncio.Semaphore] = None
+        self._file_info_cache = TTLCache(maxsize=1024, ttl=FILE_INFO_TTL)
+        # getFile in corso per file_id: le chiamate concorrenti attendono lo stesso task
+        self._file_info_inflight: Dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Client httpx dell'istanza, creato al primo utilizzo"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                http2=HTTP2_AVAILABLE,
+                timeout=10.0,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16)
+            )
+        return self._client
+
+    @property
+    def poll_client(self) -> httpx.AsyncClient:
+        """Client httpx dedicato al long polling, creato al primo utilizzo"""
+        if self._poll_client is None or self._poll_client.is_closed:
+            self._poll_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=LONG_POLL_TIMEOUT + 10,
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=1)
+            )
+        return self._poll_client
+
+    @property
+    def host_limit(self) -> asyncio.Semaphore:
+        """Semaforo che limita le richieste contemporanee verso Telegram (HOST_CONCURRENCY)"""
+        if self._host_limit is None:
+            self._host_limit = asyncio.Semaphore(HOST_CONCURRENCY)
+        return self._host_limit
+
+    async def aclose(self):
+        """Chiude i client httpx (da chiamare allo shutdown)"""
+        for client in (self._client, self._poll_client):
+            if client is not None and not client.is_closed:
+                await client.aclose()
+        self._client = None
+        self._poll_client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    @staticmethod
+    def _result(response: httpx.Response) -> Any:
+        """Estrae 'result' dalla risposta Bot API o solleva l'errore restituito"""
+        response.raise_for_status()
+        result = _json_loads(response.content)
+        if result.get("ok"):
+            return result["result"]
+        raise Exception(f"API error: {result.get('description')}")
+
+    @staticmethod
+    def _retry_after(response: httpx.Response, attempt: int) -> float:
+        """Attesa richiesta da Telegram dopo un 429 (backoff esponenziale se assente)"""
+        try:
+            retry_after = _json_loads(response.content).get("parameters", {}).get("retry_after")
+        except ValueError:
+            retry_after = None
+        retry_after = retry_after or response.headers.get("Retry-After")
+        return float(retry_after) if retry_after else float(2 ** attempt)
+
+    async def _request(self, method: str, path: str, **kwargs) -> Any:
+        """Chiamata Bot API che ripete la richiesta dopo un 429 rispettando retry_after"""
+        # L'attesa dopo un 429 avviene tenendo il posto nel semaforo: le altre chiamate rallentano con essa
+        async with self.host_limit:
+            for attempt in range(MAX_RETRIES + 1):
+                response = await self.client.request(method, path, **kwargs)
+                if response.status_code == 429 and attempt < MAX_RETRIES:
+                    delay = self._retry_after(response, attempt)
+                    logger.warning(f"Rate limit Telegram su {path}, nuovo tentativo tra {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                return self._result(response)
+
+    async def get_me(self) -> Dict[str, Any]:
+        """
+        Ottiene informazioni sul bot
+
+        Returns:
+            dict: Info bot (id, username, first_name, etc.)
+        """
+        try:
+            return await self._request("GET", "/getMe")
+        except Exception as e:
+            logger.error(f"Errore getMe: {e}")
+            raise
+
+    async def send_message(self, chat_id: int, text: str, parse_mode: str = None) -> Dict[str, Any]:
+        """
+        Invia messaggio di testo a una chat
+
+        Args:
+            chat_id: ID della chat destinatario
+            text: Testo del messaggio
+            parse_mode: Formato testo ('Markdown', 'HTML', None)
+
+        Returns:
+            dict: Messaggio inviato
+        """
+        try:
+            params = {
+                "chat_id": chat_id,
+                "text": text
+            }
+
+            if parse_mode:
+                params["parse_mode"] = parse_mode
+
+            message = await self._request("POST", "/sendMessage", **_json_body(params))
+            logger.info(f"✅ Messaggio inviato a {chat_id}")
+            return message
+
+        except Exception as e:
+            logger.error(f"Errore invio messaggio: {e}")
+            raise
+
+    async def get_file_info(self, file_id: str) -> Dict[str, Any]:
+        """
+        Ottiene informazioni su un file (in cache per FILE_INFO_TTL secondi)
+
+        Args:
+            file_id: ID del file
+
+        Returns:
+            dict: Info file (file_path, file_size, etc.)
+        """
+        info = self._file_info_cache.get(file_id)
+        if info is not None:
+            return info
+
+        task = self._file_info_inflight.get(file_id)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_file_info(file_id))
+            self._file_info_inflight[file_id] = task
+            task.add_done_callback(lambda _: self._file_info_inflight.pop(file_id, None))
+
+        # shield: la cancellazione di un chiamante non interrompe la richiesta degli altri
+        return await asyncio.shield(task)
+
+    async def _fetch_file_info(self, file_id: str) -> Dict[str, Any]:
+        """Chiama getFile e salva il risultato in cache"""
+        try:
+            info = await self._request("GET", "/getFile", params={"file_id": file_id})
+        except Exception as e:
+            logger.error(f"Errore getFile: {e}")
+            raise
+        self._file_info_cache.put(file_id, info)
+        return info
+
+    async def download_file(self, file_id: str, save_path: str = None) -> str:
+        """
+        Scarica un file da Telegram scrivendolo su disco in streaming
+
+        Args:
+            file_id: ID del file da scaricare
+            save_path: Percorso dove salvare (opzionale)
+
+        Returns:
+            str: Percorso del file scaricato
+        """
+        try:
+            # Ottieni info file
+            file_info = await self.get_file_info(file_id)
+            file_path = file_info["file_path"]
+            file_size = file_info.get("file_size", 0)
+
+            logger.info(f"📥 Download file: {file_path} ({file_size} bytes)")
+
+            # Determina percorso salvataggio
+            if not save_path:
+                file_ext = os.path.splitext(file_path)[1] or '.jpg'
+                save_path = os.path.join(TEMP_DIR, f"telegram_{file_id[:10]}{file_ext}")
+
+            # Download
+            url = f"{self.file_url}/{file_path}"
+            if file_size >= RANGED_MIN_SIZE:
+                try:
+                    await self._download_ranged(url, file_size, save_path)
+                except _RangeNotSupported:
+                    await self._download_stream(url, save_path)
+            else:
+                await self._download_stream(url, save_path)
+
+            logger.info(f"✅ File salvato: {save_path}")
+            return save_path
+
+        except Exception as e:
+            logger.error(f"Errore download file: {e}")
+            raise
+
+    async def _download_stream(self, url: str, save_path: str):
+        """Scarica url in streaming su save_path con una sola richiesta"""
+        async with self.host_limit, self.client.stream("GET", url, timeout=30.0) as response:
+            response.raise_for_status()
+            async with aiofiles.open(save_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+
+    async def _download_ranged(self, url: str, file_size: int, save_path: str):
+        """
+        Scarica url in RANGED_PARTS richieste Range parallele, ognuna scritta al proprio offset
+
+        Raises:
+            _RangeNotSupported: se il server ignora l'header Range
+        """
+        part_size = -(-file_size // RANGED_PARTS)
+
+        # Pre-alloca il file così ogni parte può scrivere al suo offset
+        async with aiofiles.open(save_path, 'wb') as f:
+            await f.truncate(file_size)
+
+        async def download_part(start: int):
+            end = min(start + part_size, file_size) - 1
+            headers = {"Range": f"bytes={start}-{end}"}
+            async with self.host_limit, self.client.stream("GET", url, headers=headers, timeout=30.0) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise _RangeNotSupported()
+                async with aiofiles.open(save_path, 'r+b') as f:
+                    await f.seek(start)
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+
+        # Attende tutte le parti prima di propagare un errore (niente scritture dopo il fallback)
+        results = await asyncio.gather(
+            *(download_part(start) for start in range(0, file_size, part_size)),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+    async def poll_updates(self, offset: int = 0, timeout: int = LONG_POLL_TIMEOUT,
+                           allowed_updates=DEFAULT_ALLOWED_UPDATES) -> List[Dict[str, Any]]:
+        """
+        Recupera gli update con long polling (una richiesta resta aperta finché arriva un update)
+
+        Args:
+            offset: ID del primo update da ricevere (ultimo update_id + 1)
+            timeout: Secondi di attesa lato Telegram se non ci sono update
+            allowed_updates: Tipi di update da ricevere
+
+        Returns:
+            list: Update ricevuti (vuota se scade il timeout)
+        """
+        try:
+            response = await self.poll_client.get(
+                "/getUpdates",
+                params={
+                    "offset": offset,
+                    "timeout": timeout,
+                    "allowed_updates": json.dumps(list(allowed_updates))
+                },
+                timeout=timeout + 10
+            )
+            return self._result(response)
+        except Exception as e:
+            logger.error(f"Errore getUpdates: {e}")
+            raise
+
+    async def send_many(self, messages: List[Tuple[int, str]], parse_mode: str = None) -> List[Any]:
+        """
+        Invia più messaggi in parallelo (al massimo BULK_CONCURRENCY alla volta)
+
+        Args:
+            messages: Coppie (chat_id, testo)
+            parse_mode: Formato testo per tutti i messaggi
+
+        Returns:
+            list: Messaggio inviato o eccezione, nello stesso ordine dell'input
+        """
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+        async def send(chat_id: int, text: str):
+            async with semaphore:
+                return await self.send_message(chat_id, text, parse_mode)
+
+        return await asyncio.gather(
+            *(send(chat_id, text) for chat_id, text in messages),
+            return_exceptions=True
+        )
+
+    async def download_many(self, file_ids: List[str]) -> List[Any]:
+        """
+        Scarica più file in parallelo (al massimo BULK_CONCURRENCY alla volta)
+
+        Args:
+            file_ids: ID dei file da scaricare
+
+        Returns:
+            list: Percorso del file scaricato o eccezione, nello stesso ordine dell'input
+        """
+        semaphore = asyncio.Semaphore(BULK_CONCURRENCY)
+
+        async def download(file_id: str):
+            async with semaphore:
+                return await self.download_file(file_id)
+
+        return await asyncio.gather(
+            *(download(file_id) for file_id in file_ids),
+            return_exceptions=True
+        )
+
+
+# Esempio di utilizzo
+if __name__ == "__main__":
+    import asyncio
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def test():
+        async with TelegramHandler() as handler:
+            bot_info = await handler.get_me()
+            print(f"🤖 Bot: @{bot_info.get('username')}")
+            print(f"📝 Nome: {bot_info.get('first_name')}")
+
+    asyncio.run(test())
@@ -10,6 +10,8 @@ Features:
 Security note: This script will overwrite the INSTAGRAM_ACCESS_TOKEN value in .env. Keep .env secure.
 """
 import asyncio
+import os
+import re
 import time
 import httpx
 import logging
@@ -18,6 +20,8 @@ from typing import Optional
 from dotenv import dotenv_values
 
 from config import config
+# Shared httpx client (same pool as the publisher): reuses keep-alive connections to graph.facebook.com
+from services.instagram_publisher_async import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +29,46 @@ BASE_URL = f"https://graph.facebook.com/{config.instagram.graph_api_version}"
 
 ENV_PATH = Path('.env')
 
+# INSTAGRAM_ACCESS_TOKEN=... lines (leading whitespace allowed), one pass over the whole file
+_TOKEN_LINE_RE = re.compile(r'^[ \t]*INSTAGRAM_ACCESS_TOKEN=.*$', re.M)
 
-async def debug_token(token: str) -> Optional[dict]:
-    """Return token debug info (data dict) or None on error."""
+# (token, expires_at) from the last successful debug_token: lets the refresh loop
+# skip the HTTP call while the token is still far from expiry
+_cached_expiry: Optional[tuple] = None
+
+# Backoff after a failed refresh check: 60s, 120s, ... up to 60s * 2**8 (capped at the interval)
+REFRESH_RETRY_BASE = 60
+REFRESH_MAX_BACKOFF_STEPS = 8
+
+# Max concurrent page lookups in try_update_page_token
+PAGE_LOOKUP_CONCURRENCY = 5
+
+
+class TransientTokenError(Exception):
+    """Graph API temporarily unavailable (network error, 429 or 5xx): the check should be retried soon."""
+
+    def __init__(self, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _transient_error(e: Exception) -> Optional[TransientTokenError]:
+    """Return a TransientTokenError for retryable failures, None for permanent ones."""
+    if isinstance(e, httpx.RequestError):
+        return TransientTokenError(str(e))
+    if isinstance(e, httpx.HTTPStatusError):
+        status = e.response.status_code
+        if status == 429 or status >= 500:
+            retry_after = e.response.headers.get('Retry-After', '')
+            return TransientTokenError(str(e), int(retry_after) if retry_after.isdigit() else None)
+    return None
+
+
+async def debug_token(token: str, raise_transient: bool = False) -> Optional[dict]:
+    """Return token debug info (data dict) or None on error.
+
+    With raise_transient=True, network errors, 429 and 5xx raise TransientTokenError instead.
+    """
     if not config.instagram.app_id or not config.instagram.app_secret:
         logger.warning("App id/secret not configured; cannot call debug_token")
         return None
@@ -36,13 +77,15 @@ async def debug_token(token: str) -> Optional[dict]:
     url = f"https://graph.facebook.com/debug_token"
     params = {"input_token": token, "access_token": app_access}
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            data = r.json().get('data')
-            return data
-    except httpx.HTTPStatusError as e:
-        if e.response.status_code == 400:
+        r = await get_client().get(url, params=params, timeout=15.0)
+        r.raise_for_status()
+        data = r.json().get('data')
+        return data
+    except httpx.HTTPError as e:
+        transient = _transient_error(e)
+        if raise_transient and transient:
+            raise transient from e
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 400:
             logger.warning(f"Token debug failed (400 Bad Request) - token may be invalid or expired")
             logger.debug(f"Debug response: {e.response.text}")
             return None
@@ -54,10 +97,11 @@ async def debug_token(token: str) -> Optional[dict]:
         return None
 
 
-async def exchange_long_lived(token: str) -> Optional[dict]:
+async def exchange_long_lived(token: str, raise_transient: bool = False) -> Optional[dict]:
     """Exchange a short- or long-lived user token for a new long-lived token.
 
     Returns dict with keys: access_token, token_type, expires_in
+    With raise_transient=True, network errors, 429 and 5xx raise TransientTokenError instead of returning None.
     """
     if not config.instagram.app_id or not config.instagram.app_secret:
         logger.warning("App id/secret not configured; cannot exchange token")
@@ -70,13 +114,16 @@ async def exchange_long_lived(token: str) -> Optional[dict]:
         "fb_exchange_token": token,
     }
     url = "https://graph.facebook.com/oauth/access_token"
+    r = None
     try:
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            return r.json()
-    except httpx.HTTPStatusError as e:
-        if e.response.status_code == 400:
+        r = await get_client().get(url, params=params, timeout=20.0)
+        r.raise_for_status()
+        return r.json()
+    except httpx.HTTPError as e:
+        transient = _transient_error(e)
+        if raise_transient and transient:
+            raise transient from e
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 400:
             logger.error(f"Token exchange failed (400 Bad Request) - check Facebook app configuration")
             logger.error(f"Response: {e.response.text}")
             logger.error("Common causes:")
@@ -90,11 +137,9 @@ async def exchange_long_lived(token: str) -> Optional[dict]:
             return None
     except Exception as e:
         logger.error(f"exchange_long_lived error: {e}")
-        try:
+        if r is not None:
             # log body if available
             logger.error(f"response text: {r.text}")
-        except Exception:
-            pass
         return None
 
 
@@ -102,17 +147,15 @@ async def get_page_access_token(page_id: str, user_token: str) -> Optional[str]:
     """Get page access token for a Page ID using a user token with appropriate permissions."""
     url = f"{BASE_URL}/{page_id}"
     params = {"fields": "access_token", "access_token": user_token}
+    r = None
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.get(url, params=params)
-            r.raise_for_status()
-            return r.json().get('access_token')
+        r = await get_client().get(url, params=params, timeout=15.0)
+        r.raise_for_status()
+        return r.json().get('access_token')
     except Exception as e:
         logger.error(f"get_page_access_token error: {e}")
-        try:
+        if r is not None:
             logger.debug(f"response: {r.text}")
-        except Exception:
-            pass
         return None
 
 
@@ -123,19 +166,23 @@ def persist_token_to_env(new_token: str) -> bool:
         return False
 
     try:
+        if dotenv_values(ENV_PATH).get('INSTAGRAM_ACCESS_TOKEN') == new_token:
+            logger.debug("INSTAGRAM_ACCESS_TOKEN unchanged; .env not rewritten")
+            return True
+
         text = ENV_PATH.read_text(encoding='utf-8')
-        lines = text.splitlines()
-        out = []
-        replaced = False
-        for ln in lines:
-            if ln.strip().startswith('INSTAGRAM_ACCESS_TOKEN='):
-                out.append(f"INSTAGRAM_ACCESS_TOKEN={new_token}")
-                replaced = True
-            else:
-                out.append(ln)
+        line = f"INSTAGRAM_ACCESS_TOKEN={new_token}"
+        # callable replacement: the token is inserted literally (no backslash escapes)
+        new_text, replaced = _TOKEN_LINE_RE.subn(lambda _: line, text)
         if not replaced:
-            out.append(f"INSTAGRAM_ACCESS_TOKEN={new_token}")
-        ENV_PATH.write_text('\n'.join(out) + '\n', encoding='utf-8')
+            new_text = (text.rstrip('\n') + '\n' if text.strip() else '') + line
+        new_text = new_text.rstrip('\n') + '\n'
+        # Write a temp file in the same directory and rename it over .env:
+        # a crash mid-write never leaves a truncated .env behind
+        tmp_path = ENV_PATH.with_name(ENV_PATH.name + '.tmp')
+        tmp_path.write_text(new_text, encoding='utf-8')
+        os.chmod(tmp_path, 0o600)  # the file holds secrets
+        os.replace(tmp_path, ENV_PATH)
         logger.info("Persisted new INSTAGRAM_ACCESS_TOKEN to .env")
         return True
     except Exception as e:
@@ -143,6 +190,26 @@ def persist_token_to_env(new_token: str) -> bool:
         return False
 
 
+async def check_app_credentials() -> bool:
+    """Validate app id/secret by requesting an app access token (client_credentials).
+
+    Token exchange uses the same credentials, so this tells whether exchange can work
+    without a call that is bound to fail.
+    """
+    params = {
+        "grant_type": "client_credentials",
+        "client_id": config.instagram.app_id,
+        "client_secret": config.instagram.app_secret,
+    }
+    try:
+        r = await get_client().get("https://graph.facebook.com/oauth/access_token", params=params, timeout=15.0)
+        r.raise_for_status()
+        return bool(r.json().get('access_token'))
+    except Exception as e:
+        logger.warning(f"App credentials check failed: {e}")
+        return False
+
+
 async def test_facebook_app_config() -> dict:
     """Test Facebook app configuration and return status info."""
     result = {
@@ -158,49 +225,66 @@ async def test_facebook_app_config() -> dict:
 
     result["app_configured"] = True
 
-    # Test token debug capability
-    try:
-        debug = await debug_token(config.instagram.access_token)
+    # Debug and credential checks are independent: run them concurrently
+    debug, exchanged = await asyncio.gather(
+        debug_token(config.instagram.access_token),
+        check_app_credentials(),
+        return_exceptions=True
+    )
+
+    if isinstance(debug, Exception):
+        result["issues"].append(f"Token debug test failed: {debug}")
+    else:
         result["can_debug_tokens"] = debug is not None
         if not debug:
             result["issues"].append("Cannot debug tokens - app may not have proper permissions")
-    except Exception as e:
-        result["issues"].append(f"Token debug test failed: {e}")
 
-    # Test token exchange capability
-    try:
-        # Use a dummy token to test if exchange endpoint works
-        exchanged = await exchange_long_lived("dummy_token")
-        result["can_exchange_tokens"] = exchanged is not None
+    if isinstance(exchanged, Exception):
+        result["issues"].append(f"Token exchange test failed: {exchanged}")
+    else:
+        result["can_exchange_tokens"] = exchanged
         if not exchanged:
             result["issues"].append("Cannot exchange tokens - check app configuration")
-    except Exception as e:
-        result["issues"].append(f"Token exchange test failed: {e}")
 
     return result
 
 
-async def refresh_token_if_needed(threshold_seconds: int = 7 * 24 * 3600) -> bool:
+async def refresh_token_if_needed(threshold_seconds: int = 7 * 24 * 3600,
+                                  check_interval: int = 0) -> bool:
     """Check token expiry and refresh if expires within threshold_seconds.
 
+    If the cached expiry of the current token is more than threshold_seconds +
+    check_interval away, debug_token is skipped: the next check will still be in time.
+
     Returns True if token refreshed, False otherwise.
+    Raises TransientTokenError when the Graph API is temporarily unreachable, so the
+    caller can retry sooner than the next scheduled check.
     """
+    global _cached_expiry
     token = config.instagram.access_token
     if not token:
         logger.warning("No INSTAGRAM_ACCESS_TOKEN configured")
         return False
 
-    debug = await debug_token(token)
+    # expires_at is a Unix timestamp, so it is compared with wall-clock time
+    if _cached_expiry and _cached_expiry[0] == token:
+        if _cached_expiry[1] - int(time.time()) > threshold_seconds + check_interval:
+            logger.debug("Token expiry cached and far away; skipping debug_token")
+            return False
+
+    debug = await debug_token(token, raise_transient=True)
     if not debug:
         logger.warning("Unable to debug token - may be invalid/expired. Will attempt token exchange anyway.")
         # Try to exchange token even if debug fails
         # This might work if the token is still valid for exchange but not for debug
-        return await force_token_refresh()
+        logger.info("Attempting forced token refresh...")
+        return await exchange_and_update_token(token, raise_transient=True)
 
     expires_at = debug.get('expires_at')
     if not expires_at:
         logger.info("Token appears non-expiring or no expiry info; skipping refresh")
         return False
+    _cached_expiry = (token, expires_at)
 
     now = int(time.time())
     seconds_left = expires_at - now
@@ -211,7 +295,7 @@ async def refresh_token_if_needed(threshold_seconds: int = 7 * 24 * 3600) -> boo
         return False
 
     # Exchange token
-    return await exchange_and_update_token(token)
+    return await exchange_and_update_token(token, raise_transient=True)
 
 
 async def force_token_refresh() -> bool:
@@ -225,9 +309,9 @@ async def force_token_refresh() -> bool:
     return await exchange_and_update_token(token)
 
 
-async def exchange_and_update_token(token: str) -> bool:
+async def exchange_and_update_token(token: str, raise_transient: bool = False) -> bool:
     """Exchange token and update configuration."""
-    exchanged = await exchange_long_lived(token)
+    exchanged = await exchange_long_lived(token, raise_transient=raise_transient)
     if not exchanged:
         logger.error("Failed to exchange token")
         return False
@@ -252,28 +336,39 @@ async def exchange_and_update_token(token: str) -> bool:
     return True
 
 
+async def _fetch_ig_account(client: httpx.AsyncClient, page_id: str, user_token: str,
+                            semaphore: asyncio.Semaphore) -> Optional[dict]:
+    """Return the instagram_business_account linked to a page, or None."""
+    async with semaphore:
+        r = await client.get(f"{BASE_URL}/{page_id}", params={"fields": "instagram_business_account", "access_token": user_token}, timeout=15.0)
+    r.raise_for_status()
+    return r.json().get('instagram_business_account')
+
+
 async def try_update_page_token(user_token: str):
     """Try to update page access token if possible."""
     try:
         # try to find page id from user accounts
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            r = await client.get(f"{BASE_URL}/me/accounts", params={"access_token": user_token})
-            r.raise_for_status()
-            data = r.json().get('data', [])
-            for entry in data:
-                page_id = entry.get('id')
-                # get instagram_business_account for page
-                r2 = await client.get(f"{BASE_URL}/{page_id}", params={"fields": "instagram_business_account", "access_token": user_token})
-                r2.raise_for_status()
-                ig = r2.json().get('instagram_business_account')
-                if ig and str(ig.get('id')) == str(config.instagram.account_id):
-                    # found page; get its access token
-                    page_token = entry.get('access_token')
-                    if page_token:
-                        # Persist page token into env as fallback variable
-                        persist_token_to_env(page_token)
-                        logger.info(f"Persisted page access token for page {page_id}")
-                        break
+        client = get_client()
+        r = await client.get(f"{BASE_URL}/me/accounts", params={"access_token": user_token}, timeout=15.0)
+        r.raise_for_status()
+        data = r.json().get('data', [])
+
+        # get instagram_business_account for every page concurrently
+        semaphore = asyncio.Semaphore(PAGE_LOOKUP_CONCURRENCY)
+        accounts = await asyncio.gather(
+            *(_fetch_ig_account(client, entry.get('id'), user_token, semaphore) for entry in data)
+        )
+        for entry, ig in zip(data, accounts):
+            page_id = entry.get('id')
+            if ig and str(ig.get('id')) == str(config.instagram.account_id):
+                # found page; get its access token
+                page_token = entry.get('access_token')
+                if page_token:
+                    # Persist page token into env as fallback variable
+                    persist_token_to_env(page_token)
+                    logger.info(f"Persisted page access token for page {page_id}")
+                    break
     except Exception as e:
         logger.debug(f"Could not auto-resolve page access token: {e}")
 
@@ -281,13 +376,21 @@ async def try_update_page_token(user_token: str):
 async def background_refresh_loop(interval_seconds: int = 24 * 3600):
     """Background task: check daily and refresh if near expiry."""
     logger.info("Starting Instagram token background refresh loop")
+    failures = 0
     try:
         while True:
+            delay = interval_seconds
             try:
-                await refresh_token_if_needed()
+                await refresh_token_if_needed(check_interval=interval_seconds)
+                failures = 0
             except Exception as e:
-                logger.error(f"Error in refresh loop: {e}")
-            await asyncio.sleep(interval_seconds)
+                # Retry soon with exponential backoff instead of waiting a full interval
+                delay = min(interval_seconds, REFRESH_RETRY_BASE * 2 ** failures)
+                if isinstance(e, TransientTokenError) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                failures = min(failures + 1, REFRESH_MAX_BACKOFF_STEPS)
+                logger.error(f"Error in refresh loop: {e} (retry in {delay}s)")
+            await asyncio.sleep(delay)
     except asyncio.CancelledError:
         logger.info("Token refresh loop cancelled")
         raise
@@ -0,0 +1,150 @@
+"""
+Webhook Instagram (Meta Graph API) per ricevere eventi in tempo reale
+
+Sostituisce il polling di GET /me/media per commenti e menzioni:
+Meta invia una POST firmata (X-Hub-Signature-256) a ogni evento.
+
+Setup:
+1. Configura FACEBOOK_APP_SECRET e INSTAGRAM_WEBHOOK_VERIFY_TOKEN
+2. Avvia il bot in modalità webhook (USE_WEBHOOK=true)
+3. Registra l'URL pubblico con subscribe_app() oppure dalla dashboard dell'app Meta
+"""
+import hashlib
+import hmac
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+from services.instagram_publisher_async import get_client
+
+logger = logging.getLogger(__name__)
+
+# Campi dell'oggetto 'instagram' a cui iscriversi
+DEFAULT_FIELDS = ("comments", "mentions", "messages")
+
+EventCallback = Callable[[dict], Awaitable[None]]
+
+
+def verify_signature(app_secret: str, body: bytes, signature: Optional[str]) -> bool:
+    """
+    Verifica la firma HMAC-SHA256 inviata da Meta
+
+    Args:
+        app_secret: App secret dell'app Facebook
+        body: Corpo della richiesta così come ricevuto
+        signature: Valore dell'header X-Hub-Signature-256 ("sha256=<hex>")
+
+    Returns:
+        True se la firma è valida
+    """
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature[len("sha256="):])
+
+
+class InstagramWebhookHandler:
+    """Endpoint aiohttp per verifica e ricezione eventi webhook Instagram"""
+
+    def __init__(self, app_secret: str, verify_token: str):
+        """
+        Args:
+            app_secret: App secret usato per firmare gli eventi
+            verify_token: Token scelto in fase di iscrizione (handshake GET)
+        """
+        self.app_secret = app_secret
+        self.verify_token = verify_token
+        self._listeners: Dict[str, List[EventCallback]] = {}
+
+    def add_listener(self, field: str, callback: EventCallback):
+        """
+        Registra una coroutine chiamata per ogni evento del campo indicato
+
+        Args:
+            field: Campo dell'evento (es. 'comments', 'mentions')
+            callback: Coroutine che riceve il dict 'value' dell'evento
+        """
+        self._listeners.setdefault(field, []).append(callback)
+
+    def register(self, app: web.Application, path: str):
+        """Aggiunge le route GET (verifica) e POST (eventi) all'app aiohttp"""
+        app.router.add_get(path, self.handle_verify)
+        app.router.add_post(path, self.handle_event)
+
+    async def handle_verify(self, request: web.Request) -> web.Response:
+        """Handshake di iscrizione: restituisce hub.challenge se il token coincide"""
+        params = request.query
+        if params.get("hub.mode") == "subscribe" and params.get("hub.verify_token") == self.verify_token:
+            logger.info("Webhook Instagram verificato")
+            return web.Response(text=params.get("hub.challenge", ""))
+        return web.Response(status=403)
+
+    async def handle_event(self, request: web.Request) -> web.Response:
+        """Riceve un evento firmato e lo inoltra ai listener"""
+        body = await request.read()
+        if not verify_signature(self.app_secret, body, request.headers.get("X-Hub-Signature-256")):
+            logger.warning("Evento webhook Instagram con firma non valida")
+            return web.Response(status=403)
+
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        for entry in payload.get("entry", []):
+            for change in entry.get("changes", []):
+                await self._dispatch(change.get("field"), change.get("value") or {})
+
+        # Meta ripete l'invio se non riceve 200 in pochi secondi
+        return web.Response(text="EVENT_RECEIVED")
+
+    async def _dispatch(self, field: Optional[str], value: dict):
+        """Chiama i listener del campo; gli errori non bloccano gli altri eventi"""
+        listeners = self._listeners.get(field, [])
+        if not listeners:
+            logger.info(f"Evento Instagram '{field}': {value}")
+            return
+
+        for callback in listeners:
+            try:
+                await callback(value)
+            except Exception as e:
+                logger.error(f"Errore gestione evento Instagram '{field}': {e}")
+
+
+async def subscribe_app(app_id: str, app_secret: str, callback_url: str, verify_token: str,
+                        fields=DEFAULT_FIELDS, api_version: str = "v23.0") -> bool:
+    """
+    Iscrive l'app agli eventi dell'oggetto 'instagram' (POST /{app_id}/subscriptions)
+
+    Args:
+        app_id: ID app Facebook
+        app_secret: App secret (usato per l'app access token)
+        callback_url: URL pubblico dell'endpoint webhook
+        verify_token: Token per l'handshake GET
+        fields: Campi a cui iscriversi
+        api_version: Versione Graph API
+
+    Returns:
+        True se l'iscrizione è andata a buon fine
+    """
+    try:
+        response = await get_client().post(
+            f"https://graph.facebook.com/{api_version}/{app_id}/subscriptions",
+            data={
+                "object": "instagram",
+                "callback_url": callback_url,
+                "fields": ",".join(fields),
+                "verify_token": verify_token,
+                "access_token": f"{app_id}|{app_secret}"
+            }
+        )
+        response.raise_for_status()
+        success = bool(response.json().get("success"))
+        logger.info(f"Iscrizione webhook Instagram: {'OK' if success else 'rifiutata'}")
+        return success
+
+    except Exception as e:
+        logger.error(f"Errore iscrizione webhook Instagram: {e}")
+        return False
@@ -24,8 +24,8 @@ async def test_configuration():
     else:
         print("✅ Configurazione valida")
     
-    # 2. Test Steem
-    print("\n2️⃣ Test connessione Steem...")
+    # 2-3. Test Steem e Instagram in parallelo (connessioni indipendenti)
+    print("\n2️⃣ 3️⃣ Test connessione Steem e Instagram...")
     try:
         steem = SteemUploader(
             username=config.steem.username,
@@ -33,37 +33,44 @@ async def test_configuration():
             nodes=config.steem.nodes,
             auto_find_fastest=config.steem.auto_find_fastest
         )
-        steem_ok = await steem.test_connection()
-        if steem_ok:
-            print(f"✅ Connesso a Steem")
-            print(f"   Username: {config.steem.username}")
-            print(f"   Nodi attivi: {', '.join(steem.active_nodes[:2])}...")
-            print(f"   Auto-find: {'✅ Abilitato' if config.steem.auto_find_fastest else '❌ Disabilitato'}")
-        else:
-            print("❌ Errore connessione Steem")
-            return False
-    except Exception as e:
-        print(f"❌ Errore Steem: {e}")
-        return False
-    
-    # 3. Test Instagram
-    print("\n3️⃣ Test connessione Instagram...")
-    try:
         instagram = InstagramPublisher(
             access_token=config.instagram.access_token,
             account_id=config.instagram.account_id
         )
-        ig_info = await instagram.get_account_info()
-        if ig_info:
-            print(f"✅ Connesso a Instagram")
-            print(f"   Account: @{ig_info.get('username')}")
-            print(f"   Followers: {ig_info.get('followers_count', 0):,}")
-            print(f"   Posts: {ig_info.get('media_count', 0)}")
-        else:
-            print("❌ Errore connessione Instagram")
-            return False
     except Exception as e:
-        print(f"❌ Errore Instagram: {e}")
+        print(f"❌ Errore inizializzazione: {e}")
+        return False
+    
+    steem_ok, ig_info = await asyncio.gather(
+        steem.test_connection(),
+        instagram.get_account_info(),
+        return_exceptions=True
+    )
+    
+    print("\n2️⃣ Steem")
+    if isinstance(steem_ok, Exception):
+        print(f"❌ Errore Steem: {steem_ok}")
+        return False
+    elif steem_ok:
+        print(f"✅ Connesso a Steem")
+        print(f"   Username: {config.steem.username}")
+        print(f"   Nodi attivi: {', '.join(steem.active_nodes[:2])}...")
+        print(f"   Auto-find: {'✅ Abilitato' if config.steem.auto_find_fastest else '❌ Disabilitato'}")
+    else:
+        print("❌ Errore connessione Steem")
+        return False
+    
+    print("\n3️⃣ Instagram")
+    if isinstance(ig_info, Exception):
+        print(f"❌ Errore Instagram: {ig_info}")
+        return False
+    elif ig_info:
+        print(f"✅ Connesso a Instagram")
+        print(f"   Account: @{ig_info.get('username')}")
+        print(f"   Followers: {ig_info.get('followers_count', 0):,}")
+        print(f"   Posts: {ig_info.get('media_count', 0)}")
+    else:
+        print("❌ Errore connessione Instagram")
         return False
     
     # 4. Verifica modalità bot
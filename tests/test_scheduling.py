@@ -3,7 +3,7 @@ Test sistema di programmazione post con database SQLite
 """
 import asyncio
 from datetime import datetime, timedelta
-from services.database import db
+from services.database import get_db
 from services.scheduler import scheduler
 from services.instagram_publisher_async import InstagramPublisher
 from config import config
@@ -17,26 +17,28 @@ async def test_scheduling_workflow():
     print("1️⃣ Test sessione utente...")
     user_id = 999999  # ID test
     
-    # Simula selezione data
+    # Le selezioni vengono salvate in un'unica transazione
     selected_date = datetime.now() + timedelta(days=1)
-    db.save_user_session(user_id=user_id, selected_date=selected_date)
-    print(f"   ✅ Data salvata: {selected_date.strftime('%d/%m/%Y')}")
-    
-    # Simula selezione ora
-    db.save_user_session(user_id=user_id, selected_hour=14)
-    print(f"   ✅ Ora salvata: 14")
-    
-    # Simula selezione minuti
-    db.save_user_session(user_id=user_id, selected_minute=30)
-    print(f"   ✅ Minuti salvati: 30")
-    
-    # Simula conferma
     scheduled_datetime = selected_date.replace(hour=14, minute=30)
-    db.save_user_session(user_id=user_id, scheduled_datetime=scheduled_datetime)
-    print(f"   ✅ DateTime completo salvato: {scheduled_datetime.strftime('%d/%m/%Y %H:%M')}")
+    with get_db().batch():
+        # Simula selezione data
+        get_db().save_user_session(user_id=user_id, selected_date=selected_date)
+        print(f"   ✅ Data salvata: {selected_date.strftime('%d/%m/%Y')}")
+        
+        # Simula selezione ora
+        get_db().save_user_session(user_id=user_id, selected_hour=14)
+        print(f"   ✅ Ora salvata: 14")
+        
+        # Simula selezione minuti
+        get_db().save_user_session(user_id=user_id, selected_minute=30)
+        print(f"   ✅ Minuti salvati: 30")
+        
+        # Simula conferma
+        get_db().save_user_session(user_id=user_id, scheduled_datetime=scheduled_datetime)
+        print(f"   ✅ DateTime completo salvato: {scheduled_datetime.strftime('%d/%m/%Y %H:%M')}")
     
     # Recupera sessione
-    session = db.get_user_session(user_id)
+    session = get_db().get_user_session(user_id)
     print(f"   ✅ Sessione recuperata: {session is not None}")
     
     # 2. Test programmazione post
@@ -57,7 +59,7 @@ async def test_scheduling_workflow():
     print(f"   📅 Pubblicazione prevista: {test_scheduled_time.strftime('%d/%m/%Y %H:%M')}")
     
     # Verifica che la sessione sia stata pulita
-    session_after = db.get_user_session(user_id)
+    session_after = get_db().get_user_session(user_id)
     print(f"   ✅ Sessione pulita dopo programmazione: {session_after is None}")
     
     # 3. Test recupero post
@@ -107,13 +109,13 @@ async def test_scheduling_workflow():
     
     # 7. Statistiche finali
     print("\n7️⃣ Statistiche database...")
-    stats = db.get_stats()
+    stats = get_db().get_stats()
     for key, value in stats.items():
         print(f"   {key}: {value}")
     
     # Pulizia
     print("\n8️⃣ Pulizia test data...")
-    db.clear_user_session(user_id)
+    get_db().clear_user_session(user_id)
     print("   ✅ Sessione pulita")
     
     print("\n✅ Tutti i test completati con successo!")
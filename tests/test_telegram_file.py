@@ -1,8 +1,16 @@
 """
 Test script per verificare se un file_id di Telegram è scaricabile
+
+Uso:
+    python -m tests.test_telegram_file                         # verifica FILE_ID
+    python -m tests.test_telegram_file --file-id ID --full-download
+    python -m tests.test_telegram_file ID1 ID2 ...             # verifica più file_id in parallelo
 """
 
+import argparse
+import asyncio
 import os
+import sys
 import requests
 from dotenv import load_dotenv
 
@@ -13,14 +21,45 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 FILE_ID = "AgACAgQAAxkBAAIBd2kFxBixZAFAzOVKOwdrXbR9HQyOAAL3DGsbW_IpUMDZBN1ZAvCsAQADAgADeQADNgQ"
 
-def test_telegram_file():
-    """Test se il file_id è accessibile su Telegram"""
+# Una sola sessione: getFile e download riusano la connessione verso api.telegram.org
+session = requests.Session()
+
+# Estensioni riconosciute come immagine
+IMAGE_EXTENSIONS = frozenset({'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'})
+
+# Firme (magic bytes) dei formati immagine, come in main.py
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+    (b'BM', 'BMP'),
+)
+
+
+def sniff_image_format(head):
+    """Riconosce il formato immagine dai primi byte (None se non riconosciuto)"""
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def test_telegram_file(file_id=FILE_ID):
+    """
+    Test se il file_id è accessibile su Telegram
+
+    Returns:
+        file_path restituito da getFile se il file è scaricabile, altrimenti None
+    """
 
     if not TELEGRAM_BOT_TOKEN:
         print("❌ TELEGRAM_BOT_TOKEN non configurato nel file .env")
-        return False
+        return None
 
-    print(f"🤖 Test file_id: {FILE_ID}")
+    print(f"🤖 Test file_id: {file_id}")
     print(f"🔑 Bot token configurato: {'✅ Sì' if TELEGRAM_BOT_TOKEN else '❌ No'}")
 
     try:
@@ -31,7 +70,7 @@ def test_telegram_file():
         print("📡 Richiesta informazioni file...")
 
         # Ottieni informazioni del file
-        response = requests.get(get_file_url, params={"file_id": FILE_ID}, timeout=10)
+        response = session.get(get_file_url, params={"file_id": file_id}, timeout=10)
         response.raise_for_status()
 
         data = response.json()
@@ -39,7 +78,7 @@ def test_telegram_file():
 
         if not data.get("ok"):
             print(f"❌ Errore API Telegram: {data.get('description', 'Unknown error')}")
-            return False
+            return None
 
         file_data = data["result"]
         file_path = file_data["file_path"]
@@ -50,87 +89,95 @@ def test_telegram_file():
         print(f"   📏 Dimensione: {file_size:,} bytes")
 
         # Verifica se è un'immagine
-        file_extension = file_path.split('.')[-1].lower() if '.' in file_path else 'unknown'
-        image_extensions = ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp']
+        file_extension = os.path.splitext(file_path)[1].lower()
 
-        if file_extension in image_extensions:
-            print(f"   🖼️  Tipo: Immagine ({file_extension.upper()})")
+        if file_extension in IMAGE_EXTENSIONS:
+            print(f"   🖼️  Tipo: Immagine ({file_extension[1:].upper()})")
         else:
-            print(f"   ❓ Tipo: {file_extension} (potrebbe non essere un'immagine)")
+            print(f"   ❓ Tipo: {file_extension[1:] or 'unknown'} (potrebbe non essere un'immagine)")
 
-        # Test download (solo headers, non scaricare tutto il file)
+        # Test download: GET in streaming chiusa subito dopo gli header (il corpo non viene letto)
         file_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
         print("\n📥 Test download...")
-        download_response = requests.head(file_url, timeout=10)
+        with session.get(file_url, stream=True, timeout=10) as download_response:
+            status_code = download_response.status_code
+            content_length = download_response.headers.get('content-length')
 
-        if download_response.status_code == 200:
+        if status_code == 200:
             print("✅ File scaricabile!")
-            content_length = download_response.headers.get('content-length')
             if content_length:
                 print(f"   📏 Content-Length: {int(content_length):,} bytes")
         else:
-            print(f"❌ Errore download: HTTP {download_response.status_code}")
-            return False
+            print(f"❌ Errore download: HTTP {status_code}")
+            return None
 
         print("\n🎉 File_id VALIDO e SCARICABILE!")
-        return True
+        return file_path
 
     except requests.exceptions.Timeout:
         print("⏰ Timeout nella richiesta a Telegram")
-        return False
+        return None
     except requests.exceptions.RequestException as e:
         print(f"🌐 Errore di connessione: {e}")
-        return False
+        return None
     except Exception as e:
         print(f"💥 Errore imprevisto: {e}")
-        return False
+        return None
 
     except requests.exceptions.Timeout:
         print("⏰ Timeout nella richiesta a Telegram")
-        return False
+        return None
     except requests.exceptions.RequestException as e:
         print(f"🌐 Errore di connessione: {e}")
-        return False
+        return None
     except Exception as e:
         print(f"💥 Errore imprevisto: {e}")
-        return False
+        return None
 
-def test_full_download():
-    """Test completo download (opzionale, scarica effettivamente il file)"""
+def test_full_download(file_path=None, file_id=FILE_ID):
+    """
+    Test completo download (opzionale, scarica effettivamente il file)
+
+    Args:
+        file_path: file_path già ottenuto da test_telegram_file (evita una seconda getFile)
+        file_id: file_id da scaricare se file_path non è indicato
+    """
     if not TELEGRAM_BOT_TOKEN:
         return
 
     try:
         print("\n🔄 Test download completo...")
 
-        base_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
-
-        # Ottieni info file
-        response = requests.get(f"{base_url}/getFile", params={"file_id": FILE_ID})
-        file_data = response.json()["result"]
-        file_path = file_data["file_path"]
+        if not file_path:
+            # Ottieni info file
+            base_url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+            response = session.get(f"{base_url}/getFile", params={"file_id": file_id})
+            file_path = response.json()["result"]["file_path"]
 
         # Scarica file
         file_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
-        download_response = requests.get(file_url)
-
-        if download_response.status_code == 200:
-            # Salva temporaneamente per test
-            temp_filename = f"test_telegram_{FILE_ID[:10]}.jpg"
-            with open(temp_filename, 'wb') as f:
-                f.write(download_response.content)
-
-            file_size = len(download_response.content)
+        temp_filename = f"test_telegram_{file_id[:10]}.jpg"
+        file_size = 0
+        # Scrittura in streaming a blocchi da 64 KiB: il file non viene tenuto tutto in memoria
+        with session.get(file_url, stream=True, timeout=30) as download_response:
+            status_code = download_response.status_code
+            if status_code == 200:
+                # Salva temporaneamente per test
+                with open(temp_filename, 'wb') as f:
+                    for chunk in download_response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+                        file_size += len(chunk)
+
+        if status_code == 200:
             print(f"✅ Download completato: {temp_filename} ({file_size:,} bytes)")
 
-            # Verifica che sia un'immagine valida
-            try:
-                from PIL import Image
-                with Image.open(temp_filename) as img:
-                    img.verify()
-                print("✅ File è un'immagine valida!")
-            except Exception as e:
-                print(f"⚠️  File potrebbe non essere un'immagine valida: {e}")
+            # Verifica che sia un'immagine valida (solo magic bytes, senza decodificare il file)
+            with open(temp_filename, 'rb') as f:
+                image_format = sniff_image_format(f.read(16))
+            if image_format:
+                print(f"✅ File è un'immagine valida! ({image_format})")
+            else:
+                print("⚠️  File potrebbe non essere un'immagine valida: formato non riconosciuto")
 
             # Pulisci
             if os.path.exists(temp_filename):
@@ -138,23 +185,67 @@ def test_full_download():
                 print("🧹 File temporaneo eliminato")
 
         else:
-            print(f"❌ Errore download: HTTP {download_response.status_code}")
+            print(f"❌ Errore download: HTTP {status_code}")
 
     except Exception as e:
         print(f"❌ Errore download completo: {e}")
 
+async def validate_file_ids(file_ids):
+    """
+    Verifica più file_id in parallelo (il TelegramHandler limita le richieste a HOST_CONCURRENCY alla volta)
+
+    Returns:
+        dict: file_id -> file_path, oppure l'eccezione ricevuta
+    """
+    from services.telegram_handler_async import TelegramHandler
+
+    async with TelegramHandler(TELEGRAM_BOT_TOKEN) as handler:
+        async def check(file_id):
+            return (await handler.get_file_info(file_id))["file_path"]
+
+        results = await asyncio.gather(*(check(file_id) for file_id in file_ids), return_exceptions=True)
+    return dict(zip(file_ids, results))
+
+
+def test_file_ids_batch(file_ids):
+    """Stampa l'esito della verifica in parallelo di più file_id"""
+    if not TELEGRAM_BOT_TOKEN:
+        print("❌ TELEGRAM_BOT_TOKEN non configurato nel file .env")
+        return False
+
+    print(f"🤖 Verifica di {len(file_ids)} file_id in parallelo...")
+    results = asyncio.run(validate_file_ids(file_ids))
+    valid = 0
+    for file_id, result in results.items():
+        if isinstance(result, Exception):
+            print(f"❌ {file_id[:20]}...: {result}")
+        else:
+            valid += 1
+            print(f"✅ {file_id[:20]}...: {result}")
+    print(f"\n📊 Validi: {valid}/{len(file_ids)}")
+    return valid == len(file_ids)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica file_id Telegram")
+    parser.add_argument("file_ids", nargs="*", help="Più file_id da verificare in parallelo")
+    parser.add_argument("--file-id", default=FILE_ID, help="file_id da verificare (default: FILE_ID)")
+    parser.add_argument("--full-download", action="store_true", help="Scarica anche il file completo")
+    args = parser.parse_args()
+
     print("🧪 Test File ID Telegram")
     print("=" * 50)
 
+    if args.file_ids:
+        sys.exit(0 if test_file_ids_batch(args.file_ids) else 1)
+
     # Test base
-    success = test_telegram_file()
+    file_path = test_telegram_file(args.file_id)
+    success = file_path is not None
 
-    if success:
+    if success and args.full_download:
         # Opzionale: test download completo
-        choice = input("\nVuoi testare anche il download completo? (y/N): ").lower().strip()
-        if choice == 'y':
-            test_full_download()
+        test_full_download(file_path, args.file_id)
 
     print("\n" + "=" * 50)
     if success:
@@ -162,6 +253,7 @@ if __name__ == "__main__":
         print("💡 Esempio chiamata API:")
         print(f'   curl -X POST http://127.0.0.1:5000/upload-telegram \\')
         print(f'        -H "Content-Type: application/json" \\')
-        print(f'        -d \'{{"file_id": "{FILE_ID}"}}\'')
+        print(f'        -d \'{{"file_id": "{args.file_id}"}}\'')
     else:
-        print("❌ File_id NON valido o non accessibile")
\ No newline at end of file
+        print("❌ File_id NON valido o non accessibile")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,101 @@
+"""
+Test backoff del loop di refresh token quando la Graph API non risponde
+(nessuna chiamata reale: client HTTP e sleep sono simulati)
+"""
+import asyncio
+import sys
+import httpx
+from config import config
+from services import token_manager
+
+
+class FailingClient:
+    """Client finto: ogni GET restituisce l'errore configurato"""
+
+    def __init__(self, status_code: int = None, headers: dict = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.calls = 0
+
+    async def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        request = httpx.Request("GET", url)
+        if self.status_code is None:
+            raise httpx.ConnectError("connessione rifiutata", request=request)
+        return httpx.Response(self.status_code, headers=self.headers, request=request)
+
+
+async def run_loop(client: FailingClient, iterations: int) -> list:
+    """Esegue il loop di refresh per `iterations` attese e restituisce i ritardi richiesti"""
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+        if len(delays) >= iterations:
+            raise asyncio.CancelledError()
+
+    original_client, original_sleep = token_manager.get_client, asyncio.sleep
+    token_manager.get_client = lambda: client
+    asyncio.sleep = fake_sleep
+    token_manager._cached_expiry = None
+    try:
+        await token_manager.background_refresh_loop(interval_seconds=24 * 3600)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        token_manager.get_client = original_client
+        asyncio.sleep = original_sleep
+    return delays
+
+
+async def test_token_refresh_backoff():
+    """debug_token che fallisce deve far ripartire il controllo con backoff, non dopo 24 ore"""
+    print("🧪 Test Backoff Refresh Token\n")
+    config.instagram.access_token = "test-token"
+    config.instagram.app_id = config.instagram.app_id or "123"
+    config.instagram.app_secret = config.instagram.app_secret or "secret"
+    ok = True
+
+    # 1. Errore di rete: 60s, 120s, 240s
+    print("1️⃣ debug_token con errore di rete...")
+    client = FailingClient()
+    delays = await run_loop(client, 3)
+    expected = [token_manager.REFRESH_RETRY_BASE * 2 ** i for i in range(3)]
+    print(f"   Ritardi: {delays} (attesi {expected}), chiamate: {client.calls}")
+    if delays != expected:
+        print("   ❌ Backoff non applicato")
+        ok = False
+    else:
+        print("   ✅ Backoff esponenziale")
+
+    # 2. 429 con Retry-After: il ritardo rispetta l'header
+    print("\n2️⃣ debug_token con 429 e Retry-After...")
+    delays = await run_loop(FailingClient(429, {"Retry-After": "900"}), 1)
+    print(f"   Ritardi: {delays}")
+    if delays != [900]:
+        print("   ❌ Retry-After ignorato")
+        ok = False
+    else:
+        print("   ✅ Retry-After rispettato")
+
+    # 3. 5xx: stesso trattamento dell'errore di rete
+    print("\n3️⃣ debug_token con 503...")
+    delays = await run_loop(FailingClient(503), 2)
+    print(f"   Ritardi: {delays}")
+    if delays != expected[:2]:
+        print("   ❌ Backoff non applicato")
+        ok = False
+    else:
+        print("   ✅ Backoff esponenziale")
+
+    print("\n✅ Tutti i test passati!" if ok else "\n❌ Alcuni test falliti")
+    return ok
+
+
+if __name__ == "__main__":
+    try:
+        result = asyncio.run(test_token_refresh_backoff())
+        sys.exit(0 if result else 1)
+    except KeyboardInterrupt:
+        print("\n⚠️  Test interrotto")
+        sys.exit(1)
@@ -0,0 +1,27 @@
+"""
+Verifica completa delle immagini con Pillow.
+
+Modulo separato e leggero (importa solo PIL) così può essere eseguito nei processi
+di un ProcessPoolExecutor senza reimportare l'applicazione Flask.
+"""
+
+from PIL import Image
+
+
+def verify_image(source) -> str:
+    """
+    Legge e verifica l'intero file immagine (CRC/struttura)
+
+    Args:
+        source: Percorso del file oppure oggetto file-like posizionato all'inizio
+
+    Returns:
+        str: Formato rilevato da Pillow
+
+    Raises:
+        Exception: Se l'immagine è corrotta o non riconosciuta
+    """
+    with Image.open(source) as img:
+        image_format = img.format
+        img.verify()
+    return image_format
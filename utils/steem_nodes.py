@@ -0,0 +1,95 @@
+"""
+Parametri dei test nodi Steem, sessione HTTP e cache su disco del nodo più veloce,
+condivisi da utils.steem_request (API Flask) e services.steem_uploader (bot)
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Nodi testati in parallelo con una sola richiesta HTTP (timeout breve)
+MAX_PROBED_NODES = 30
+PROBE_TIMEOUT = 3
+# Con deep_check, get_dynamic_global_properties viene verificato solo sui primi nodi che rispondono
+DEEP_CHECK_NODES = 3
+# Chiamata RPC leggera usata per verificare i nodi con deep_check
+RPC_PROBE_PAYLOAD = {
+    "jsonrpc": "2.0",
+    "method": "condenser_api.get_dynamic_global_properties",
+    "params": [],
+    "id": 1
+}
+# Oltre questa latenza (s) non si attendono altri candidati se un nodo ha già risposto
+GOOD_ENOUGH_LATENCY = 0.5
+
+# La lista dei nodi cambia nell'ordine delle ore
+SERVER_LIST_TTL = 3600
+
+# Cache su disco del nodo più veloce, condivisa tra riavvii e processi (bot e API)
+FASTEST_NODE_CACHE = Path(tempfile.gettempdir()) / "steem_fastest_node.json"
+FASTEST_NODE_TTL = 600
+
+
+def create_http_session() -> requests.Session:
+    """
+    Sessione HTTP condivisa per lista nodi e test dei nodi (connessioni keep-alive riusate).
+    I retry valgono solo per le GET: una HEAD di test che fallisce non viene ripetuta.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        # Un pool per ogni nodo testato (+ lista nodi): tra un test e il successivo le connessioni
+        # keep-alive restano aperte, quindi niente nuova risoluzione DNS né handshake TLS
+        pool_connections=MAX_PROBED_NODES + 1,
+        pool_maxsize=32,
+        max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                          allowed_methods=frozenset(['GET']))
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http_session = create_http_session()
+
+
+def load_cached_node() -> Optional[str]:
+    """Restituisce il nodo più veloce salvato su disco se ancora valido"""
+    try:
+        data = json.loads(FASTEST_NODE_CACHE.read_text())
+        if time.time() - data['measured_at'] < FASTEST_NODE_TTL:
+            return data['node']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_cached_node(node: str, latency: float):
+    """Salva il nodo più veloce su disco (scrittura atomica)"""
+    try:
+        tmp_path = FASTEST_NODE_CACHE.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({
+            'node': node,
+            'measured_at': time.time(),
+            'latency': latency
+        }))
+        os.replace(tmp_path, FASTEST_NODE_CACHE)
+    except OSError as e:
+        logger.debug(f"Impossibile salvare cache nodo Steem: {e}")
+
+
+def invalidate_cached_node():
+    """Elimina la cache del nodo più veloce"""
+    try:
+        FASTEST_NODE_CACHE.unlink()
+    except OSError:
+        pass
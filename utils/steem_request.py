@@ -3,28 +3,74 @@ Modulo semplificato per upload immagini su Steem/Hive blockchain
 Contiene solo le funzionalità necessarie per l'API di upload immagini
 """
 
-from beem import Steem
-from beem.imageuploader import ImageUploader
+import os
+import random
 import requests
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.steem_nodes import (
+    DEEP_CHECK_NODES, FASTEST_NODE_TTL, GOOD_ENOUGH_LATENCY, MAX_PROBED_NODES, PROBE_TIMEOUT,
+    RPC_PROBE_PAYLOAD, SERVER_LIST_TTL, http_session, invalidate_cached_node, load_cached_node,
+    save_cached_node,
+)
+
+# Upload: tentativi su errori di rete transitori, backoff esponenziale con jitter (s)
+UPLOAD_ATTEMPTS = 3
+UPLOAD_RETRY_BASE = 0.5
+UPLOAD_RETRY_MAX = 5
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    ConnectionError, TimeoutError)
 
 
 class SteemNodeTester:
     """Classe per testare e trovare il nodo Steem più veloce"""
 
+    # Lista nodi condivisa tra le istanze (il lock evita download multipli all'avvio)
+    _server_list_cache = {'data': None, 'fetched_at': 0.0}
+    _server_list_lock = threading.Lock()
+
     def __init__(self, mode='irreversible'):
         self.mode = mode
         self.fastest_node = None
+        self.fastest_time = float('inf')
         self.blacklist = set()
+        # test_node/check_rpc girano su più thread durante find_fastest_node
+        self._blacklist_lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        """Thread pool dei test nodi, creato al primo utilizzo e riusato tra le chiamate"""
+        if self._executor is None:
+            # Posti per tutti i test più le verifiche RPC, anche con test lenti ancora in corso
+            self._executor = ThreadPoolExecutor(max_workers=MAX_PROBED_NODES + DEEP_CHECK_NODES,
+                                                thread_name_prefix="steem-probe")
+        return self._executor
+
+    def close(self):
+        """Chiude il thread pool dei test nodi"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
 
     def get_steem_servers(self):
-        """Ottiene lista nodi Steem disponibili"""
+        """Ottiene lista nodi Steem disponibili (in cache per SERVER_LIST_TTL secondi)"""
+        cache = self._server_list_cache
+        with self._server_list_lock:
+            if cache['data'] and time.monotonic() - cache['fetched_at'] < SERVER_LIST_TTL:
+                return cache['data']
+            return self._fetch_steem_servers()
+
+    def _fetch_steem_servers(self):
+        """Scarica la lista nodi e aggiorna la cache"""
         url = "https://steem.senior.workers.dev/"
         try:
-            response = requests.get(url, timeout=10)
+            response = http_session.get(url, timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 steem_servers = data.get('__steem_servers__', [])
+                self._server_list_cache.update(data=steem_servers, fetched_at=time.monotonic())
                 return steem_servers
             else:
                 print(f"Errore richiesta server: {response.status_code}")
@@ -34,43 +80,86 @@ class SteemNodeTester:
             return None
 
     def test_node(self, node):
-        """Testa velocità di un singolo nodo"""
-        if node in self.blacklist:
-            return float('inf')
+        """Misura la latenza di un singolo nodo con una richiesta HEAD"""
+        with self._blacklist_lock:
+            if node in self.blacklist:
+                return float('inf')
 
         try:
-            # Test connessione HTTP
-            response = requests.get(node, timeout=5)
-            if response.status_code != 200:
+            start_time = time.monotonic()
+            response = http_session.head(node, timeout=PROBE_TIMEOUT)
+            response_time = time.monotonic() - start_time
+            if response.status_code >= 500:
                 raise Exception(f"Nodo {node} status {response.status_code}")
 
-            # Test connessione blockchain
-            steem = Steem(node=node)
-            start_time = time.time()
-            steem.get_config()
-            end_time = time.time()
-
-            return end_time - start_time
+            return response_time
 
         except Exception as e:
             print(f"Errore test nodo {node}: {e}")
-            self.blacklist.add(node)
+            with self._blacklist_lock:
+                self.blacklist.add(node)
             return float('inf')
 
-    def find_fastest_node(self):
-        """Trova il nodo più veloce disponibile"""
+    def check_rpc(self, node):
+        """Verifica che il nodo risponda alle RPC (get_dynamic_global_properties, risposta di ~1 KB)"""
+        try:
+            # JSON-RPC diretta: niente costruzione di un client beem per ogni nodo
+            response = http_session.post(node, json=RPC_PROBE_PAYLOAD, timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            if 'head_block_number' not in (response.json().get('result') or {}):
+                raise Exception(f"risposta RPC non valida: {response.text[:100]}")
+            return True
+        except Exception as e:
+            print(f"Errore RPC nodo {node}: {e}")
+            with self._blacklist_lock:
+                self.blacklist.add(node)
+            return False
+
+    def find_fastest_node(self, deep_check=False):
+        """
+        Trova il nodo più veloce disponibile
+
+        Args:
+            deep_check: Se True verifica con get_dynamic_global_properties i primi nodi che rispondono
+        """
         nodes = self.get_steem_servers()
         if not nodes:
             return None
 
-        fastest_time = float('inf')
-        fastest_node = None
+        # Test in parallelo (solo I/O): i primi nodi a rispondere sono i più veloci
+        candidates = nodes[:MAX_PROBED_NODES]
+        wanted = DEEP_CHECK_NODES if deep_check else 1
+        responders = []
+        pool = self._get_executor()
+        futures = {pool.submit(self.test_node, node): node for node in candidates}
+        try:
+            pending = set(futures)
+            start = time.monotonic()
+            while pending and len(responders) < wanted:
+                # Con almeno un nodo valido si attendono altri candidati solo entro GOOD_ENOUGH_LATENCY
+                timeout = None
+                if responders:
+                    timeout = max(0.0, GOOD_ENOUGH_LATENCY - (time.monotonic() - start))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    response_time = future.result()
+                    if response_time < float('inf'):
+                        responders.append((response_time, futures[future]))
+        finally:
+            # I test ancora in coda vengono annullati, quelli in corso terminano entro il loro timeout
+            for future in futures:
+                future.cancel()
+
+        if deep_check and responders:
+            # Verifiche RPC in parallelo: il costo è quello del nodo più lento, non la somma
+            rpc_ok = list(pool.map(self.check_rpc, [node for _, node in responders]))
+            responders = [r for r, ok in zip(responders, rpc_ok) if ok]
 
-        for node in nodes:
-            response_time = self.test_node(node)
-            if response_time < fastest_time:
-                fastest_time = response_time
-                fastest_node = node
+        fastest_time, fastest_node = min(responders, default=(float('inf'), None))
+        if fastest_node:
+            self.fastest_time = fastest_time
 
         self.fastest_node = fastest_node
         return fastest_node
@@ -83,45 +172,143 @@ class Blockchain:
         self.mode = mode
         self.tester = SteemNodeTester()
         self.steem_node = None
+        self._node_updated_at = 0.0
+        # Dopo un errore del nodo il prossimo upload ripete i test (uno solo alla volta)
+        self._node_stale = False
+        self._node_lock = threading.Lock()
+        # ImageUploader per (nodo, username, wif) e per thread (beem non è thread-safe):
+        # ogni thread li riusa finché la generazione non cambia
+        self._local = threading.local()
+        self._uploaders_generation = 0
+        self._uploaders_lock = threading.Lock()
+
+    def _get_uploader(self, username, wif):
+        """Restituisce l'ImageUploader del thread corrente per il nodo attuale, creandolo al primo utilizzo"""
+        local = self._local
+        generation = self._uploaders_generation
+        if getattr(local, 'generation', None) != generation:
+            local.uploaders = {}
+            local.generation = generation
+        key = (self.steem_node, username, wif)
+        uploader = local.uploaders.get(key)
+        if uploader is None:
+            # beem importato solo al primo upload: l'import (crittografia inclusa) è lento
+            from beem import Steem
+            from beem.imageuploader import ImageUploader
+            stm = Steem(keys=[wif], node=self.steem_node, rpcuser=username)
+            uploader = ImageUploader(blockchain_instance=stm)
+            local.uploaders[key] = uploader
+        return uploader
+
+    def _reset_uploaders(self):
+        """Scarta i client Steem di tutti i thread (ricreati al prossimo upload)"""
+        with self._uploaders_lock:
+            self._uploaders_generation += 1
+
+    def close(self):
+        """Rilascia le risorse (thread pool dei test nodi, client Steem)"""
+        self.tester.close()
+        self._reset_uploaders()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def update_node(self, force=False):
+        """
+        Aggiorna al nodo più veloce disponibile
+
+        Args:
+            force: Se True ignora la cache su disco e ripete i test dei nodi
+        """
+        self._node_updated_at = time.monotonic()
+        self._node_stale = False
+        cached = None if force else load_cached_node()
+        if cached:
+            self.steem_node = cached
+            return
 
-    def update_node(self):
-        """Aggiorna al nodo più veloce disponibile"""
         new_node = self.tester.find_fastest_node()
         if new_node:
             self.steem_node = new_node
+            save_cached_node(new_node, self.tester.fastest_time)
             print(f"✅ Nodo aggiornato: {self.steem_node}")
         else:
             print("⚠️ Impossibile trovare nodi disponibili")
             # Fallback a un nodo conosciuto
             self.steem_node = "https://api.steemit.com"
 
-    def steem_upload_image(self, file_path, username, wif):
+    def _needs_node_update(self):
+        """True se il nodo manca, è scaduto (FASTEST_NODE_TTL) o è fallito nell'ultimo upload"""
+        return (self._node_stale or not self.steem_node
+                or time.monotonic() - self._node_updated_at > FASTEST_NODE_TTL)
+
+    def _ensure_node(self):
+        """Aggiorna il nodo se necessario; richieste concorrenti attendono un unico test"""
+        if not self._needs_node_update():
+            return
+        with self._node_lock:
+            if self._needs_node_update():
+                self.update_node(force=self._node_stale)
+
+    def ping_node(self):
+        """
+        Verifica con una RPC leggera che il nodo corrente risponda
+
+        Returns:
+            True se il nodo risponde; altrimenti False e il prossimo upload ripete i test dei nodi
+        """
+        self._ensure_node()
+        if self.tester.check_rpc(self.steem_node):
+            return True
+        self._node_stale = True
+        return False
+
+    @staticmethod
+    def _is_node_error(error):
+        """Errori di rete o RPC del nodo (non credenziali errate o immagine rifiutata)"""
+        return isinstance(error, TRANSIENT_ERRORS) or type(error).__module__.startswith('beemapi')
+
+    @staticmethod
+    def _upload_with_retry(uploader, file_path, username, image_name):
+        """Esegue l'upload ripetendolo su errori di rete transitori (jitter: niente retry sincronizzati)"""
+        for attempt in range(UPLOAD_ATTEMPTS):
+            try:
+                return uploader.upload(file_path, username, image_name=image_name)
+            except TRANSIENT_ERRORS as e:
+                if attempt == UPLOAD_ATTEMPTS - 1:
+                    raise
+                delay = min(UPLOAD_RETRY_MAX, UPLOAD_RETRY_BASE * 2 ** attempt)
+                delay = random.uniform(delay / 2, delay)
+                print(f"⚠️ Errore di rete in upload ({e}), nuovo tentativo tra {delay:.1f}s")
+                time.sleep(delay)
+
+    def steem_upload_image(self, file_path, username, wif, image_name=None):
         """
         Carica un'immagine su Steem blockchain
 
         Args:
-            file_path: Percorso del file da caricare
+            file_path: Percorso del file da caricare (oppure bytes dell'immagine)
             username: Username Steem
             wif: Chiave privata posting
+            image_name: Nome immagine, usato quando file_path sono bytes
 
         Returns:
             URL dell'immagine caricata
         """
-        # Assicurati di avere un nodo valido
-        if not self.steem_node:
-            self.update_node()
+        # Assicurati di avere un nodo valido (rivalutato ogni FASTEST_NODE_TTL secondi)
+        self._ensure_node()
 
         try:
-            print(f"📤 Upload immagine: {file_path}")
+            print(f"📤 Upload immagine: {file_path if isinstance(file_path, str) else image_name}")
             print(f"👤 Username: {username}")
             print(f"🌐 Nodo: {self.steem_node}")
 
-            # Inizializza connessione Steem
-            stm = Steem(keys=[wif], node=self.steem_node, rpcuser=username)
-
-            # Carica immagine
-            uploader = ImageUploader(blockchain_instance=stm)
-            result = uploader.upload(file_path, username)
+            # Carica immagine (client Steem del thread, riusato tra gli upload)
+            uploader = self._get_uploader(username, wif)
+            result = self._upload_with_retry(uploader, file_path, username, image_name)
 
             print("✅ Immagine caricata con successo!")
             print(f"🔗 Risultato: {result}")
@@ -130,4 +317,49 @@ class Blockchain:
 
         except Exception as e:
             print(f"❌ Errore upload: {e}")
-            raise Exception(f"Upload fallito: {e}")
\ No newline at end of file
+            if self._is_node_error(e):
+                # Nodo degradato: nuovo client e nuovo test al prossimo upload, non in questa richiesta
+                self._reset_uploaders()
+                invalidate_cached_node()
+                self._node_stale = True
+            raise Exception(f"Upload fallito: {e}")
+
+# ==================== WORKER MULTIPROCESSING ====================
+
+# Istanza Blockchain e credenziali del processo worker (impostate dall'initializer del pool)
+_worker_blockchain = None
+_worker_credentials = (None, None)
+
+
+def init_upload_worker(mode='irreversible', username=None, wif=None):
+    """
+    Initializer del pool di processi: crea una Blockchain per worker
+
+    Args:
+        mode: Modalità Blockchain
+        username: Username Steem usato quando upload_in_worker non lo riceve
+        wif: Chiave privata posting, passata una sola volta invece che a ogni upload
+    """
+    global _worker_blockchain, _worker_credentials
+    _worker_blockchain = Blockchain(mode=mode)
+    _worker_credentials = (username, wif)
+
+
+def upload_in_worker(file_path, username=None, wif=None, image_name=None):
+    """
+    Esegue steem_upload_image nel processo worker
+
+    Args:
+        file_path: Percorso del file (consigliato, IPC minimo) oppure bytes dell'immagine
+        username: Username Steem (default: quello dell'initializer)
+        wif: Chiave privata posting (default: quella dell'initializer)
+        image_name: Nome immagine, usato quando file_path sono bytes
+
+    Returns:
+        Risultato dell'upload
+    """
+    if _worker_blockchain is None:
+        init_upload_worker()
+    return _worker_blockchain.steem_upload_image(
+        file_path, username or _worker_credentials[0], wif or _worker_credentials[1], image_name=image_name
+    )
@@ -0,0 +1,51 @@
+"""
+Cache in memoria LRU con scadenza, thread-safe.
+
+Usata per le risposte della Graph API che cambiano raramente (info account, shortcode).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """Cache LRU con scadenza per voce"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        Args:
+            maxsize: Numero massimo di voci (oltre viene scartata la meno recente)
+            ttl: Durata di ogni voce in secondi
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Restituisce il valore in cache o None se assente/scaduto"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if time.monotonic() > expires:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        """Salva il valore, scartando la voce meno recente oltre maxsize"""
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        """Svuota la cache"""
+        with self._lock:
+            self._items.clear()